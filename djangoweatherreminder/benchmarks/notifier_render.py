@@ -0,0 +1,89 @@
+"""
+Benchmark: building the report emails of a notification run, rendered per subscription vs once per city.
+
+Builds a synthetic run in memory (no database or SMTP involved) and prints a JSON report. Run from the
+directory with manage.py:
+
+    DJANGO_SETTINGS_MODULE=djangoweatherreminder.settings python -m benchmarks.notifier_render --subscriptions 100000
+"""
+import argparse
+import json
+import time
+
+from .common import setup_django
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--subscriptions', type=int, default=100_000)
+    parser.add_argument('--cities', type=int, default=2_000)
+    return parser.parse_args()
+
+
+def synthetic_run(subscriptions_count, cities_count):
+    from django.contrib.auth import get_user_model
+    from django.utils import timezone
+
+    from weather.models import CityName, UserSubscription
+    from weather.owm import parse_weather
+    from weather.testing import fake_weather
+
+    cities = [CityName(pk=i, name=f"city-{i}", state='', country_code='UA') for i in range(1, cities_count + 1)]
+    now = timezone.now().isoformat()
+    snapshots = {city.pk: {'id': city.pk, 'city': city.pk, 'last_info_update': now,
+                           **parse_weather(fake_weather(city.name))} for city in cities}
+    subscriptions = []
+    for i in range(1, subscriptions_count + 1):
+        city = cities[i % cities_count]
+        subscription = UserSubscription(pk=i, city=city, notification_frequency=1,
+                                        user=get_user_model()(pk=i, email=f"user-{i}@example.com"))
+        subscriptions.append(subscription)
+    return subscriptions, snapshots
+
+
+def render_per_subscription(subscriptions, snapshots):
+    """The notifier before reports were shared: one template render per subscription."""
+    from django.template.loader import render_to_string
+
+    from weather.serializers import CityNameSerializer
+    from weather.tasks import REPORT_TEMPLATE, build_report_email
+
+    messages = []
+    for subscription in subscriptions:
+        weather_data = dict(snapshots[subscription.city_id])
+        for field in ('id', 'city', 'last_info_update'):
+            del weather_data[field]
+        email_body = render_to_string(REPORT_TEMPLATE, {
+            'weather_data': weather_data,
+            'city_data': CityNameSerializer(subscription.city).data,
+        })
+        messages.append(build_report_email(email_body, subscription.user))
+    return messages
+
+
+def timed(function, *args):
+    started = time.perf_counter()
+    function(*args)
+    return round(time.perf_counter() - started, 3)
+
+
+def main():
+    args = parse_args()
+    setup_django()
+
+    from weather.tasks import build_report_emails
+
+    subscriptions, snapshots = synthetic_run(args.subscriptions, args.cities)
+    per_subscription = timed(render_per_subscription, subscriptions, snapshots)
+    per_city = timed(build_report_emails, subscriptions, snapshots)
+    print(json.dumps({
+        'subscriptions': args.subscriptions,
+        'cities': args.cities,
+        'per_subscription_seconds': per_subscription,
+        'per_city_seconds': per_city,
+        'speedup': round(per_subscription / per_city, 1),
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
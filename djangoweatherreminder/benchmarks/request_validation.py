@@ -0,0 +1,91 @@
+"""
+Microbenchmark: per-request CPU time and queries of request validation, serializers vs precompiled schemas.
+
+"serializers" is the validation the subscription and registration views used to run: ModelSerializers
+built per request, with primary key lookups and a UniqueValidator query. "schemas" is the weather.validation
+path they run now. Runs against a throwaway test database and prints a JSON report. Run from the directory
+with manage.py:
+
+    DJANGO_SETTINGS_MODULE=djangoweatherreminder.settings python -m benchmarks.request_validation
+"""
+import argparse
+import json
+import time
+
+from .common import setup_django, test_database
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--iterations', type=int, default=2_000)
+    return parser.parse_args()
+
+
+def measure(function, iterations):
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+
+    with CaptureQueriesContext(connection) as captured:
+        function()
+    started = time.process_time()
+    for _ in range(iterations):
+        function()
+    return {
+        'cpu_us_per_request': round((time.process_time() - started) / iterations * 1e6, 1),
+        'queries_per_request': len(captured.captured_queries),
+    }
+
+
+def main():
+    args = parse_args()
+    setup_django()
+
+    from django.contrib.auth import get_user_model
+
+    from users.serializers import RegistrationSerializer
+    from users.views import REGISTRATION_SCHEMA
+    from weather.models import CityName, CityWeather
+    from weather.serializers import CityNameSerializer, UserSubscriptionSerializer
+    from weather.validation import NEW_SUBSCRIPTION_SCHEMA
+
+    with test_database():
+        user = get_user_model().objects.create(email='bench@example.com')
+        city = CityName.objects.create(name='Kyiv', state='', country_code='UA')
+        city_weather = CityWeather.objects.create(city=city, weather_description='clear sky', temperature=0,
+                                                  feels_like=0, humidity=0, pressure=0, visibility=0,
+                                                  wind_speed=0, clouds=0, rain=0, snow=0)
+        subscription_body = json.dumps({'city': {'name': 'Kyiv', 'state': '', 'country_code': 'UA'},
+                                        'notification_frequency': 2})
+        registration_body = json.dumps({'email': 'new_user@example.com', 'password': 'example_pwd_1!',
+                                        'password2': 'example_pwd_1!'})
+
+        def subscription_serializers():
+            request_body = json.loads(subscription_body)
+            assert CityNameSerializer(data=request_body['city']).is_valid()
+            assert UserSubscriptionSerializer(data={
+                'user': user.pk, 'city': city.pk, 'weather_info': city_weather.pk,
+                'notification_frequency': request_body['notification_frequency'],
+            }).is_valid()
+
+        def subscription_schemas():
+            assert not NEW_SUBSCRIPTION_SCHEMA.validate(json.loads(subscription_body))[1]
+
+        def registration_serializers():
+            assert RegistrationSerializer(data=json.loads(registration_body)).is_valid()
+
+        def registration_schemas():
+            assert not REGISTRATION_SCHEMA.validate(json.loads(registration_body))[1]
+
+        report = {
+            'iterations': args.iterations,
+            'new_subscription': {'serializers': measure(subscription_serializers, args.iterations),
+                                 'schemas': measure(subscription_schemas, args.iterations)},
+            'registration': {'serializers': measure(registration_serializers, args.iterations),
+                             'schemas': measure(registration_schemas, args.iterations)},
+        }
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
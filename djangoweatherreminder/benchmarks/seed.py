@@ -0,0 +1,56 @@
+"""
+Synthetic data for the benchmarks: users, cities with current weather and subscriptions that are all due.
+"""
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.utils import timezone
+
+from weather.managers import make_city_key
+from weather.models import CityName, CityWeather, UserSubscription
+from weather.owm import parse_weather
+from weather.persistence import BULK_BATCH_SIZE, clean_weather
+from weather.testing import fake_weather
+
+SUBSCRIPTIONS_PER_USER = 5
+SUBSCRIPTIONS_PER_CITY = 50
+
+
+def seed(subscriptions, owm_stub=None):
+    """
+    Create `subscriptions` subscriptions, SUBSCRIPTIONS_PER_USER per user and about SUBSCRIPTIONS_PER_CITY
+    per city, every one of them due now. Cities get the OWM id of their fake weather and are registered
+    with `owm_stub`, so the refresh can fetch them by id. Returns the counts of created rows.
+    """
+    users_count = max(1, subscriptions // SUBSCRIPTIONS_PER_USER)
+    cities_count = max(SUBSCRIPTIONS_PER_USER, subscriptions // SUBSCRIPTIONS_PER_CITY)
+    password = make_password(None)
+    get_user_model().objects.bulk_create(
+        [get_user_model()(email=f"user-{i}@example.com", password=password) for i in range(users_count)],
+        batch_size=BULK_BATCH_SIZE)
+
+    cities = []
+    for i in range(cities_count):
+        name = f"City {i}"
+        weather = fake_weather(name)
+        if owm_stub is not None:
+            owm_stub.add_city(name)
+        cities.append(CityName(name=name, state='', country_code='UA', key=make_city_key(name, '', 'UA'),
+                               owm_id=weather['id'], latitude=weather['coord']['lat'],
+                               longitude=weather['coord']['lon']))
+    CityName.objects.bulk_create(cities, batch_size=BULK_BATCH_SIZE)
+    cities = list(CityName.objects.order_by('pk'))
+    CityWeather.objects.bulk_create(
+        [CityWeather(city=city, **clean_weather(parse_weather(fake_weather(city.name)))) for city in cities],
+        batch_size=BULK_BATCH_SIZE)
+
+    # read the rows back: not every backend returns primary keys from bulk_create
+    users = list(get_user_model().objects.order_by('pk'))
+    city_weathers = list(CityWeather.objects.order_by('city_id'))
+    now = timezone.now()
+    UserSubscription.objects.bulk_create(
+        [UserSubscription(user=users[i // SUBSCRIPTIONS_PER_USER], city=cities[i % cities_count],
+                          weather_info=city_weathers[i % cities_count], notification_frequency=(1, 3, 6, 12)[i % 4],
+                          next_notification_at=now)
+         for i in range(users_count * SUBSCRIPTIONS_PER_USER)],
+        batch_size=BULK_BATCH_SIZE)
+    return {'users': users_count, 'cities': cities_count, 'subscriptions': users_count * SUBSCRIPTIONS_PER_USER}
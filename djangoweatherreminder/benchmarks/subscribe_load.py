@@ -0,0 +1,124 @@
+"""
+Load test: throughput of the sync and async subscribe endpoints under the ASGI server.
+
+Starts the OWM stub with a configurable latency, serves the project with uvicorn against it and fires
+`--requests` new-subscription requests at each endpoint, `--concurrency` at a time. Every request subscribes to
+a city nobody asked for before, so each one waits for an OWM lookup. Prints a JSON report.
+
+Run from the directory with manage.py, with the settings (and database) the server should use:
+
+    DJANGO_SETTINGS_MODULE=djangoweatherreminder.settings python -m benchmarks.subscribe_load --requests 500
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+import uuid
+
+import httpx
+
+from .common import setup_django
+
+ENDPOINTS = {
+    'sync': '/api/v1/subscriptions/new/',
+    'async': '/api/v1/async/subscriptions/new/',
+}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--requests', type=int, default=200, help='requests per endpoint')
+    parser.add_argument('--concurrency', type=int, default=100, help='requests in flight at once')
+    parser.add_argument('--owm-latency', type=float, default=0.2, help='seconds the OWM stub takes per call')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--workers', type=int, default=1, help='uvicorn worker processes')
+    parser.add_argument('--endpoints', nargs='+', choices=ENDPOINTS, default=list(ENDPOINTS))
+    return parser.parse_args()
+
+
+def start_server(args, owm_url):
+    env = dict(os.environ, OWM_API_URL=owm_url, OWM_RATE_LIMIT='100000', OWM_RATE_BURST='100000',
+               OWM_ASYNC_MAX_CONNECTIONS=str(args.concurrency))
+    server = subprocess.Popen([sys.executable, '-m', 'uvicorn', 'djangoweatherreminder.asgi:application',
+                               '--port', str(args.port), '--workers', str(args.workers), '--log-level', 'warning'],
+                              env=env)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            httpx.get(f"http://127.0.0.1:{args.port}/api/v1/schema/", timeout=1)
+            return server
+        except httpx.TransportError:
+            time.sleep(0.2)
+    server.terminate()
+    raise RuntimeError("the ASGI server did not start")
+
+
+async def run_load(base_url, path, token, args):
+    run = uuid.uuid4().hex[:8]
+    semaphore = asyncio.Semaphore(args.concurrency)
+    latencies = []
+    statuses = {}
+    limits = httpx.Limits(max_connections=args.concurrency)
+
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=120,
+                                 headers={'Authorization': f"Bearer {token}"}) as client:
+        async def subscribe(index):
+            data = {'city': {'name': f"Loadtown {run} {index}", 'state': '', 'country_code': 'UA'},
+                    'notification_frequency': 2}
+            async with semaphore:
+                started = time.monotonic()
+                response = await client.post(path, json=data)
+                latencies.append(time.monotonic() - started)
+                statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+        started = time.monotonic()
+        await asyncio.gather(*(subscribe(index) for index in range(args.requests)))
+        elapsed = time.monotonic() - started
+
+    latencies.sort()
+    return {
+        'requests': args.requests,
+        'statuses': statuses,
+        'seconds': round(elapsed, 3),
+        'requests_per_second': round(args.requests / elapsed, 1),
+        'latency_p50': round(statistics.median(latencies), 3),
+        'latency_p95': round(latencies[int(len(latencies) * 0.95) - 1], 3),
+    }
+
+
+def main():
+    args = parse_args()
+    setup_django()
+
+    from django.contrib.auth import get_user_model
+    from rest_framework_simplejwt.tokens import RefreshToken
+
+    from weather.models import UserSubscription
+    from weather.tasks import delete_unused_cities
+    from weather.testing import OWMStubServer
+
+    user, _ = get_user_model().objects.get_or_create(email='loadtest@example.com')
+    token = str(RefreshToken.for_user(user).access_token)
+    report = {'owm_latency': args.owm_latency, 'concurrency': args.concurrency, 'workers': args.workers}
+
+    with OWMStubServer(delay=args.owm_latency) as owm:
+        server = start_server(args, owm.url)
+        try:
+            for name in args.endpoints:
+                report[name] = asyncio.run(run_load(f"http://127.0.0.1:{args.port}", ENDPOINTS[name], token, args))
+                UserSubscription.objects.filter(user=user).delete()
+                delete_unused_cities()
+        finally:
+            server.terminate()
+            server.wait()
+            user.delete()
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
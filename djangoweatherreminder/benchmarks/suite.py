@@ -0,0 +1,162 @@
+"""
+Benchmark suite: the hourly pipeline and the subscription endpoints at several data scales.
+
+For every scale a throwaway test database is seeded with that many subscriptions (see benchmarks.seed), OWM
+and SMTP are served by local stubs, and the suite times update_weather_table, update_subscriptions_table and
+the subscription endpoints, counting the queries each one runs. Endpoint timings are the median of
+`--repeat` requests. Results are JSON, tagged with the git revision and database, so runs of different
+commits can be compared. Run from the directory with manage.py:
+
+    DJANGO_SETTINGS_MODULE=djangoweatherreminder.settings python -m benchmarks.suite --scales 1000 10000 100000 \
+        --output results.json
+"""
+import argparse
+import json
+import logging
+import statistics
+import time
+
+from .common import git_revision, setup_django, test_database
+
+BULK_SIZE = 20
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--scales', type=int, nargs='+', default=[1_000, 10_000, 100_000],
+                        help='numbers of subscriptions to seed')
+    parser.add_argument('--repeat', type=int, default=20, help='requests per endpoint')
+    parser.add_argument('--output', help='write the JSON report to this file instead of stdout')
+    return parser.parse_args()
+
+
+def measure(function):
+    """Run `function` once; returns its result, wall time and query count."""
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+
+    with CaptureQueriesContext(connection) as captured:
+        started = time.perf_counter()
+        result = function()
+        seconds = time.perf_counter() - started
+    return result, {'seconds': round(seconds, 4), 'queries': len(captured.captured_queries)}
+
+
+def measure_requests(request, repeat):
+    """Call `request(i)` `repeat` times; latency median and maximum, and the most queries any call ran."""
+    timings = []
+    statuses = set()
+    for i in range(repeat):
+        response, timing = measure(lambda: request(i))
+        statuses.add(response.status_code)
+        timings.append(timing)
+    return {
+        'median_ms': round(statistics.median(timing['seconds'] for timing in timings) * 1000, 2),
+        'max_ms': round(max(timing['seconds'] for timing in timings) * 1000, 2),
+        'queries': max(timing['queries'] for timing in timings),
+        'statuses': sorted(statuses),
+    }
+
+
+def run_pipeline(owm, smtp):
+    from weather.tasks import update_subscriptions_table, update_weather_table
+
+    owm.reset()
+    smtp.messages = 0
+    weather_report, weather = measure(update_weather_table)
+    subscriptions_report, subscriptions = measure(update_subscriptions_table)
+    weather.update(owm_requests=len(owm.requests), cities=weather_report['cities'],
+                   fetched=weather_report['fetched'])
+    subscriptions.update(emails=smtp.messages, failed=subscriptions_report['failed'],
+                         rendered=subscriptions_report['rendered'])
+    return {'update_weather_table': weather, 'update_subscriptions_table': subscriptions}
+
+
+def run_endpoints(repeat):
+    from django.contrib.auth import get_user_model
+    from django.urls import reverse
+    from rest_framework.test import APIClient
+
+    from weather.models import UserSubscription
+
+    user = get_user_model().objects.order_by('pk').first()
+    client = APIClient()
+    client.force_authenticate(user=user)
+    subscription = UserSubscription.objects.filter(user=user).select_related('city').first()
+    city_data = {'name': subscription.city.name, 'state': '', 'country_code': subscription.city.country_code}
+
+    def new_subscription(i):
+        return client.post(reverse('new_subscription'), {
+            'city': {'name': f"Bench New {i}", 'state': '', 'country_code': 'UA'}, 'notification_frequency': 2,
+        }, format='json')
+
+    def bulk_subscriptions(i):
+        return client.post(reverse('bulk_subscriptions'), {'subscriptions': [
+            {'city': {'name': f"Bench Bulk {i} {j}", 'state': '', 'country_code': 'UA'}, 'notification_frequency': 3}
+            for j in range(BULK_SIZE)
+        ]}, format='json')
+
+    results = {
+        'list': measure_requests(
+            lambda i: client.get(reverse('subscriptions_list'), {'include': 'weather'}), repeat),
+        'new': measure_requests(new_subscription, repeat),
+        'edit': measure_requests(lambda i: client.put(
+            reverse('subscription_action', kwargs={'id': subscription.pk}),
+            {'city': city_data, 'notification_frequency': i % 12 + 1}, format='json'), repeat),
+        'bulk_new': measure_requests(bulk_subscriptions, repeat),
+    }
+    # delete the subscriptions created above, one per request
+    ids = list(UserSubscription.objects.filter(user=user, city__name__startswith='Bench New ')
+               .values_list('pk', flat=True))
+    results['delete'] = measure_requests(
+        lambda i: client.delete(reverse('subscription_action', kwargs={'id': ids[i]})), min(repeat, len(ids)))
+    return results
+
+
+def main():
+    args = parse_args()
+    setup_django()
+
+    from django.core.management import call_command
+    from django.db import connection
+    from django.test.utils import override_settings
+
+    from weather import resilience
+    from weather.cache import get_cache
+    from weather.testing import OWMStubServer, SMTPStubServer
+
+    from .seed import seed
+
+    # one log line per request and task would drown the report
+    logging.getLogger('weather.instrumentation').setLevel(logging.WARNING)
+
+    with OWMStubServer() as owm, SMTPStubServer() as smtp, test_database():
+        report = {'revision': git_revision(), 'database': connection.vendor, 'repeat': args.repeat, 'scales': {}}
+        with override_settings(OWM_API_URL=owm.url, OWM_RATE_LIMIT_BACKEND='local', OWM_RATE_LIMIT=100_000,
+                               OWM_RATE_BURST=100_000, EMAIL_BACKEND='django.core.mail.backends.smtp.EmailBackend',
+                               EMAIL_HOST=smtp.host, EMAIL_PORT=smtp.port, EMAIL_USE_TLS=False,
+                               EMAIL_HOST_USER='', EMAIL_HOST_PASSWORD=''):
+            for scale in args.scales:
+                call_command('flush', interactive=False, verbosity=0)
+                get_cache().clear()
+                resilience.reset()
+                started = time.perf_counter()
+                rows = seed(scale, owm)
+                report['scales'][scale] = {
+                    'rows': rows,
+                    'seed_seconds': round(time.perf_counter() - started, 2),
+                    'pipeline': run_pipeline(owm, smtp),
+                    'endpoints': run_endpoints(args.repeat),
+                }
+        resilience.reset()
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -57,6 +57,7 @@ INSTALLED_APPS = [
 AUTH_USER_MODEL = 'users.CustomUser'
 
 MIDDLEWARE = [
+    'weather.instrumentation.InstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -93,6 +94,10 @@ REST_FRAMEWORK = {
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
 }
 
+SUBSCRIPTIONS_PAGE_SIZE = 50
+SUBSCRIPTIONS_MAX_PAGE_SIZE = 500
+BULK_SUBSCRIPTIONS_MAX = 100  # items per bulk subscriptions request
+
 SPECTACULAR_SETTINGS = {
     'TITLE': 'WeatherReminder API',
     'DESCRIPTION': 'A service of weather notification.</br>'
@@ -166,6 +171,36 @@ import dj_database_url
 
 db_from_env = dj_database_url.config(conn_max_age=600)
 DATABASES['default'].update(db_from_env)
+
+# Cache
+# https://docs.djangoproject.com/en/4.1/topics/cache/
+
+WEATHER_CACHE_ALIAS = 'weather'
+WEATHER_CACHE_TTL = int(os.environ.get('WEATHER_CACHE_TTL', 600))  # seconds
+WEATHER_CACHE_MAX_ENTRIES = int(os.environ.get('WEATHER_CACHE_MAX_ENTRIES', 5000))
+WEATHER_CACHE_LEASE = 5  # seconds other processes wait for an in-flight fetch of the same city
+WEATHER_SNAPSHOT_TTL = 2 * 60 * 60  # seconds; the hourly refresh rewrites the snapshots of the cities it updates
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # LocMemCache evicts least recently used entries past MAX_ENTRIES; configure Redis with an allkeys-lru policy
+    WEATHER_CACHE_ALIAS: {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'weather',
+        'TIMEOUT': WEATHER_CACHE_TTL,
+        'OPTIONS': {'MAX_ENTRIES': WEATHER_CACHE_MAX_ENTRIES},
+    },
+}
+
+if os.environ.get('REDIS_URL'):
+    CACHES[WEATHER_CACHE_ALIAS] = {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.environ.get('REDIS_URL'),
+        'TIMEOUT': WEATHER_CACHE_TTL,
+    }
+
 # Password validation
 # https://docs.djangoproject.com/en/4.1/ref/settings/#auth-password-validators
 
@@ -207,6 +242,7 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 CELERY_BROKER_URL = 'pyamqp://localhost'
 CELERY_RESULT_BACKEND = 'rpc://localhost'
+CELERY_TASK_ALWAYS_EAGER = os.environ.get('CELERY_TASK_ALWAYS_EAGER') == 'True'  # run tasks inline, for local testing
 
 CELERY_BEAT_SCHEDULE = {
     'update-tables-and-send-emails': {
@@ -215,6 +251,28 @@ CELERY_BEAT_SCHEDULE = {
     },
 }
 
+# A new city within this distance of a known one (km) resolves to it and shares its weather
+CITY_MATCH_RADIUS_KM = float(os.environ.get('CITY_MATCH_RADIUS_KM', 5))
+
+# Remove cities nobody is subscribed to from a periodic task instead of on every edit/delete request
+CITY_CLEANUP_DEFERRED = os.environ.get('CITY_CLEANUP_DEFERRED') == 'True'
+
+if CITY_CLEANUP_DEFERRED:
+    CELERY_BEAT_SCHEDULE['remove-unused-cities'] = {
+        'task': 'weather.tasks.remove_unused_cities',
+        'schedule': crontab(minute='*/15'),
+    }
+
+CELERY_BEAT_SCHEDULE['retry-notifications'] = {
+    'task': 'weather.tasks.retry_notifications',
+    'schedule': crontab(minute='*/10'),
+}
+
+CELERY_BEAT_SCHEDULE['compact-weather-history'] = {
+    'task': 'weather.tasks.compact_weather_history',
+    'schedule': crontab(hour=3, minute=30),
+}
+
 # CLOUDAMQP settings
 broker_url = os.environ.get('CLOUDAMQP_URL')
 broker_pool_limit = 1  # Will decrease connection usage
@@ -227,7 +285,42 @@ worker_concurrency = 50  # If you tasks are CPU bound,then limit to the number o
 
 # worker_send_task_events = True
 
-
+# Hourly job fan-out
+WEATHER_SHARD_SIZE = int(os.environ.get('WEATHER_SHARD_SIZE', 200))  # cities per refresh subtask
+NOTIFICATION_SHARD_SIZE = int(os.environ.get('NOTIFICATION_SHARD_SIZE', 500))  # subscriptions per email subtask
+# seconds; weather older than this is refetched before a report goes out, cities with nobody due are skipped
+WEATHER_MAX_AGE = int(os.environ.get('WEATHER_MAX_AGE', 45 * 60))
+
+# Weather history: raw readings are rolled into hourly averages, hourly averages into daily ones, which are kept
+WEATHER_HISTORY_RAW_DAYS = int(os.environ.get('WEATHER_HISTORY_RAW_DAYS', 7))
+WEATHER_HISTORY_HOURLY_DAYS = int(os.environ.get('WEATHER_HISTORY_HOURLY_DAYS', 90))
+WEATHER_HISTORY_MAX_POINTS = 2000  # per history request
+# subscriptions notified this many hours apart or more get a digest of the weather since their last report
+DIGEST_MIN_FREQUENCY = 24
+DIGEST_CACHE_TTL = 60 * 60  # seconds
+ALERT_RULES_PER_SUBSCRIPTION = 10
+
+# Notification outbox
+NOTIFICATION_MAX_ATTEMPTS = 3  # deliveries of one report before it is marked failed
+NOTIFICATION_RETRY_AFTER = 10 * 60  # seconds a report may stay pending or sending before the retry task takes it
+NOTIFICATION_RETENTION_DAYS = 30  # delivered reports are kept this long for delivery stats
+
+# OpenWeatherMap settings
+OWM_API_URL = os.environ.get('OWM_API_URL', 'https://api.openweathermap.org/data/2.5')
+OWM_TOKEN = os.environ.get('OWM_TOKEN')
+OWM_FETCH_CONCURRENCY = int(os.environ.get('OWM_FETCH_CONCURRENCY', 10))  # parallel requests per refresh run
+OWM_ASYNC_MAX_CONNECTIONS = int(os.environ.get('OWM_ASYNC_MAX_CONNECTIONS', 100))  # per ASGI worker process
+OWM_GROUP_SIZE = 20  # city ids per call to the group endpoint, the OWM maximum
+OWM_TIMEOUT = (3.05, 10)  # connect and read timeouts, seconds
+OWM_RETRIES = 2
+OWM_BACKOFF = 0.5  # seconds, base of the jittered exponential backoff
+OWM_RATE_LIMIT = float(os.environ.get('OWM_RATE_LIMIT', 10))  # requests per second
+OWM_RATE_BURST = int(os.environ.get('OWM_RATE_BURST', 20))
+# 'redis' shares one limiter between all processes, 'local' limits every process on its own
+OWM_RATE_LIMIT_BACKEND = 'redis' if os.environ.get('REDIS_URL') else 'local'
+OWM_RATE_LIMIT_REDIS_URL = os.environ.get('REDIS_URL')
+OWM_BREAKER_THRESHOLD = 5  # consecutive failed calls that open the circuit
+OWM_BREAKER_RESET_TIMEOUT = 60  # seconds before a trial call is let through
 
 # Email settings
 EMAIL_HOST = 'smtp.gmail.com'
@@ -236,4 +329,25 @@ EMAIL_HOST_USER = os.environ.get('EMAIL_HOST_USER')
 EMAIL_HOST_PASSWORD = os.environ.get('APP_PASSWORD')
 EMAIL_PORT = 587
 EMAIL_USE_TLS = True
+EMAIL_BATCH_SIZE = int(os.environ.get('EMAIL_BATCH_SIZE', 100))  # messages per send_messages call
+EMAIL_SEND_RETRIES = 3
+EMAIL_RETRY_BACKOFF = 1  # seconds, doubled on every retry
 
+
+# Instrumentation: Prometheus metrics at /metrics and one JSON log line per request and task
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')  # if set, /metrics requires "Authorization: Bearer <token>"
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'weather.instrumentation': {
+            'handlers': ['console'],
+            'level': os.environ.get('INSTRUMENTATION_LOG_LEVEL', 'INFO'),
+            'propagate': False,
+        },
+    },
+}
@@ -40,3 +40,34 @@ def test_delete_account(api_client_with_authenticated_user):
     assert response.status_code == 200
     response_json = json.loads(response.content)
     assert response_json['result'] == 'user deleted'
+
+
+@pytest.mark.django_db
+def test_registration_duplicate_email_rejected_by_constraint(api_client, create_user, django_assert_max_num_queries):
+    create_user(email='test_user@example.com')
+    url = reverse('register')
+    data = {
+        "email": "test_user@example.com",
+        "password": "example_pwd_1!",
+        "password2": "example_pwd_1!"
+    }
+
+    with django_assert_max_num_queries(4) as captured:  # the INSERT and its savepoint
+        response = api_client.post(url, data, format='json')
+
+    assert response.status_code == 400
+    assert response.json()['error'] == {'email': ['This field must be unique.']}
+    assert not [query for query in captured.captured_queries if query['sql'].startswith('SELECT')]
+
+
+@pytest.mark.django_db
+def test_registration_password_mismatch(api_client):
+    url = reverse('register')
+    data = {
+        "email": "test_user@example.com",
+        "password": "example_pwd_1!",
+        "password2": "example_pwd_2!"
+    }
+    response = api_client.post(url, data, format='json')
+    assert response.status_code == 400
+    assert response.json()['error'] == {'password': ["Password fields didn't match."]}
@@ -1,14 +1,21 @@
-import json
-
-from rest_framework import status
+from django.contrib.auth.password_validation import validate_password
+from django.db import IntegrityError, transaction
+from rest_framework import serializers, status
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from drf_spectacular.utils import extend_schema
 
+from weather.validation import Schema
 from .serializers import RegistrationSerializer
 from .models import CustomUser
 
+REGISTRATION_SCHEMA = Schema(
+    email=serializers.EmailField(),
+    password=serializers.CharField(validators=[validate_password]),
+    password2=serializers.CharField(),
+)
+
 
 class RegistrationView(APIView):
     queryset = CustomUser.objects.all()
@@ -19,17 +26,24 @@ class RegistrationView(APIView):
                                '"password2" parameter',
                    tags=['auth'], )
     def post(self, request):
-        request_body = json.loads(request.body)
-        serializer = RegistrationSerializer(data=request_body)
-        if serializer.is_valid():
-            account = serializer.save()
-            account.is_active = True
-            account.save()
-            return Response({'res': 'Registered successfully',
-                             'user info': serializer.data}, status=status.HTTP_201_CREATED)
-        else:
-            return Response({'error': serializer.errors},
+        data, errors = REGISTRATION_SCHEMA.validate(request.data)
+        if not errors and data['password'] != data['password2']:
+            errors = {'password': ["Password fields didn't match."]}
+        if errors:
+            return Response({'error': errors},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        account = CustomUser(email=data['email'], is_active=True)
+        account.set_password(data['password'])
+        try:
+            # the unique constraint on email rejects duplicates, no need to look them up first
+            with transaction.atomic():
+                account.save()
+        except IntegrityError:
+            return Response({'error': {'email': ['This field must be unique.']}},
                             status=status.HTTP_400_BAD_REQUEST)
+        return Response({'res': 'Registered successfully',
+                         'user info': {'email': account.email}}, status=status.HTTP_201_CREATED)
 
 
 class DeleteAccount(APIView):
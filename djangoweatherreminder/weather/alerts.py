@@ -0,0 +1,42 @@
+from functools import reduce
+from operator import or_
+
+from django.db import transaction
+from django.db.models import F, Q
+
+from .models import AlertRule
+
+
+def matches(field):
+    """Condition on AlertRule rows of `field`: the current weather of the subscribed city meets the rule."""
+    weather_field = f'subscription__weather_info__{field}'
+    return reduce(or_, (Q(operator=operator, **{f'{weather_field}__{operator}': F('threshold')})
+                        for operator, _ in AlertRule.OPERATORS))
+
+
+def evaluate_alerts(city_weather_ids, now):
+    """
+    Evaluate the alert rules of the subscriptions to these cities against their current weather.
+
+    Rules are matched in the database, one query per weather field that has rules, joining the rules to the
+    weather of their subscriptions. A rule triggers when its condition starts to hold and stays quiet until the
+    weather stops matching it. Returns the ids of the rules triggered now.
+    """
+    rules = AlertRule.objects.filter(subscription__weather_info__in=city_weather_ids)
+    fields = list(rules.values_list('field', flat=True).distinct().order_by())
+    if not fields:
+        return []
+
+    matched = []
+    triggered = []
+    for field in fields:
+        for rule_id, was_matching in rules.filter(matches(field), field=field).values_list('pk', 'matching'):
+            matched.append(rule_id)
+            if not was_matching:
+                triggered.append(rule_id)
+
+    with transaction.atomic():
+        if triggered:
+            AlertRule.objects.filter(pk__in=triggered).update(matching=True, last_triggered_at=now)
+        rules.filter(matching=True).exclude(pk__in=matched).update(matching=False)
+    return triggered
@@ -4,3 +4,15 @@ from django.apps import AppConfig
 class WeatherConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'weather'
+
+    def ready(self):
+        from celery.signals import task_postrun, task_prerun
+        from django.db.backends.signals import connection_created
+        from prometheus_client import REGISTRY
+
+        from . import instrumentation
+
+        connection_created.connect(instrumentation.install_query_recorder)
+        task_prerun.connect(instrumentation.task_prerun)
+        task_postrun.connect(instrumentation.task_postrun)
+        REGISTRY.register(instrumentation.ResilienceCollector())
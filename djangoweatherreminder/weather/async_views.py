@@ -0,0 +1,147 @@
+import asyncio
+
+from asgiref.sync import sync_to_async
+from drf_spectacular.utils import extend_schema
+from rest_framework import status
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from .cache import aget_weather_or_snapshot
+from .models import CityName, CityWeather, UserSubscription
+from .persistence import clean_weather
+from .serializers import OneSubscriptionSerializer
+from .validation import EDIT_SUBSCRIPTION_SCHEMA, NEW_SUBSCRIPTION_SCHEMA
+from .views import remove_unused_entries
+
+
+class AsyncAPIView(APIView):
+    """
+    APIView whose handlers are coroutines, for the ASGI server.
+
+    Authentication, permissions and throttling still run synchronously before the handler, in a thread of the
+    default executor rather than the single thread-sensitive one, so slow authentication does not serialize
+    concurrent requests. Handlers get the same request.user and error responses as in the sync views.
+    """
+
+    async def dispatch(self, request, *args, **kwargs):
+        self.args = args
+        self.kwargs = kwargs
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        self.headers = self.default_response_headers
+
+        try:
+            await sync_to_async(self.initial, thread_sensitive=False)(request, *args, **kwargs)
+            if request.method.lower() in self.http_method_names:
+                handler = getattr(self, request.method.lower(), self.http_method_not_allowed)
+            else:
+                handler = self.http_method_not_allowed
+            if asyncio.iscoroutinefunction(handler):
+                response = await handler(request, *args, **kwargs)
+            else:
+                response = await sync_to_async(handler)(request, *args, **kwargs)
+        except Exception as exc:
+            response = self.handle_exception(exc)
+
+        self.response = self.finalize_response(request, response, *args, **kwargs)
+        return self.response
+
+
+def weather_error(weather_data, code, not_found_status):
+    return Response({'error': weather_data['message'], 'code': code},
+                    status=status.HTTP_503_SERVICE_UNAVAILABLE if code == 503 else not_found_status)
+
+
+async def resolve_city(city_data, weather_data):
+    """
+    The CityName and CityWeather for validated city data, creating them from `weather_data` if needed.
+    Raises ValueError if that weather is malformed.
+    """
+    city, _ = await CityName.objects.aresolve(city_data, location=weather_data.get('location'))
+    city_weather, _ = await CityWeather.objects.aget_or_create(city=city, defaults=clean_weather(weather_data))
+    return city, city_weather
+
+
+class AsyncNewSubscriptionView(AsyncAPIView):
+    permission_classes = (IsAuthenticated,)
+    serializer_class = OneSubscriptionSerializer
+
+    @extend_schema(description='### Provide data for a new subscription.</br></br>'
+                               'Same as <em>subscriptions/new/</em>, served without blocking a worker while '
+                               'the city is looked up on OpenWeatherMap.',
+                   tags=['subscriptions'], )
+    async def post(self, request):
+        data, errors = NEW_SUBSCRIPTION_SCHEMA.validate(request.data)
+        if errors:
+            return Response({'errors': errors,
+                             'message': "subscription errors:"},
+                            status=status.HTTP_400_BAD_REQUEST)
+        city_data = data['city']
+
+        weather_data, code = await aget_weather_or_snapshot(city_data)
+        if code != 200:
+            return weather_error(weather_data, code, status.HTTP_404_NOT_FOUND)
+
+        try:
+            subscription_city, subscription_weather = await resolve_city(city_data, weather_data)
+        except ValueError as e:
+            return Response({'error': str(e), 'code': 502}, status=status.HTTP_502_BAD_GATEWAY)
+        if await subscription_city.subscriptions.filter(user=request.user).aexists():
+            return Response({'error': 'You are already subscribed to this city. '
+                                      'Please, edit an existing subscription'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        await UserSubscription.objects.acreate(
+            user=request.user, city=subscription_city, weather_info=subscription_weather,
+            notification_frequency=data['notification_frequency'])
+        return Response({'res': 'New subscription created successfully'}, status=status.HTTP_201_CREATED)
+
+
+class AsyncSubscriptionActionsView(AsyncAPIView):
+    permission_classes = (IsAuthenticated,)
+
+    def get_serializer_class(self):
+        if self.request.method == 'PUT':
+            return OneSubscriptionSerializer
+
+    @extend_schema(description='### Write new updated information about your subscription.</br></br>'
+                               'Same as <em>subscriptions/{id}/</em>, served without blocking a worker while '
+                               'the city is looked up on OpenWeatherMap.',
+                   tags=['subscriptions'], )
+    async def put(self, request, id):
+        subscription = await UserSubscription.objects.filter(id=id, user=request.user).afirst()
+        if subscription is None:
+            return Response({"res": f"Subscription with id={id} does not exist for this user"},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        data, errors = EDIT_SUBSCRIPTION_SCHEMA.validate(request.data)
+        if errors:
+            return Response({'errors': errors,
+                             'message': "subscription errors:"},
+                            status=status.HTTP_400_BAD_REQUEST)
+        city_data = data['city']
+
+        weather_data, code = await aget_weather_or_snapshot(city_data)
+        if code != 200:
+            return weather_error(weather_data, code, status.HTTP_400_BAD_REQUEST)
+
+        # if any field about city has changed, this resolves to another city
+        try:
+            subscription.city, subscription.weather_info = await resolve_city(city_data, weather_data)
+        except ValueError as e:
+            return Response({'error': str(e), 'code': 502}, status=status.HTTP_502_BAD_GATEWAY)
+        subscription.notification_frequency = data.get('notification_frequency', subscription.notification_frequency)
+        await sync_to_async(subscription.save)()
+        await sync_to_async(remove_unused_entries)()  # remove cities that nobody is subscribed for
+        return Response({"res": "Subscription edited"}, status=status.HTTP_200_OK)
+
+    @extend_schema(description='### Specify the id of the subscription you want to delete',
+                   tags=['subscriptions'], )
+    async def delete(self, request, id):
+        deleted, _ = await UserSubscription.objects.filter(id=id, user=request.user).adelete()
+        if not deleted:
+            return Response({"res": f"Subscription with id={id} does not exist for this user"},
+                            status=status.HTTP_404_NOT_FOUND)
+        await sync_to_async(remove_unused_entries)()  # remove cities that nobody is subscribed for
+        return Response({"res": "Subscription deleted"}, status=status.HTTP_200_OK)
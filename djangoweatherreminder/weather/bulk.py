@@ -0,0 +1,190 @@
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .fetcher import fetch_weather_many
+from .geo import haversine_km
+from .managers import make_city_key
+from .models import CityName, CityWeather, UserSubscription
+from .persistence import BULK_BATCH_SIZE, clean_weather
+from .validation import BULK_UPDATE_SCHEMA, NEW_SUBSCRIPTION_SCHEMA
+
+
+def city_key(city_data):
+    return make_city_key(city_data['name'], city_data['state'], city_data['country_code'])
+
+
+def validate_cities(cities_data):
+    """
+    Look up cities by canonical key and validate the ones without stored weather against OWM, concurrently.
+
+    `cities_data` maps a canonical key to city data. Nothing is written here, so the caller's transaction is
+    not held open across network calls. Returns (cities, weathers, errors): known CityName rows by key, cleaned
+    weather for every city that still needs a CityWeather row, and key -> (message, code) for cities OWM
+    rejected. Weather comes with the OWM location of the city.
+    """
+    cities = CityName.objects.in_bulk(list(cities_data), field_name='key')
+    with_weather = set(CityWeather.objects.filter(city__in=cities.values()).values_list('city_id', flat=True))
+    to_fetch = {key: city_data for key, city_data in cities_data.items()
+                if key not in cities or cities[key].pk not in with_weather}
+    results, _ = fetch_weather_many(to_fetch)
+
+    weathers = {}
+    errors = {}
+    for key, (weather_data, code) in results.items():
+        if code != 200:
+            errors[key] = weather_data['message'], code
+            continue
+        try:
+            weathers[key] = clean_weather(weather_data), weather_data.get('location', {})
+        except ValueError as e:
+            errors[key] = str(e), 502
+    return cities, weathers, errors
+
+
+def match_nearby_cities(cities, weathers):
+    """
+    Resolve new cities within CITY_MATCH_RADIUS_KM of a known city, or of a new one earlier in the request, to
+    it, as CityName.objects.resolve does for single subscriptions. Updates `cities` in place with the known
+    matches and returns {key: key of the new city it matches} for the others.
+    """
+    aliases = {}
+    located = {}
+    for key, (_, location) in weathers.items():
+        if key in cities or not location.get('geohash'):
+            continue
+        latitude, longitude = location['latitude'], location['longitude']
+        known = CityName.objects.nearest(latitude, longitude)
+        if known is not None:
+            cities[key] = known
+            continue
+        match = next((other for other, (other_latitude, other_longitude) in located.items()
+                      if haversine_km(latitude, longitude, other_latitude, other_longitude)
+                      <= settings.CITY_MATCH_RADIUS_KM), None)
+        if match is not None:
+            aliases[key] = match
+        else:
+            located[key] = latitude, longitude
+    return aliases
+
+
+def save_cities(cities_data, cities, weathers):
+    """Create the missing CityName and CityWeather rows for validated cities, updating `cities` in place."""
+    aliases = match_nearby_cities(cities, weathers)
+    new_cities = [CityName(key=key, name=cities_data[key]['name'], state=cities_data[key]['state'],
+                           country_code=cities_data[key]['country_code'], **location)
+                  for key, (_, location) in weathers.items() if key not in cities and key not in aliases]
+    # a concurrent request may have created some of them already: skip those and read back the stored rows
+    CityName.objects.bulk_create(new_cities, batch_size=BULK_BATCH_SIZE, ignore_conflicts=True)
+    cities.update(CityName.objects.in_bulk([city.key for city in new_cities], field_name='key'))
+    for key, match in aliases.items():
+        cities[key] = cities[match]
+
+    with_weather = set(CityWeather.objects.filter(city__in=[cities[key] for key in weathers])
+                       .values_list('city_id', flat=True))
+    new_weathers = {}
+    for key, (weather_data, _) in weathers.items():
+        if cities[key].pk not in with_weather:
+            new_weathers.setdefault(cities[key].pk, CityWeather(city=cities[key], **weather_data))
+    CityWeather.objects.bulk_create(new_weathers.values(), batch_size=BULK_BATCH_SIZE)
+
+
+def bulk_create_subscriptions(user, entries):
+    results = [None] * len(entries)
+    valid = {}
+    for index, entry in enumerate(entries):
+        data, errors = NEW_SUBSCRIPTION_SCHEMA.validate(entry)
+        if errors:
+            results[index] = {'status': 'error', 'errors': errors}
+        else:
+            valid[index] = data
+
+    cities_data = {}
+    for data in valid.values():
+        cities_data.setdefault(city_key(data['city']), data['city'])
+    cities, weathers, errors = validate_cities(cities_data)
+
+    with transaction.atomic():
+        save_cities(cities_data, cities, weathers)
+        city_weathers = {weather.city_id: weather
+                         for weather in CityWeather.objects.filter(city__in=cities.values())}
+        subscribed = set(UserSubscription.objects.filter(user=user, city__in=cities.values())
+                         .values_list('city_id', flat=True))
+        now = timezone.now()
+        new_subscriptions = {}
+        for index, data in valid.items():
+            key = city_key(data['city'])
+            if key in errors:
+                message, code = errors[key]
+                results[index] = {'status': 'error', 'error': message, 'code': code}
+                continue
+            city = cities[key]
+            if city.pk in subscribed:
+                results[index] = {'status': 'error', 'error': 'You are already subscribed to this city. '
+                                                              'Please, edit an existing subscription'}
+                continue
+            subscribed.add(city.pk)
+            subscription = UserSubscription(user=user, city=city, weather_info=city_weathers[city.pk],
+                                            notification_frequency=data['notification_frequency'])
+            subscription.next_notification_at = subscription.get_next_notification_at(now)
+            new_subscriptions[index] = subscription
+        UserSubscription.objects.bulk_create(new_subscriptions.values(), batch_size=BULK_BATCH_SIZE)
+
+    for index, subscription in new_subscriptions.items():
+        results[index] = {'status': 'created', 'id': subscription.pk}
+    return results
+
+
+def bulk_update_subscriptions(user, entries):
+    results = [None] * len(entries)
+    frequencies = {}
+    for index, entry in enumerate(entries):
+        data, errors = BULK_UPDATE_SCHEMA.validate(entry)
+        if not errors and not is_id(entry['id']):
+            errors['id'] = ['A valid integer is required.']
+        if errors:
+            results[index] = {'status': 'error', 'errors': errors}
+            continue
+        frequencies[index] = data['id'], data['notification_frequency']
+
+    with transaction.atomic():
+        subscriptions = UserSubscription.objects.filter(user=user).select_for_update() \
+            .in_bulk([subscription_id for subscription_id, _ in frequencies.values()])
+        now = timezone.now()
+        changed = {}
+        for index, (subscription_id, frequency) in frequencies.items():
+            subscription = subscriptions.get(subscription_id)
+            if subscription is None:
+                results[index] = {'status': 'error',
+                                  'error': f"Subscription with id={subscription_id} does not exist for this user"}
+                continue
+            subscription.notification_frequency = frequency
+            subscription.last_info_update = now
+            subscription.next_notification_at = subscription.get_next_notification_at(now)
+            changed[subscription.pk] = subscription
+            results[index] = {'status': 'updated', 'id': subscription.pk}
+        UserSubscription.objects.bulk_update(changed.values(), batch_size=BULK_BATCH_SIZE,
+                                             fields=['notification_frequency', 'last_info_update',
+                                                     'next_notification_at'])
+    return results
+
+
+def is_id(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def bulk_delete_subscriptions(user, ids):
+    results = []
+    with transaction.atomic():
+        subscriptions = UserSubscription.objects.filter(user=user, pk__in=[i for i in ids if is_id(i)])
+        found = set(subscriptions.values_list('pk', flat=True))
+        subscriptions.delete()
+    for subscription_id in ids:
+        if not is_id(subscription_id):
+            results.append({'status': 'error', 'error': '"id" must be an integer'})
+        elif subscription_id in found:
+            results.append({'status': 'deleted', 'id': subscription_id})
+        else:
+            results.append({'status': 'error',
+                            'error': f"Subscription with id={subscription_id} does not exist for this user"})
+    return results
@@ -0,0 +1,283 @@
+import asyncio
+import hashlib
+import logging
+import threading
+import time
+import weakref
+
+import requests
+from django.conf import settings
+from django.core.cache import InvalidCacheBackendError, caches
+from django.core.cache.backends.locmem import LocMemCache
+
+from .managers import make_city_key
+from .models import CityWeather
+from .owm import aget_weather, get_weather
+from .persistence import WEATHER_SCHEMA
+from .resilience import CircuitOpenError
+
+_stats = {'hits': 0, 'misses': 0, 'snapshot_hits': 0, 'snapshot_misses': 0}
+_stats_lock = threading.Lock()
+
+_fetch_locks = {}
+_fetch_locks_lock = threading.Lock()
+
+_inflight = weakref.WeakKeyDictionary()  # event loop -> {cache key: task fetching it}
+
+_fallback_cache = None
+
+
+def get_cache():
+    """The cache configured as WEATHER_CACHE_ALIAS, or a process-local LRU cache if it is not configured."""
+    global _fallback_cache
+    try:
+        return caches[settings.WEATHER_CACHE_ALIAS]
+    except InvalidCacheBackendError:
+        if _fallback_cache is None:
+            _fallback_cache = LocMemCache('weather-fallback', {
+                'TIMEOUT': settings.WEATHER_CACHE_TTL,
+                'OPTIONS': {'MAX_ENTRIES': settings.WEATHER_CACHE_MAX_ENTRIES},
+            })
+        return _fallback_cache
+
+
+def is_shared(cache):
+    """Whether all processes see the same entries of `cache`, i.e. it is not a process-local LocMemCache."""
+    return not isinstance(cache, LocMemCache)
+
+
+def weather_cache_key(city_data):
+    city_key = make_city_key(city_data['name'], city_data.get('state', ''), city_data['country_code'])
+    digest = hashlib.sha1(city_key.encode()).hexdigest()
+    return f"weather:current:{digest}"
+
+
+def count(stat, n=1):
+    with _stats_lock:
+        _stats[stat] += n
+
+
+def hit_ratio(hits, misses):
+    return round(hits / (hits + misses), 3) if hits + misses else None
+
+
+def cache_stats():
+    """Lookups of OWM responses (hits, misses) and of CityWeather snapshots (snapshot_*) in this process."""
+    with _stats_lock:
+        stats = dict(_stats)
+    stats['hit_ratio'] = hit_ratio(stats['hits'], stats['misses'])
+    stats['snapshot_hit_ratio'] = hit_ratio(stats['snapshot_hits'], stats['snapshot_misses'])
+    return stats
+
+
+class _FetchLock:
+    """Per-key lock so that only one thread of this process fetches a given city at a time."""
+
+    def __init__(self, key):
+        self.key = key
+
+    def __enter__(self):
+        with _fetch_locks_lock:
+            lock, waiters = _fetch_locks.get(self.key, (threading.Lock(), 0))
+            _fetch_locks[self.key] = (lock, waiters + 1)
+        lock.acquire()
+
+    def __exit__(self, *exc_info):
+        with _fetch_locks_lock:
+            lock, waiters = _fetch_locks[self.key]
+            if waiters == 1:
+                del _fetch_locks[self.key]
+            else:
+                _fetch_locks[self.key] = (lock, waiters - 1)
+        lock.release()
+
+
+def cache_get(cache, key):
+    try:
+        return cache.get(key)
+    except Exception as e:  # a cache outage must not break the request
+        logging.error(f"weather cache get failed: {e!r}")
+        return None
+
+
+def cache_set(cache, key, value, timeout):
+    try:
+        cache.set(key, value, timeout)
+    except Exception as e:
+        logging.error(f"weather cache set failed: {e!r}")
+
+
+def wait_for_fill(cache, key, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        time.sleep(0.05)
+        cached = cache_get(cache, key)
+        if cached is not None:
+            return cached
+    return None
+
+
+def get_weather_cached(city_data):
+    """
+    get_weather behind a TTL cache keyed by the normalized (name, state, country_code).
+
+    Concurrent misses for the same city are collapsed into a single OWM request: threads of one process queue
+    on a per-key lock, and processes sharing the cache take a short lease with cache.add, so whoever loses the
+    race waits for the winner to fill the key instead of fetching too. Only successful responses are cached.
+    """
+    cache = get_cache()
+    key = weather_cache_key(city_data)
+
+    cached = cache_get(cache, key)
+    if cached is not None:
+        count('hits')
+        return cached
+
+    with _FetchLock(key):
+        cached = cache_get(cache, key)
+        if cached is not None:
+            count('hits')
+            return cached
+
+        lease_key = f"{key}:lease"
+        try:
+            leased = cache.add(lease_key, 1, settings.WEATHER_CACHE_LEASE)
+        except Exception:
+            leased = True
+        if not leased:
+            cached = wait_for_fill(cache, key, settings.WEATHER_CACHE_LEASE)
+            if cached is not None:
+                count('hits')
+                return cached
+
+        count('misses')
+        try:
+            weather_data, code = get_weather(city_data)
+            if code == 200:
+                cache_set(cache, key, (weather_data, code), settings.WEATHER_CACHE_TTL)
+        finally:
+            if leased:
+                try:
+                    cache.delete(lease_key)
+                except Exception:
+                    pass
+        return dict(weather_data), code
+
+
+def snapshot_key(city_data):
+    return make_city_key(city_data['name'], city_data.get('state', ''), city_data['country_code'])
+
+
+def snapshot_data(city_weather):
+    weather_data = {field: getattr(city_weather, field) for field in WEATHER_SCHEMA}
+    weather_data['location'] = {field: getattr(city_weather.city, field)
+                                for field in ('owm_id', 'latitude', 'longitude', 'geohash')}
+    return weather_data
+
+
+UNAVAILABLE_MESSAGE = 'Weather service is temporarily unavailable, please try again later'
+
+
+def get_weather_or_snapshot(city_data):
+    """
+    get_weather_cached, falling back to the stored CityWeather snapshot of the city while OpenWeatherMap is
+    unreachable or its circuit is open. Answers code 503 if there is no snapshot either.
+    """
+    try:
+        return get_weather_cached(city_data)
+    except (requests.RequestException, CircuitOpenError) as e:
+        logging.error(f"serving weather snapshot for {city_data['name']}: {e!r}")
+        city_weather = CityWeather.objects.filter(city__key=snapshot_key(city_data)).select_related('city').first()
+        if city_weather is None:
+            return {'message': UNAVAILABLE_MESSAGE}, 503
+        return snapshot_data(city_weather), 200
+
+
+async def acache_get(cache, key):
+    try:
+        return await cache.aget(key)
+    except Exception as e:
+        logging.error(f"weather cache get failed: {e!r}")
+        return None
+
+
+async def acache_set(cache, key, value, timeout):
+    try:
+        await cache.aset(key, value, timeout)
+    except Exception as e:
+        logging.error(f"weather cache set failed: {e!r}")
+
+
+async def await_fill(cache, key, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        await asyncio.sleep(0.05)
+        cached = await acache_get(cache, key)
+        if cached is not None:
+            return cached
+    return None
+
+
+async def afetch_and_cache(cache, key, city_data):
+    lease_key = f"{key}:lease"
+    try:
+        leased = await cache.aadd(lease_key, 1, settings.WEATHER_CACHE_LEASE)
+    except Exception:
+        leased = True
+    if not leased:
+        cached = await await_fill(cache, key, settings.WEATHER_CACHE_LEASE)
+        if cached is not None:
+            count('hits')
+            return cached
+
+    count('misses')
+    try:
+        weather_data, code = await aget_weather(city_data)
+        if code == 200:
+            await acache_set(cache, key, (weather_data, code), settings.WEATHER_CACHE_TTL)
+    finally:
+        if leased:
+            try:
+                await cache.adelete(lease_key)
+            except Exception:
+                pass
+    return weather_data, code
+
+
+async def aget_weather_cached(city_data):
+    """
+    Async get_weather_cached. Concurrent misses for the same city on one event loop await a single fetch task;
+    across processes the same cache lease as in the sync path applies.
+    """
+    cache = get_cache()
+    key = weather_cache_key(city_data)
+
+    cached = await acache_get(cache, key)
+    if cached is not None:
+        count('hits')
+        return cached
+
+    inflight = _inflight.setdefault(asyncio.get_running_loop(), {})
+    task = inflight.get(key)
+    if task is None:
+        task = asyncio.ensure_future(afetch_and_cache(cache, key, city_data))
+        inflight[key] = task
+        task.add_done_callback(lambda _: inflight.pop(key, None))
+    else:
+        count('hits')
+    # shielded so that a client disconnecting does not cancel the fetch other requests are waiting for
+    weather_data, code = await asyncio.shield(task)
+    return dict(weather_data), code
+
+
+async def aget_weather_or_snapshot(city_data):
+    """Async get_weather_or_snapshot."""
+    try:
+        return await aget_weather_cached(city_data)
+    except (requests.RequestException, CircuitOpenError) as e:
+        logging.error(f"serving weather snapshot for {city_data['name']}: {e!r}")
+        city_weather = await CityWeather.objects.filter(city__key=snapshot_key(city_data)) \
+            .select_related('city').afirst()
+        if city_weather is None:
+            return {'message': UNAVAILABLE_MESSAGE}, 503
+        return snapshot_data(city_weather), 200
@@ -0,0 +1,86 @@
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Count, F, Max, Min, Sum
+
+from .cache import get_cache
+from .models import WeatherAggregate, WeatherObservation
+
+
+def digest_cache_key(city_id, hours, end):
+    return f"weather:digest:{city_id}:{hours}:{end:%Y%m%d%H}"
+
+
+def digest_window_end(now):
+    """
+    Digest windows end on the hour following `now`, taking in the readings of the current run, so every
+    subscriber of a city with the same frequency gets the same digest in a run.
+    """
+    return now.replace(minute=0, second=0, microsecond=0) + timedelta(hours=1)
+
+
+def compute_digests(city_ids, start, end):
+    """
+    Weather digests of many cities between `start` and `end`, aggregated in the database: one GROUP BY query
+    over the readings and one over the aggregates the older readings were rolled into. Returns {city_id: digest}
+    with the temperature range and mean, total rain and snow, wind peak and number of readings.
+    """
+    observations = WeatherObservation.objects.filter(city__in=city_ids, observed_at__gte=start, observed_at__lt=end) \
+        .values('city_id').order_by() \
+        .annotate(readings=Count('pk'), low=Min('temperature'), high=Max('temperature'),
+                  temperature_sum=Sum('temperature'), rain=Sum('rain'), snow=Sum('snow'), wind=Max('wind_speed'))
+    aggregates = WeatherAggregate.objects.filter(city__in=city_ids, start__gte=start, start__lt=end) \
+        .values('city_id').order_by() \
+        .annotate(readings=Sum('samples'), low=Min('temperature_min'), high=Max('temperature_max'),
+                  temperature_sum=Sum(F('temperature') * F('samples')), rain=Sum(F('rain') * F('samples')),
+                  snow=Sum(F('snow') * F('samples')), wind=Max('wind_speed_max'))
+
+    totals = {}
+    for row in [*observations, *aggregates]:
+        total = totals.setdefault(row['city_id'], {'readings': 0, 'low': row['low'], 'high': row['high'],
+                                                   'temperature_sum': 0, 'rain': 0, 'snow': 0, 'wind': row['wind']})
+        for field in ('readings', 'temperature_sum', 'rain', 'snow'):
+            total[field] += row[field]
+        total['low'] = min(total['low'], row['low'])
+        total['high'] = max(total['high'], row['high'])
+        total['wind'] = max(total['wind'], row['wind'])
+
+    return {city_id: {
+        'readings': total['readings'],
+        'temperature_min': round(total['low'], 1),
+        'temperature_max': round(total['high'], 1),
+        'temperature_mean': round(total['temperature_sum'] / total['readings'], 1),
+        'rain_total': round(total['rain'], 1),
+        'snow_total': round(total['snow'], 1),
+        'wind_speed_max': round(total['wind'], 1),
+    } for city_id, total in totals.items()}
+
+
+def get_digests(city_ids, hours, now):
+    """
+    Digests of the last `hours` hours for many cities: {city_id: digest}, None for cities without readings.
+
+    Cached per (city, window) for DIGEST_CACHE_TTL, so a city is aggregated once however many of its subscribers
+    are due; the digests missing from the cache are computed together.
+    """
+    end = digest_window_end(now)
+    keys = {digest_cache_key(city_id, hours, end): city_id for city_id in set(city_ids)}
+    try:
+        cached = get_cache().get_many(keys)
+    except Exception as e:  # a cache outage must not break the notifications
+        logging.error(f"weather digest cache get failed: {e!r}")
+        cached = {}
+
+    digests = {keys[key]: digest for key, digest in cached.items()}
+    missing = set(keys.values()) - set(digests)
+    if missing:
+        computed = compute_digests(missing, end - timedelta(hours=hours), end)
+        computed = {city_id: computed.get(city_id) for city_id in missing}
+        try:
+            get_cache().set_many({digest_cache_key(city_id, hours, end): digest
+                                  for city_id, digest in computed.items()}, settings.DIGEST_CACHE_TTL)
+        except Exception as e:
+            logging.error(f"weather digest cache set failed: {e!r}")
+        digests.update(computed)
+    return digests
@@ -0,0 +1,132 @@
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from django.conf import settings
+
+from .owm import get_session, get_weather, get_weather_group
+from .resilience import CircuitOpenError
+from .utils import chunked
+
+
+def fetch_weather_many(cities_data, concurrency=None, session=None):
+    """
+    Fetch weather for many cities in parallel over one pooled session.
+
+    `cities_data` maps an arbitrary key (usually the CityName pk) to city data as produced by
+    CityNameSerializer. Returns a dict of key -> (weather_data, code) for every city and a run report.
+    A city whose request failed at the transport level gets code None.
+    """
+    concurrency = concurrency or settings.OWM_FETCH_CONCURRENCY
+    session = session or get_session()
+    started = time.monotonic()
+
+    def fetch(city_data):
+        try:
+            return get_weather(city_data, session=session)
+        except (requests.RequestException, CircuitOpenError, ValueError, KeyError) as e:
+            return {'message': str(e)}, None
+
+    results = {}
+    if cities_data:
+        keys = list(cities_data)
+        with ThreadPoolExecutor(max_workers=min(concurrency, len(keys))) as executor:
+            for key, result in zip(keys, executor.map(fetch, (cities_data[key] for key in keys))):
+                results[key] = result
+
+    failed = sum(1 for _, code in results.values() if code != 200)
+    report = {
+        'cities': len(results),
+        'fetched': len(results) - failed,
+        'failed': failed,
+        'concurrency': concurrency,
+        'seconds': round(time.monotonic() - started, 3),
+    }
+    logging.info(f"weather fetch run: {report}")
+    return results, report
+
+
+def fetch_weather_groups(owm_ids, concurrency=None, session=None):
+    """
+    Fetch weather for many OWM city ids through the group endpoint, in parallel calls of OWM_GROUP_SIZE ids.
+
+    Returns a dict of owm_id -> (weather_data, code) for every id and a run report.
+    """
+    concurrency = concurrency or settings.OWM_FETCH_CONCURRENCY
+    session = session or get_session()
+    started = time.monotonic()
+    batches = list(chunked(sorted(set(owm_ids)), settings.OWM_GROUP_SIZE))
+
+    def fetch(batch):
+        try:
+            return get_weather_group(batch, session=session)
+        except (requests.RequestException, CircuitOpenError, ValueError, KeyError) as e:
+            return {'message': str(e)}, None
+
+    results = {}
+    if batches:
+        with ThreadPoolExecutor(max_workers=min(concurrency, len(batches))) as executor:
+            for batch, (weathers, code) in zip(batches, executor.map(fetch, batches)):
+                for owm_id in batch:
+                    if code != 200:
+                        results[owm_id] = weathers, code
+                    elif owm_id in weathers:
+                        results[owm_id] = weathers[owm_id], 200
+                    else:
+                        results[owm_id] = {'message': 'city id not found'}, 404
+
+    failed = sum(1 for _, code in results.values() if code != 200)
+    report = {
+        'cities': len(results),
+        'fetched': len(results) - failed,
+        'failed': failed,
+        'requests': len(batches),
+        'concurrency': concurrency,
+        'seconds': round(time.monotonic() - started, 3),
+    }
+    logging.info(f"weather group fetch run: {report}")
+    return results, report
+
+
+def fetch_city_weathers(city_weathers):
+    """
+    Fetch fresh weather for CityWeather rows (with their city selected).
+
+    Cities with a known OWM id are refreshed in batches through the group endpoint, the rest by name, one call
+    each. Name lookups resolve the city's OWM id and coordinates onto its CityName instance, so the next run can
+    batch it; the caller saves them. Returns results keyed by CityWeather pk, the cities whose location was
+    resolved, and a combined report.
+    """
+    by_id = [city_weather for city_weather in city_weathers if city_weather.city.owm_id]
+    by_name = [city_weather for city_weather in city_weathers if not city_weather.city.owm_id]
+
+    group_results, group_report = fetch_weather_groups([city_weather.city.owm_id for city_weather in by_id])
+    name_results, name_report = fetch_weather_many({
+        city_weather.pk: {'name': city_weather.city.name, 'state': city_weather.city.state,
+                          'country_code': city_weather.city.country_code}
+        for city_weather in by_name
+    })
+
+    results = {city_weather.pk: group_results[city_weather.city.owm_id] for city_weather in by_id}
+    results.update(name_results)
+
+    located = []
+    for city_weather in by_name:
+        weather_data, code = name_results[city_weather.pk]
+        if code == 200 and 'location' in weather_data:
+            for field, value in weather_data['location'].items():
+                setattr(city_weather.city, field, value)
+            located.append(city_weather.city)
+
+    failed = sum(1 for _, code in results.values() if code != 200)
+    report = {
+        'cities': len(results),
+        'fetched': len(results) - failed,
+        'failed': failed,
+        'requests': group_report['requests'] + name_report['cities'],
+        'group_requests': group_report['requests'],
+        'located': len(located),
+        'seconds': round(group_report['seconds'] + name_report['seconds'], 3),
+    }
+    return results, located, report
@@ -0,0 +1,69 @@
+import math
+
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+PRECISION = 9  # characters of the geohash stored on CityName, cells of about 5 x 5 m
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+
+
+def encode(latitude, longitude, precision=PRECISION):
+    """Geohash of a point: nearby points share a prefix, so a prefix is a rectangular cell."""
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    geohash = []
+    bits = value = 0
+    even = True  # bits alternate between longitude and latitude, starting with longitude
+    while len(geohash) < precision:
+        interval, coordinate = (lon_range, longitude) if even else (lat_range, latitude)
+        middle = (interval[0] + interval[1]) / 2
+        value <<= 1
+        if coordinate >= middle:
+            value |= 1
+            interval[0] = middle
+        else:
+            interval[1] = middle
+        even = not even
+        bits += 1
+        if bits == 5:
+            geohash.append(BASE32[value])
+            bits = value = 0
+    return ''.join(geohash)
+
+
+def cell_size(precision):
+    """Height and width of the cells of a geohash precision, in degrees."""
+    lon_bits = (5 * precision + 1) // 2
+    lat_bits = 5 * precision // 2
+    return 180 / 2 ** lat_bits, 360 / 2 ** lon_bits
+
+
+def haversine_km(latitude1, longitude1, latitude2, longitude2):
+    lat1, lon1, lat2, lon2 = map(math.radians, (latitude1, longitude1, latitude2, longitude2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def search_precision(latitude, radius_km):
+    """The longest geohash whose cells at `latitude` are at least `radius_km` high and wide."""
+    for precision in range(PRECISION, 0, -1):
+        height, width = cell_size(precision)
+        if min(height, width * math.cos(math.radians(latitude))) * KM_PER_DEGREE >= radius_km:
+            return precision
+    return 1
+
+
+def search_cells(latitude, longitude, radius_km):
+    """
+    Geohash prefixes covering every point within `radius_km` of a point: its cell and the eight around it, at
+    a precision whose cells are larger than the radius.
+    """
+    precision = search_precision(latitude, radius_km)
+    height, width = cell_size(precision)
+    cells = set()
+    for dy in (-1, 0, 1):
+        cell_latitude = latitude + dy * height
+        if not -90 <= cell_latitude <= 90:
+            continue
+        for dx in (-1, 0, 1):
+            cell_longitude = (longitude + dx * width + 180) % 360 - 180
+            cells.add(encode(cell_latitude, cell_longitude, precision))
+    return sorted(cells)
@@ -0,0 +1,122 @@
+from datetime import timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Avg, Count, F, Max, Min, Sum
+from django.db.models.functions import Trunc
+
+from .models import WeatherAggregate, WeatherObservation
+from .persistence import BULK_BATCH_SIZE, HISTORY_FIELDS
+from .utils import chunked
+
+RAW = 'raw'
+HOUR = WeatherAggregate.HOUR
+DAY = WeatherAggregate.DAY
+# resolution -> time between two points, readings are taken at most hourly
+RESOLUTIONS = {RAW: timedelta(hours=1), HOUR: timedelta(hours=1), DAY: timedelta(days=1)}
+
+
+def truncate(field, period):
+    return Trunc(field, period, tzinfo=dt_timezone.utc)
+
+
+def bucket_observations(observations, period, *group_by):
+    """Readings averaged per `period` in the database, one row per bucket (and `group_by` fields)."""
+    return observations.annotate(bucket=truncate('observed_at', period)).values(*group_by, 'bucket').order_by() \
+        .annotate(n=Count('pk'), low=Min('temperature'), high=Max('temperature'), wind_peak=Max('wind_speed'),
+                  **{f'avg_{field}': Avg(field) for field in HISTORY_FIELDS})
+
+
+def bucket_aggregates(aggregates, period, *group_by):
+    """Aggregates combined per `period` in the database, averages weighted by their number of readings."""
+    return aggregates.annotate(bucket=truncate('start', period)).values(*group_by, 'bucket').order_by() \
+        .annotate(n=Sum('samples'), low=Min('temperature_min'), high=Max('temperature_max'),
+                  wind_peak=Max('wind_speed_max'),
+                  **{f'avg_{field}': Sum(F(field) * F('samples')) / Sum('samples') for field in HISTORY_FIELDS})
+
+
+def bucket_values(row):
+    return {'samples': row['n'], 'temperature_min': row['low'], 'temperature_max': row['high'],
+            'wind_speed_max': row['wind_peak'], **{field: row[f'avg_{field}'] for field in HISTORY_FIELDS}}
+
+
+def roll_up(buckets, period):
+    """Store bucketed rows as WeatherAggregates of `period`. Returns the number of rows created."""
+    aggregates = [WeatherAggregate(city_id=row['city_id'], period=period, start=row['bucket'], **bucket_values(row))
+                  for row in buckets]
+    for batch in chunked(aggregates, BULK_BATCH_SIZE):
+        WeatherAggregate.objects.bulk_create(batch)
+    return len(aggregates)
+
+
+def compact_history(now):
+    """
+    Apply the retention policy: readings older than WEATHER_HISTORY_RAW_DAYS are replaced with hourly aggregates
+    and hourly aggregates older than WEATHER_HISTORY_HOURLY_DAYS with daily ones. The cutoffs fall on hour and
+    day boundaries, so no bucket is split between two runs.
+    """
+    raw_before = (now - timedelta(days=settings.WEATHER_HISTORY_RAW_DAYS)).replace(minute=0, second=0, microsecond=0)
+    hourly_before = (now - timedelta(days=settings.WEATHER_HISTORY_HOURLY_DAYS)) \
+        .replace(hour=0, minute=0, second=0, microsecond=0)
+
+    with transaction.atomic():
+        observations = WeatherObservation.objects.filter(observed_at__lt=raw_before)
+        hours_created = roll_up(bucket_observations(observations, HOUR, 'city_id'), HOUR)
+        observations_deleted, _ = observations.delete()
+    with transaction.atomic():
+        hours = WeatherAggregate.objects.filter(period=HOUR, start__lt=hourly_before)
+        days_created = roll_up(bucket_aggregates(hours, DAY, 'city_id'), DAY)
+        hours_deleted, _ = hours.delete()
+    return {'observations_rolled': observations_deleted, 'hours_created': hours_created,
+            'hours_rolled': hours_deleted, 'days_created': days_created}
+
+
+def merge_points(points):
+    """Combine points of the same time coming from different tiers, weighting averages by readings."""
+    merged = {}
+    for point in points:
+        other = merged.get(point['time'])
+        if other is None:
+            merged[point['time']] = point
+            continue
+        samples = other['samples'] + point['samples']
+        for field in HISTORY_FIELDS:
+            other[field] = (other[field] * other['samples'] + point[field] * point['samples']) / samples
+        other['temperature_min'] = min(other['temperature_min'], point['temperature_min'])
+        other['temperature_max'] = max(other['temperature_max'], point['temperature_max'])
+        other['wind_speed_max'] = max(other['wind_speed_max'], point['wind_speed_max'])
+        other['samples'] = samples
+    return sorted(merged.values(), key=lambda point: point['time'])
+
+
+def city_history(city_id, start, end, resolution):
+    """
+    Weather of a city from `start` up to `end`, downsampled in the database to `resolution` ('raw', 'hour' or
+    'day'). History already compacted to a coarser period than requested keeps that period. Every point has
+    its time and period, the number of readings, the averages, the temperature range and the wind peak.
+    """
+    observations = WeatherObservation.objects.filter(city_id=city_id, observed_at__gte=start, observed_at__lt=end)
+    aggregates = WeatherAggregate.objects.filter(city_id=city_id, start__gte=start, start__lt=end)
+
+    if resolution == RAW:
+        points = [{'time': row['observed_at'], 'period': RAW, 'samples': 1, 'temperature_min': row['temperature'],
+                   'temperature_max': row['temperature'], 'wind_speed_max': row['wind_speed'],
+                   **{field: row[field] for field in HISTORY_FIELDS}}
+                  for row in observations.values('observed_at', *HISTORY_FIELDS)]
+    else:
+        points = [{'time': row['bucket'], 'period': resolution, **bucket_values(row)}
+                  for row in bucket_observations(observations, resolution)]
+
+    if resolution == DAY:
+        points += [{'time': row['bucket'], 'period': DAY, **bucket_values(row)}
+                   for row in bucket_aggregates(aggregates, DAY)]
+    else:
+        points += [{'time': row.pop('start'), **row}
+                   for row in aggregates.values('start', 'period', 'samples', 'temperature_min', 'temperature_max',
+                                                'wind_speed_max', *HISTORY_FIELDS)]
+
+    points = merge_points(points)
+    for point in points:
+        for field in (*HISTORY_FIELDS, 'temperature_min', 'temperature_max', 'wind_speed_max'):
+            point[field] = round(point[field], 2)
+    return points
@@ -0,0 +1,224 @@
+import asyncio
+import contextvars
+import functools
+import json
+import logging
+import os
+import time
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram, \
+    generate_latest, multiprocess
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+logger = logging.getLogger(__name__)
+
+REQUEST_DURATION = Histogram('http_request_duration_seconds', 'Latency of API requests',
+                             ['view', 'method', 'status'])
+TASK_DURATION = Histogram('celery_task_duration_seconds', 'Run time of Celery tasks', ['task', 'state'])
+SPAN_DURATION = Histogram('span_duration_seconds', 'Run time of instrumented functions', ['span'])
+DB_QUERIES = Histogram('db_queries', 'Database queries per request or task', ['scope'],
+                       buckets=(0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, float('inf')))
+DB_QUERY_DURATION = Histogram('db_query_duration_seconds', 'Latency of database queries', ['scope'])
+OUTBOUND_DURATION = Histogram('outbound_request_duration_seconds', 'Latency of outbound HTTP requests',
+                              ['service', 'endpoint', 'status'])
+EMAILS = Counter('emails', 'Report emails by delivery outcome', ['outcome'])
+EMAIL_BATCH_DURATION = Histogram('email_batch_duration_seconds', 'Time to send one batch of emails')
+
+
+class Scope:
+    """Database and outbound HTTP work done on behalf of one request or task."""
+
+    def __init__(self, name):
+        self.name = name
+        self.queries = 0
+        self.query_seconds = 0.0
+        self.outbound = 0
+        self.outbound_seconds = 0.0
+
+
+_scope = contextvars.ContextVar('instrumentation_scope', default=None)
+
+
+def current_scope():
+    return _scope.get()
+
+
+def record_query(execute, sql, params, many, context):
+    """Connection execute wrapper timing every query run inside a scope."""
+    scope = _scope.get()
+    if scope is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        seconds = time.perf_counter() - started
+        scope.queries += 1
+        scope.query_seconds += seconds
+        DB_QUERY_DURATION.labels(scope.name).observe(seconds)
+
+
+def install_query_recorder(sender, connection, **kwargs):
+    """connection_created receiver: every new database connection records its queries."""
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+def observe_outbound(service, endpoint, status, seconds):
+    """Record one outbound HTTP call; `status` is the response code or the name of the transport error."""
+    OUTBOUND_DURATION.labels(service, endpoint, str(status)).observe(seconds)
+    scope = _scope.get()
+    if scope is not None:
+        scope.outbound += 1
+        scope.outbound_seconds += seconds
+
+
+def observe_email_batch(sent, failed, seconds):
+    EMAILS.labels('sent').inc(sent)
+    EMAILS.labels('failed').inc(failed)
+    EMAIL_BATCH_DURATION.observe(seconds)
+
+
+def log_event(event, scope, seconds, **fields):
+    logger.info(json.dumps({
+        'event': event,
+        'name': scope.name,
+        'duration_ms': round(seconds * 1000, 1),
+        'db_queries': scope.queries,
+        'db_ms': round(scope.query_seconds * 1000, 1),
+        'outbound_requests': scope.outbound,
+        'outbound_ms': round(scope.outbound_seconds * 1000, 1),
+        **fields,
+    }))
+
+
+def span(name):
+    """Decorator timing a function into span_duration_seconds."""
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                SPAN_DURATION.labels(name).observe(time.perf_counter() - started)
+        return wrapper
+    return decorator
+
+
+class InstrumentationMiddleware:
+    """
+    Times every request and counts the database queries and outbound calls made while serving it, including
+    those async views run in worker threads. Requests are labelled with their URL name.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = asyncio.iscoroutinefunction(get_response)
+        if self.is_async:
+            self._is_coroutine = asyncio.coroutines._is_coroutine  # lets Django call the middleware as async
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        scope = Scope('request')
+        token = _scope.set(scope)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _scope.reset(token)
+        self.finish(request, response, scope, time.perf_counter() - started)
+        return response
+
+    async def __acall__(self, request):
+        scope = Scope('request')
+        token = _scope.set(scope)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _scope.reset(token)
+        self.finish(request, response, scope, time.perf_counter() - started)
+        return response
+
+    @staticmethod
+    def finish(request, response, scope, seconds):
+        match = request.resolver_match
+        view = match.view_name if match else 'unresolved'
+        REQUEST_DURATION.labels(view, request.method, response.status_code).observe(seconds)
+        DB_QUERIES.labels(view).observe(scope.queries)
+        log_event('request', scope, seconds, view=view, method=request.method, status=response.status_code)
+
+
+_task_started = {}
+
+
+def task_prerun(task_id, task, **kwargs):
+    _task_started[task_id] = (time.perf_counter(), _scope.set(Scope(task.name)))
+
+
+def task_postrun(task_id, task, state=None, **kwargs):
+    started, token = _task_started.pop(task_id, (None, None))
+    if started is None:
+        return
+    scope = _scope.get()
+    _scope.reset(token)
+    seconds = time.perf_counter() - started
+    TASK_DURATION.labels(task.name, state or 'UNKNOWN').observe(seconds)
+    DB_QUERIES.labels(task.name).observe(scope.queries)
+    log_event('task', scope, seconds, task_id=task_id, state=state)
+
+
+class ResilienceCollector:
+    """Exports the OWM rate limiter, circuit breaker and weather cache state of this process."""
+
+    def describe(self):
+        # registration must not collect: that would build the rate limiter and read Redis at startup
+        return []
+
+    def collect(self):
+        from .cache import cache_stats
+        from .resilience import resilience_metrics
+
+        metrics = resilience_metrics()
+        limiter, breaker = metrics['rate_limiter'], metrics['circuit_breaker']
+        yield GaugeMetricFamily('owm_rate_limit', 'Current OWM request rate limit, per second',
+                                value=limiter['rate'])
+        yield CounterMetricFamily('owm_rate_limited', 'OWM requests that waited for the rate limiter',
+                                  value=limiter['throttled'])
+        state = GaugeMetricFamily('owm_circuit_state', 'State of the OWM circuit breaker', labels=['state'])
+        for name in ('closed', 'open', 'half_open'):
+            state.add_metric([name], 1 if breaker['state'] == name else 0)
+        yield state
+        yield CounterMetricFamily('owm_circuit_rejected', 'OWM calls rejected by the open circuit',
+                                  value=breaker['rejected'])
+
+        stats = cache_stats()
+        lookups = CounterMetricFamily('weather_cache_lookups', 'Weather cache lookups', labels=['cache', 'result'])
+        lookups.add_metric(['owm', 'hit'], stats['hits'])
+        lookups.add_metric(['owm', 'miss'], stats['misses'])
+        lookups.add_metric(['snapshot', 'hit'], stats['snapshot_hits'])
+        lookups.add_metric(['snapshot', 'miss'], stats['snapshot_misses'])
+        yield lookups
+
+
+def metrics_registry():
+    """The registry to expose: merged over all worker processes when PROMETHEUS_MULTIPROC_DIR is set."""
+    if 'PROMETHEUS_MULTIPROC_DIR' not in os.environ:
+        return REGISTRY
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    registry.register(ResilienceCollector())
+    return registry
+
+
+def metrics_view(request):
+    """Prometheus metrics. Requires "Authorization: Bearer <METRICS_TOKEN>" if METRICS_TOKEN is set."""
+    if settings.METRICS_TOKEN and request.headers.get('Authorization') != f"Bearer {settings.METRICS_TOKEN}":
+        return HttpResponseForbidden()
+    return HttpResponse(generate_latest(metrics_registry()), content_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,125 @@
+import logging
+import smtplib
+import time
+
+from django.conf import settings
+from django.core.mail import get_connection
+
+from .instrumentation import observe_email_batch, span
+from .utils import chunked
+
+
+def is_transient(error):
+    """A dropped connection or a 4xx reply is worth retrying; refused recipients and 5xx replies are not."""
+    if isinstance(error, smtplib.SMTPServerDisconnected):
+        return True
+    if isinstance(error, smtplib.SMTPResponseException):
+        return 400 <= error.smtp_code < 500
+    if isinstance(error, smtplib.SMTPException):  # e.g. SMTPRecipientsRefused, an OSError subclass too
+        return False
+    return isinstance(error, OSError)
+
+
+def is_connection_error(error):
+    """The server could not be reached or dropped us, as opposed to a reply about this one message."""
+    if isinstance(error, (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError)):
+        return True
+    return isinstance(error, OSError) and not isinstance(error, smtplib.SMTPException)
+
+
+def send_one(connection, message, retries, number):
+    """
+    Send one message over `connection`, retrying transient errors on a fresh connection with exponential
+    backoff. Returns (accepted, attempts, unreachable), `unreachable` telling that the retries were used up on
+    connection errors.
+    """
+    for attempt in range(retries + 1):
+        try:
+            connection.open()
+            return bool(connection.send_messages([message])), attempt + 1, False
+        except (smtplib.SMTPException, OSError) as e:
+            logging.error(f"email batch {number} message to {message.to} attempt {attempt + 1} failed: {e!r}")
+            if not is_transient(e):
+                return False, attempt + 1, False
+            connection.close()
+            if attempt == retries:
+                return False, attempt + 1, is_connection_error(e)
+            time.sleep(settings.EMAIL_RETRY_BACKOFF * 2 ** attempt)
+
+
+@span('send_in_batches')
+def send_in_batches(messages, batch_size=None, retries=None, connection=None, before_batch=None, on_batch=None):
+    """
+    Send EmailMessages over one persistent connection, in batches of `batch_size` messages.
+
+    Messages go out one by one over the open connection, so each has its own outcome. A message that fails with
+    a transient error (dropped connection, 4xx reply) is retried on a fresh connection up to `retries` times with
+    exponential backoff, without re-sending the messages already accepted; one that fails permanently (refused
+    recipient, 5xx reply) is counted as failed and the batch moves on. Once a message has used up its retries on
+    connection errors the server is taken to be down: the run stops and the remaining messages are reported as
+    unsent rather than each waiting through its own retries.
+
+    `before_batch(batch)` may return the messages of a batch that should still be sent, the others are counted as
+    skipped. `on_batch(batch, accepted)` is called after every batch with the messages it tried and the list of
+    those the server accepted. Returns totals and per-batch metrics.
+    """
+    batch_size = batch_size or settings.EMAIL_BATCH_SIZE
+    retries = settings.EMAIL_SEND_RETRIES if retries is None else retries
+    connection = connection or get_connection(fail_silently=False)
+    started = time.monotonic()
+    batches = []
+    skipped = 0
+    unreachable = False
+
+    try:
+        for number, batch in enumerate(chunked(messages, batch_size), start=1):
+            if before_batch is not None:
+                wanted = before_batch(batch)
+                skipped += len(batch) - len(wanted)
+                batch = wanted
+                if not batch:
+                    continue
+            batch_started = time.monotonic()
+            outcomes = []
+            for message in batch:
+                accepted, attempts, unreachable = send_one(connection, message, retries, number)
+                outcomes.append((accepted, attempts))
+                if unreachable:
+                    break
+            batch = batch[:len(outcomes)]
+            sent = sum(1 for accepted, _ in outcomes if accepted)
+            seconds = time.monotonic() - batch_started
+            observe_email_batch(sent, len(batch) - sent, seconds)
+            batch_metrics = {
+                'batch': number,
+                'messages': len(batch),
+                'sent': sent,
+                'attempts': max(attempts for _, attempts in outcomes),
+                'seconds': round(seconds, 3),
+                'per_second': round(sent / seconds, 1) if seconds else None,
+            }
+            logging.info(f"email batch sent: {batch_metrics}")
+            batches.append(batch_metrics)
+            if on_batch is not None:
+                on_batch(batch, [message for message, (accepted, _) in zip(batch, outcomes) if accepted])
+            if unreachable:
+                break
+    finally:
+        connection.close()
+
+    seconds = time.monotonic() - started
+    tried = sum(batch['messages'] for batch in batches)
+    sent = sum(batch['sent'] for batch in batches)
+    unsent = len(messages) - skipped - tried
+    if unsent:
+        logging.error(f"email server unreachable, {unsent} messages left unsent")
+    return {
+        'messages': len(messages),
+        'sent': sent,
+        'failed': tried - sent,
+        'skipped': skipped,
+        'unsent': unsent,
+        'seconds': round(seconds, 3),
+        'per_second': round(sent / seconds, 1) if seconds else None,
+        'batches': batches,
+    }
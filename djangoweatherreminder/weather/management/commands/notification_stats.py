@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from weather.models import Notification
+from weather.outbox import delivery_stats
+
+
+class Command(BaseCommand):
+    help = "Show how many report emails of the latest notification runs were sent, skipped, failed or are pending"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=24, help="number of latest runs to show")
+
+    def handle(self, *args, **options):
+        statuses = [status for status, _ in Notification.STATUSES]
+        self.stdout.write(' '.join(['run'.ljust(16), *(status.rjust(8) for status in statuses)]))
+        for run, counts in delivery_stats(limit=options['runs']).items():
+            self.stdout.write(' '.join([run.ljust(16), *(str(counts[status]).rjust(8) for status in statuses)]))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from weather.snapshots import warm_snapshots
+
+
+class Command(BaseCommand):
+    help = "Preload the weather cache with the CityWeather snapshots of every subscribed city"
+
+    def handle(self, *args, **options):
+        cached = warm_snapshots()
+        self.stdout.write(f"cached weather snapshots of {cached} cities")
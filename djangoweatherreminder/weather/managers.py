@@ -0,0 +1,56 @@
+from functools import reduce
+from operator import or_
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import models
+from django.db.models import Q
+
+from .geo import haversine_km, search_cells
+
+
+def make_city_key(name, state, country_code):
+    """Canonical identity of a city: case-folded, whitespace-normalized name, state and country code."""
+    return '|'.join(' '.join(part.split()).casefold() for part in (name, state, country_code))
+
+
+class CityNameManager(models.Manager):
+    def nearest(self, latitude, longitude, radius_km=None):
+        """
+        The known city nearest to a point within `radius_km` (CITY_MATCH_RADIUS_KM by default), None if there is
+        none. Candidates are found by geohash prefix on the indexed `geohash` column, then ranked by distance.
+        """
+        radius_km = settings.CITY_MATCH_RADIUS_KM if radius_km is None else radius_km
+        cells = search_cells(latitude, longitude, radius_km)
+        candidates = self.filter(reduce(or_, (Q(geohash__startswith=cell) for cell in cells)))
+        distance, city = min(((haversine_km(latitude, longitude, city.latitude, city.longitude), city)
+                              for city in candidates), key=lambda candidate: candidate[0], default=(None, None))
+        return city if distance is not None and distance <= radius_km else None
+
+    def resolve(self, city_data, location=None):
+        """
+        Atomically fetch or create the city for `city_data`. Returns (city, created).
+
+        `location` (OWM id, coordinates and geohash, see owm.parse_location) is stored on the city if it has none
+        yet. A new spelling of a city within CITY_MATCH_RADIUS_KM of a known one resolves to the known city, so
+        both share one weather row and one OWM refresh.
+        """
+        key = make_city_key(city_data['name'], city_data.get('state', ''), city_data['country_code'])
+        if location and location.get('geohash') and not self.filter(key=key).exists():
+            city = self.nearest(location['latitude'], location['longitude'])
+            if city is not None:
+                return city, False
+        city, created = self.get_or_create(key=key, defaults={
+            'name': city_data['name'],
+            'state': city_data.get('state', ''),
+            'country_code': city_data['country_code'],
+            **(location or {}),
+        })
+        if not created and location and city.owm_id is None:
+            for field, value in location.items():
+                setattr(city, field, value)
+            city.save(update_fields=list(location))
+        return city, created
+
+    async def aresolve(self, city_data, location=None):
+        return await sync_to_async(self.resolve)(city_data, location)
@@ -0,0 +1,31 @@
+# Generated by Django 4.1.1 on 2026-10-18 10:12
+
+from datetime import timedelta
+
+from django.db import migrations, models
+
+
+def backfill_next_notification_at(apps, schema_editor):
+    UserSubscription = apps.get_model('weather', 'UserSubscription')
+    subscriptions = []
+    for subscription in UserSubscription.objects.only('id', 'last_info_update', 'notification_frequency').iterator():
+        subscription.next_notification_at = subscription.last_info_update + \
+            timedelta(hours=subscription.notification_frequency)
+        subscriptions.append(subscription)
+    UserSubscription.objects.bulk_update(subscriptions, fields=['next_notification_at'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('weather', '0002_alter_cityname_state'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='usersubscription',
+            name='next_notification_at',
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.RunPython(backfill_next_notification_at, migrations.RunPython.noop),
+    ]
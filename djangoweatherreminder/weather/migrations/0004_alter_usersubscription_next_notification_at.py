@@ -0,0 +1,18 @@
+# Generated by Django 4.1.1 on 2026-10-18 10:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('weather', '0003_usersubscription_next_notification_at'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='usersubscription',
+            name='next_notification_at',
+            field=models.DateTimeField(db_index=True),
+        ),
+    ]
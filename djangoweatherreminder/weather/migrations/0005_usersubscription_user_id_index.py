@@ -0,0 +1,17 @@
+# Generated by Django 4.1.1 on 2026-10-18 09:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('weather', '0004_alter_usersubscription_next_notification_at'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='usersubscription',
+            index=models.Index(fields=['user', 'id'], name='weather_use_user_id_a3420e_idx'),
+        ),
+    ]
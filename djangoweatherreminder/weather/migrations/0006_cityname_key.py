@@ -0,0 +1,61 @@
+# Generated by Django 4.1.1 on 2026-10-18 11:05
+
+from collections import defaultdict
+
+from django.db import migrations, models
+
+
+def make_city_key(name, state, country_code):
+    # frozen copy of weather.managers.make_city_key
+    return '|'.join(' '.join(part.split()).casefold() for part in (name, state, country_code))
+
+
+def deduplicate_cities(apps, schema_editor):
+    CityName = apps.get_model('weather', 'CityName')
+    CityWeather = apps.get_model('weather', 'CityWeather')
+    UserSubscription = apps.get_model('weather', 'UserSubscription')
+
+    cities_by_key = defaultdict(list)
+    for city in CityName.objects.order_by('pk').iterator():
+        city.key = make_city_key(city.name, city.state, city.country_code)
+        cities_by_key[city.key].append(city)
+
+    for key, (city, *duplicates) in cities_by_key.items():
+        if duplicates:
+            duplicate_ids = [duplicate.pk for duplicate in duplicates]
+            weathers = list(CityWeather.objects.filter(city_id__in=[city.pk, *duplicate_ids]))
+            # prefer the weather row that already belongs to the surviving city
+            weathers.sort(key=lambda weather: (weather.city_id != city.pk, weather.pk))
+            if weathers:
+                kept_weather, *stale_weathers = weathers
+                stale_weather_ids = [weather.pk for weather in stale_weathers]
+                CityWeather.objects.filter(pk=kept_weather.pk).update(city_id=city.pk)
+                UserSubscription.objects.filter(weather_info_id__in=stale_weather_ids) \
+                    .update(weather_info_id=kept_weather.pk)
+                CityWeather.objects.filter(pk__in=stale_weather_ids).delete()
+            UserSubscription.objects.filter(city_id__in=duplicate_ids).update(city_id=city.pk)
+
+            # a user subscribed to two spellings of the city keeps the older subscription
+            seen_users = set()
+            for subscription in UserSubscription.objects.filter(city_id=city.pk).order_by('pk'):
+                if subscription.user_id in seen_users:
+                    subscription.delete()
+                seen_users.add(subscription.user_id)
+            CityName.objects.filter(pk__in=duplicate_ids).delete()
+        CityName.objects.filter(pk=city.pk).update(key=key)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('weather', '0005_usersubscription_user_id_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cityname',
+            name='key',
+            field=models.CharField(max_length=160, null=True),
+        ),
+        migrations.RunPython(deduplicate_cities, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.1.1 on 2026-10-18 11:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('weather', '0006_cityname_key'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='cityname',
+            name='key',
+            field=models.CharField(max_length=160, unique=True),
+        ),
+    ]
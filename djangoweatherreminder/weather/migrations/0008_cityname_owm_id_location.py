@@ -0,0 +1,28 @@
+# Generated by Django 4.1.1 on 2026-10-18 09:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('weather', '0007_alter_cityname_key'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cityname',
+            name='latitude',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='cityname',
+            name='longitude',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='cityname',
+            name='owm_id',
+            field=models.BigIntegerField(blank=True, db_index=True, null=True),
+        ),
+    ]
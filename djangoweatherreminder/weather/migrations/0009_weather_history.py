@@ -0,0 +1,69 @@
+# Generated by Django 4.1.1 on 2026-10-18 10:22
+
+import django.contrib.postgres.indexes
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('weather', '0008_cityname_owm_id_location'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WeatherObservation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('observed_at', models.DateTimeField()),
+                ('temperature', models.FloatField()),
+                ('feels_like', models.FloatField()),
+                ('humidity', models.FloatField()),
+                ('pressure', models.FloatField()),
+                ('visibility', models.FloatField()),
+                ('wind_speed', models.FloatField()),
+                ('clouds', models.FloatField()),
+                ('rain', models.FloatField()),
+                ('snow', models.FloatField()),
+                ('city', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='observations', to='weather.cityname')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='WeatherAggregate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('hour', 'hour'), ('day', 'day')], max_length=4)),
+                ('start', models.DateTimeField()),
+                ('samples', models.IntegerField()),
+                ('temperature', models.FloatField()),
+                ('temperature_min', models.FloatField()),
+                ('temperature_max', models.FloatField()),
+                ('feels_like', models.FloatField()),
+                ('humidity', models.FloatField()),
+                ('pressure', models.FloatField()),
+                ('visibility', models.FloatField()),
+                ('wind_speed', models.FloatField()),
+                ('clouds', models.FloatField()),
+                ('rain', models.FloatField()),
+                ('snow', models.FloatField()),
+                ('city', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='weather_aggregates', to='weather.cityname')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='weatherobservation',
+            index=models.Index(fields=['city', 'observed_at'], name='weather_wea_city_id_388101_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='weatherobservation',
+            index=django.contrib.postgres.indexes.BrinIndex(fields=['observed_at'], name='weather_observed_at_brin'),
+        ),
+        migrations.AddIndex(
+            model_name='weatheraggregate',
+            index=django.contrib.postgres.indexes.BrinIndex(fields=['start'], name='weather_aggregate_start_brin'),
+        ),
+        migrations.AddConstraint(
+            model_name='weatheraggregate',
+            constraint=models.UniqueConstraint(fields=('city', 'period', 'start'), name='unique_weather_aggregate'),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 4.1.1 on 2026-10-18 10:24
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def copy_wind_speed(apps, schema_editor):
+    # the peak of rows rolled up before it was recorded is unknown, the average is the best estimate
+    WeatherAggregate = apps.get_model('weather', 'WeatherAggregate')
+    WeatherAggregate.objects.update(wind_speed_max=F('wind_speed'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('weather', '0009_weather_history'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='weatheraggregate',
+            name='wind_speed_max',
+            field=models.FloatField(default=0),
+            preserve_default=False,
+        ),
+        migrations.RunPython(copy_wind_speed, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 4.1.1 on 2026-10-18 10:27
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('weather', '0010_weatheraggregate_wind_speed_max'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AlertRule',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('field', models.CharField(choices=[('temperature', 'temperature'), ('feels_like', 'feels_like'), ('humidity', 'humidity'), ('pressure', 'pressure'), ('visibility', 'visibility'), ('wind_speed', 'wind_speed'), ('clouds', 'clouds'), ('rain', 'rain'), ('snow', 'snow')], max_length=20)),
+                ('operator', models.CharField(choices=[('lt', '<'), ('lte', '<='), ('gt', '>'), ('gte', '>=')], max_length=3)),
+                ('threshold', models.FloatField()),
+                ('matching', models.BooleanField(default=False)),
+                ('last_triggered_at', models.DateTimeField(blank=True, null=True)),
+                ('subscription', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='alert_rules', to='weather.usersubscription')),
+            ],
+        ),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 4.1.1 on 2026-10-18 10:35
+
+from django.db import migrations, models
+
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+
+def encode(latitude, longitude, precision=9):
+    # frozen copy of weather.geo.encode
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    geohash = []
+    bits = value = 0
+    even = True
+    while len(geohash) < precision:
+        interval, coordinate = (lon_range, longitude) if even else (lat_range, latitude)
+        middle = (interval[0] + interval[1]) / 2
+        value <<= 1
+        if coordinate >= middle:
+            value |= 1
+            interval[0] = middle
+        else:
+            interval[1] = middle
+        even = not even
+        bits += 1
+        if bits == 5:
+            geohash.append(BASE32[value])
+            bits = value = 0
+    return ''.join(geohash)
+
+
+def fill_geohash(apps, schema_editor):
+    CityName = apps.get_model('weather', 'CityName')
+    cities = list(CityName.objects.filter(latitude__isnull=False, longitude__isnull=False))
+    for city in cities:
+        city.geohash = encode(city.latitude, city.longitude)
+    CityName.objects.bulk_update(cities, fields=['geohash'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('weather', '0012_notification_outbox'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cityname',
+            name='geohash',
+            field=models.CharField(blank=True, db_index=True, max_length=12),
+        ),
+        migrations.RunPython(fill_geohash, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.1.1 on 2026-10-18 11:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('weather', '0013_city_geohash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notification',
+            name='claim_token',
+            field=models.CharField(blank=True, default='', max_length=32),
+        ),
+    ]
@@ -1,13 +1,30 @@
+from datetime import timedelta
+
+from django.contrib.postgres.indexes import BrinIndex
 from django.db import models
+from django.utils import timezone
 
 from django.conf import settings
 
+from .managers import CityNameManager, make_city_key
+
 
 class CityName(models.Model):
     id = models.BigAutoField(primary_key=True)
     name = models.CharField(max_length=150)
     country_code = models.CharField(max_length=2)
     state = models.CharField(max_length=2, blank=True)
+    key = models.CharField(max_length=160, unique=True)
+    owm_id = models.BigIntegerField(null=True, blank=True, db_index=True)
+    latitude = models.FloatField(null=True, blank=True)
+    longitude = models.FloatField(null=True, blank=True)
+    geohash = models.CharField(max_length=12, blank=True, db_index=True)  # of the coordinates, see geo.encode
+
+    objects = CityNameManager()
+
+    def save(self, *args, **kwargs):
+        self.key = make_city_key(self.name, self.state, self.country_code)
+        super().save(*args, **kwargs)
 
     def __str__(self):
         return f"{self.name}, {self.state}, {self.country_code}"
@@ -38,7 +55,125 @@ class UserSubscription(models.Model):
     weather_info = models.ForeignKey(CityWeather, on_delete=models.CASCADE, related_name="subscriptions", null=True)
     notification_frequency = models.IntegerField()
     last_info_update = models.DateTimeField(auto_now=True)
+    next_notification_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'id']),
+        ]
+
+    def save(self, *args, **kwargs):
+        # last_info_update is refreshed by auto_now on every save, so the schedule restarts from now
+        self.next_notification_at = self.get_next_notification_at(timezone.now())
+        if kwargs.get('update_fields') is not None:
+            kwargs['update_fields'] = {*kwargs['update_fields'], 'last_info_update', 'next_notification_at'}
+        super().save(*args, **kwargs)
+
+    def get_next_notification_at(self, last_notification):
+        return last_notification + timedelta(hours=self.notification_frequency)
 
     def __str__(self):
         return f"user {self.user}, city {self.city.name}, notify every {self.notification_frequency}h, " \
                f"last update on {self.last_info_update}"
+
+
+class Notification(models.Model):
+    """
+    Outbox row of one report email. It is written in the transaction that advances the subscription's schedule
+    and `key` (subscription and scheduled time) keeps it unique, so selection and delivery can both be retried.
+    """
+    PENDING = 'pending'
+    SENDING = 'sending'
+    SENT = 'sent'
+    FAILED = 'failed'
+    SKIPPED = 'skipped'  # superseded by a newer report of the same subscription
+    STATUSES = [(PENDING, 'pending'), (SENDING, 'sending'), (SENT, 'sent'), (FAILED, 'failed'), (SKIPPED, 'skipped')]
+
+    subscription = models.ForeignKey(UserSubscription, on_delete=models.CASCADE, related_name="notifications")
+    key = models.CharField(max_length=100, unique=True)
+    run = models.CharField(max_length=20, db_index=True)
+    status = models.CharField(max_length=7, choices=STATUSES, default=PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    claim_token = models.CharField(max_length=32, blank=True, default='')  # the sending worker's claim
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'created_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.key}: {self.status} after {self.attempts} attempts"
+
+
+class AlertRule(models.Model):
+    """Email the subscriber when a field of the city's weather crosses a threshold, e.g. rain > 0."""
+    FIELDS = ['temperature', 'feels_like', 'humidity', 'pressure', 'visibility', 'wind_speed', 'clouds', 'rain',
+              'snow']
+    OPERATORS = [('lt', '<'), ('lte', '<='), ('gt', '>'), ('gte', '>=')]
+
+    subscription = models.ForeignKey(UserSubscription, on_delete=models.CASCADE, related_name="alert_rules")
+    field = models.CharField(max_length=20, choices=[(field, field) for field in FIELDS])
+    operator = models.CharField(max_length=3, choices=OPERATORS)
+    threshold = models.FloatField()
+    matching = models.BooleanField(default=False)  # whether the weather matched at the last evaluation
+    last_triggered_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.field} {self.get_operator_display()} {self.threshold:g}"
+
+
+class WeatherObservation(models.Model):
+    """One reading of a city's weather, appended by every refresh. Old readings are rolled into WeatherAggregate."""
+    city = models.ForeignKey(CityName, on_delete=models.CASCADE, related_name="observations", db_index=False)
+    observed_at = models.DateTimeField()
+    temperature = models.FloatField()
+    feels_like = models.FloatField()
+    humidity = models.FloatField()
+    pressure = models.FloatField()
+    visibility = models.FloatField()
+    wind_speed = models.FloatField()
+    clouds = models.FloatField()
+    rain = models.FloatField()
+    snow = models.FloatField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['city', 'observed_at']),
+            # rows are appended in time order, so a BRIN index is tiny and serves the retention scans
+            BrinIndex(fields=['observed_at'], name='weather_observed_at_brin'),
+        ]
+
+
+class WeatherAggregate(models.Model):
+    """A city's weather over an hour or a day: averages, temperature range, wind peak and number of readings."""
+    HOUR = 'hour'
+    DAY = 'day'
+    PERIODS = [(HOUR, 'hour'), (DAY, 'day')]
+
+    city = models.ForeignKey(CityName, on_delete=models.CASCADE, related_name="weather_aggregates", db_index=False)
+    period = models.CharField(max_length=4, choices=PERIODS)
+    start = models.DateTimeField()
+    samples = models.IntegerField()
+    temperature = models.FloatField()
+    temperature_min = models.FloatField()
+    temperature_max = models.FloatField()
+    feels_like = models.FloatField()
+    humidity = models.FloatField()
+    pressure = models.FloatField()
+    visibility = models.FloatField()
+    wind_speed = models.FloatField()
+    wind_speed_max = models.FloatField()
+    clouds = models.FloatField()
+    rain = models.FloatField()
+    snow = models.FloatField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['city', 'period', 'start'], name='unique_weather_aggregate'),
+        ]
+        indexes = [
+            BrinIndex(fields=['start'], name='weather_aggregate_start_brin'),
+        ]
@@ -0,0 +1,132 @@
+import hashlib
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, Count, F, Q, Value, When
+
+from .models import Notification, UserSubscription
+from .persistence import BULK_BATCH_SIZE
+
+
+def run_id(now):
+    """Label of a notification run, for delivery stats: the minute it started."""
+    return now.strftime('%Y-%m-%dT%H:%M')
+
+
+def notification_key(subscription):
+    """Idempotency key of a report: one per subscription and scheduled time."""
+    return f"report:{subscription.pk}:{subscription.next_notification_at:%Y%m%dT%H%M%S}"
+
+
+def message_id(key):
+    """Message-ID header derived from the idempotency key, so a re-sent report can be recognized downstream."""
+    return f"<{hashlib.sha1(key.encode()).hexdigest()}@weather-reminder>"
+
+
+def enqueue_notifications(due_subscriptions, now, run):
+    """
+    Write an outbox row for every subscription of the `due_subscriptions` queryset and advance its schedule,
+    in one transaction.
+
+    Subscriptions locked by a concurrent run are skipped, and a key already in the outbox is not written again,
+    so the selection can safely be retried. Returns the ids of the pending notifications of this selection.
+    """
+    with transaction.atomic():
+        due = list(due_subscriptions.select_related(None).select_for_update(skip_locked=True)
+                   .only('pk', 'notification_frequency', 'next_notification_at'))
+        keys = [notification_key(subscription) for subscription in due]
+        Notification.objects.bulk_create([Notification(subscription_id=subscription.pk, key=key, run=run)
+                                          for subscription, key in zip(due, keys)],
+                                         batch_size=BULK_BATCH_SIZE, ignore_conflicts=True)
+        for subscription in due:
+            subscription.last_info_update = now
+            subscription.next_notification_at = subscription.get_next_notification_at(now)
+        UserSubscription.objects.bulk_update(due, fields=['last_info_update', 'next_notification_at'],
+                                             batch_size=BULK_BATCH_SIZE)
+    return list(Notification.objects.filter(key__in=keys, status=Notification.PENDING).values_list('pk', flat=True))
+
+
+def retryable(now):
+    """Notifications left pending, or stuck sending by a worker that died, for NOTIFICATION_RETRY_AFTER."""
+    before = now - timedelta(seconds=settings.NOTIFICATION_RETRY_AFTER)
+    return Q(status=Notification.PENDING, created_at__lt=before) | \
+        Q(status=Notification.SENDING, claimed_at__lt=before)
+
+
+def claim_token():
+    return uuid.uuid4().hex
+
+
+def claim_notifications(notification_ids, now, token):
+    """
+    Mark these notifications as being sent by this worker under `token`, with their subscription, user and city
+    selected.
+
+    Only pending notifications and ones stuck sending are claimed; rows a concurrent worker holds are skipped,
+    so two senders never deliver the same notification. Of several reports of one subscription only the newest
+    is sent, the others are marked skipped. The claim is a lease of NOTIFICATION_RETRY_AFTER: a long delivery
+    keeps it with renew_claims.
+    """
+    claimable = Q(status=Notification.PENDING) | retryable(now)
+    with transaction.atomic():
+        claimed = list(Notification.objects.filter(claimable, pk__in=notification_ids)
+                       .select_for_update(skip_locked=True, of=('self',))
+                       .select_related('subscription__user', 'subscription__city').order_by('pk'))
+        newest = {notification.subscription_id: notification for notification in claimed}
+        superseded = [notification.pk for notification in claimed
+                      if newest[notification.subscription_id] is not notification]
+        if superseded:
+            Notification.objects.filter(pk__in=superseded).update(status=Notification.SKIPPED)
+        Notification.objects.filter(pk__in=[notification.pk for notification in newest.values()]) \
+            .update(status=Notification.SENDING, claimed_at=now, claim_token=token, attempts=F('attempts') + 1)
+    return list(newest.values())
+
+
+def held_by(token):
+    return Q(status=Notification.SENDING, claim_token=token)
+
+
+def renew_claims(notification_ids, token, now):
+    """Extend the lease of the notifications this worker still holds; returns their ids."""
+    held = Notification.objects.filter(held_by(token), pk__in=notification_ids)
+    held.update(claimed_at=now)
+    return set(held.values_list('pk', flat=True))
+
+
+def finish_notifications(sent_ids, failed_ids, now, token, unsent_ids=()):
+    """
+    Record delivery outcomes; failed notifications go back to pending until NOTIFICATION_MAX_ATTEMPTS, and
+    unsent ones (never tried, the server being down) go back to pending without counting the attempt.
+    Notifications re-claimed by another worker in the meantime are left to it.
+    """
+    with transaction.atomic():
+        if unsent_ids:
+            Notification.objects.filter(held_by(token), pk__in=unsent_ids) \
+                .update(status=Notification.PENDING, attempts=F('attempts') - 1)
+        if sent_ids:
+            Notification.objects.filter(held_by(token), pk__in=sent_ids).update(status=Notification.SENT, sent_at=now)
+        if failed_ids:
+            Notification.objects.filter(held_by(token), pk__in=failed_ids).update(status=Case(
+                When(attempts__gte=settings.NOTIFICATION_MAX_ATTEMPTS, then=Value(Notification.FAILED)),
+                default=Value(Notification.PENDING),
+            ))
+
+
+def delete_old_notifications(now):
+    before = now - timedelta(days=settings.NOTIFICATION_RETENTION_DAYS)
+    deleted, _ = Notification.objects.filter(status__in=[Notification.SENT, Notification.SKIPPED],
+                                             created_at__lt=before).delete()
+    return deleted
+
+
+def delivery_stats(runs=None, limit=24):
+    """Notifications by status for the given runs, or the `limit` latest ones: {run: {status: count}}."""
+    if runs is None:
+        runs = list(Notification.objects.values_list('run', flat=True).distinct().order_by('-run')[:limit])
+    stats = {run: {status: 0 for status, _ in Notification.STATUSES} for run in runs}
+    for row in Notification.objects.filter(run__in=runs).values('run', 'status').annotate(count=Count('pk')) \
+            .order_by():
+        stats[row['run']][row['status']] = row['count']
+    return stats
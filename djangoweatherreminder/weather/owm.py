@@ -0,0 +1,243 @@
+import asyncio
+import logging
+import threading
+import time
+import weakref
+
+import httpx
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+from .geo import encode
+from .instrumentation import observe_outbound
+from .resilience import CircuitOpenError, backoff_delay, get_breaker, get_limiter
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """Shared pooled HTTP session for all outbound OpenWeatherMap traffic."""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=settings.OWM_FETCH_CONCURRENCY)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                _session = session
+    return _session
+
+
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def get_async_client():
+    """Pooled async HTTP client for OpenWeatherMap traffic from async views, one per event loop."""
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        connect_timeout, read_timeout = settings.OWM_TIMEOUT
+        client = httpx.AsyncClient(
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+            limits=httpx.Limits(max_connections=settings.OWM_ASYNC_MAX_CONNECTIONS,
+                                max_keepalive_connections=settings.OWM_ASYNC_MAX_CONNECTIONS),
+        )
+        _async_clients[loop] = client
+    return client
+
+
+class OWMUnavailable(requests.RequestException):
+    pass
+
+
+def check_status(status_code, limiter):
+    """The error to retry a throttled or failed reply with, None if the reply is usable."""
+    if status_code == 429:
+        limiter.penalize()
+        return OWMUnavailable(f"OpenWeatherMap throttled the request: {status_code}")
+    if status_code >= 500:
+        return OWMUnavailable(f"OpenWeatherMap error: {status_code}")
+    return None
+
+
+def request_owm(endpoint, params, session=None):
+    """
+    GET an OWM endpoint through the shared rate limiter and circuit breaker.
+
+    Every attempt waits for a rate limiter token and has a timeout of OWM_TIMEOUT. Timeouts, connection errors,
+    429 and 5xx replies are retried OWM_RETRIES times with jittered exponential backoff, and a 429 also slows the
+    limiter down. A call that still fails counts against the circuit breaker; while it is open calls raise
+    CircuitOpenError straight away. Returns the decoded JSON of any other reply, including OWM's 404s.
+    """
+    session = session or get_session()
+    limiter = get_limiter()
+    breaker = get_breaker()
+    if not breaker.allow():
+        raise CircuitOpenError("OpenWeatherMap circuit is open")
+
+    error = None
+    try:
+        for attempt in range(settings.OWM_RETRIES + 1):
+            if attempt:
+                time.sleep(backoff_delay(attempt - 1, settings.OWM_BACKOFF))
+            limiter.acquire()
+            started = time.perf_counter()
+            try:
+                resp = session.get(f"{settings.OWM_API_URL}/{endpoint}", params=params,
+                                   timeout=settings.OWM_TIMEOUT)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                observe_outbound('owm', endpoint, type(e).__name__, time.perf_counter() - started)
+                error = e
+                continue
+            observe_outbound('owm', endpoint, resp.status_code, time.perf_counter() - started)
+            error = check_status(resp.status_code, limiter)
+            if error:
+                continue
+            payload = resp.json()
+            limiter.reward()
+            breaker.record_success()
+            return payload
+    except Exception:  # any other error must still settle a half-open circuit
+        breaker.record_failure()
+        raise
+
+    breaker.record_failure()
+    logging.error(f"OpenWeatherMap request to {endpoint} failed: {error!r}")
+    raise error
+
+
+async def arequest_owm(endpoint, params):
+    """
+    Async request_owm over the event loop's pooled client. It shares the rate limiter and circuit breaker with
+    the sync path; transport errors are raised as OWMUnavailable.
+    """
+    client = get_async_client()
+    limiter = get_limiter()
+    breaker = get_breaker()
+    if not breaker.allow():
+        raise CircuitOpenError("OpenWeatherMap circuit is open")
+
+    error = None
+    try:
+        for attempt in range(settings.OWM_RETRIES + 1):
+            if attempt:
+                await asyncio.sleep(backoff_delay(attempt - 1, settings.OWM_BACKOFF))
+            await limiter.aacquire()
+            started = time.perf_counter()
+            try:
+                resp = await client.get(f"{settings.OWM_API_URL}/{endpoint}", params=params)
+            except httpx.TransportError as e:
+                observe_outbound('owm', endpoint, type(e).__name__, time.perf_counter() - started)
+                error = OWMUnavailable(f"OpenWeatherMap unreachable: {e!r}")
+                continue
+            observe_outbound('owm', endpoint, resp.status_code, time.perf_counter() - started)
+            error = check_status(resp.status_code, limiter)
+            if error:
+                continue
+            payload = resp.json()
+            limiter.reward()
+            breaker.record_success()
+            return payload
+    except Exception:  # any other error must still settle a half-open circuit
+        breaker.record_failure()
+        raise
+
+    breaker.record_failure()
+    logging.error(f"OpenWeatherMap request to {endpoint} failed: {error!r}")
+    raise error
+
+
+def parse_weather(weather_resp):
+    return {
+        'weather_description': weather_resp['weather'][0]['description'],
+        'temperature': weather_resp['main']['temp'],
+        'feels_like': weather_resp['main']['feels_like'],
+        'humidity': weather_resp['main']['humidity'],
+        'pressure': weather_resp['main']['pressure'],
+        'visibility': weather_resp['visibility'],
+        'wind_speed': weather_resp['wind']['speed'],
+        'clouds': weather_resp.get('clouds', {}).get('all', 0),
+        'rain': weather_resp.get('rain', {}).get('1h', 0),
+        'snow': weather_resp.get('snow', {}).get('1h', 0),
+    }
+
+
+def parse_location(weather_resp):
+    return {
+        'owm_id': weather_resp['id'],
+        'latitude': weather_resp['coord']['lat'],
+        'longitude': weather_resp['coord']['lon'],
+        'geohash': encode(weather_resp['coord']['lat'], weather_resp['coord']['lon']),
+    }
+
+
+def weather_params(city_data):
+    return {
+        'q': f"{city_data['name']},{city_data['state']},{city_data['country_code']}",
+        'appid': settings.OWM_TOKEN,
+        'units': 'metric',
+    }
+
+
+def weather_result(weather_resp):
+    if weather_resp['cod'] != 200:
+        res = {'message': weather_resp['message']}
+        code = weather_resp['cod']
+    else:
+        res = parse_weather(weather_resp)
+        res['location'] = parse_location(weather_resp)
+        code = 200
+
+    return res, code
+
+
+def coordinates_params(latitude, longitude):
+    return {
+        'lat': latitude,
+        'lon': longitude,
+        'appid': settings.OWM_TOKEN,
+        'units': 'metric',
+    }
+
+
+def weather_at_result(weather_resp):
+    """weather_result of a lookup by coordinates, with the city OWM places there as 'city'."""
+    res, code = weather_result(weather_resp)
+    if code == 200:
+        if not weather_resp.get('name'):
+            return {'message': 'no city at these coordinates'}, 404
+        res['city'] = {'name': weather_resp['name'], 'state': '', 'country_code': weather_resp['sys']['country']}
+    return res, code
+
+
+def get_weather(city_data, session=None):
+    return weather_result(request_owm('weather', weather_params(city_data), session=session))
+
+
+async def aget_weather(city_data):
+    return weather_result(await arequest_owm('weather', weather_params(city_data)))
+
+
+def get_weather_at(latitude, longitude, session=None):
+    return weather_at_result(request_owm('weather', coordinates_params(latitude, longitude), session=session))
+
+
+def get_weather_group(owm_ids, session=None):
+    """
+    Current weather for up to settings.OWM_GROUP_SIZE cities in one call to the group endpoint.
+
+    Returns ({owm_id: weather_data}, code). Ids OWM does not know are missing from the result.
+    """
+    params = {
+        'id': ','.join(str(owm_id) for owm_id in owm_ids),
+        'appid': settings.OWM_TOKEN,
+        'units': 'metric',
+    }
+    group_resp = request_owm('group', params, session=session)
+
+    if 'list' not in group_resp:
+        return {'message': group_resp.get('message', 'unexpected response')}, int(group_resp.get('cod', 0))
+    return {weather_resp['id']: parse_weather(weather_resp) for weather_resp in group_resp['list']}, 200
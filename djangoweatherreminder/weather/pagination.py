@@ -0,0 +1,10 @@
+from django.conf import settings
+from rest_framework.pagination import CursorPagination
+
+
+class SubscriptionCursorPagination(CursorPagination):
+    # keyset pagination over (user, id), served by the usersubscription user/id index
+    ordering = 'id'
+    page_size = settings.SUBSCRIPTIONS_PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = settings.SUBSCRIPTIONS_MAX_PAGE_SIZE
@@ -0,0 +1,80 @@
+import logging
+
+from django.db import transaction
+from django.utils import timezone
+
+from .models import CityWeather, WeatherObservation
+
+# field -> type for a parsed OWM payload, see owm.parse_weather
+WEATHER_SCHEMA = {
+    'weather_description': str,
+    'temperature': float,
+    'feels_like': float,
+    'humidity': float,
+    'pressure': float,
+    'visibility': float,
+    'wind_speed': float,
+    'clouds': float,
+    'rain': float,
+    'snow': float,
+}
+# the numeric fields, recorded in the weather history
+HISTORY_FIELDS = [field for field, field_type in WEATHER_SCHEMA.items() if field_type is float]
+
+BULK_BATCH_SIZE = 500
+
+
+def clean_weather(weather_data):
+    """Coerce a weather payload to WEATHER_SCHEMA types. Raises ValueError if a field is missing or malformed."""
+    cleaned = {}
+    for field, field_type in WEATHER_SCHEMA.items():
+        value = weather_data.get(field)
+        if value is None or isinstance(value, bool):
+            raise ValueError(f"{field}: invalid value {value!r}")
+        try:
+            cleaned[field] = field_type(value)
+        except (TypeError, ValueError):
+            raise ValueError(f"{field}: invalid value {value!r}")
+    if len(cleaned['weather_description']) > CityWeather._meta.get_field('weather_description').max_length:
+        raise ValueError("weather_description: too long")
+    return cleaned
+
+
+def save_weathers(city_weathers, results):
+    """
+    Write fetched weather onto CityWeather instances with bulk_update and append it to the weather history.
+
+    `results` maps CityWeather pk -> (weather_data, code) as returned by fetcher.fetch_weather_many.
+    Rows whose fetch failed or whose payload does not validate are skipped.
+    """
+    now = timezone.now()
+    changed = []
+    skipped = 0
+    for city_weather in city_weathers:
+        weather_data, code = results.get(city_weather.pk, ({'message': 'not fetched'}, None))
+        if code != 200:
+            logging.error(f"{weather_data['message']}, 'code': {code}")
+            skipped += 1
+            continue
+        try:
+            cleaned = clean_weather(weather_data)
+        except ValueError as e:
+            logging.error(f"city weather {city_weather.pk}: {e}")
+            skipped += 1
+            continue
+        for field, value in cleaned.items():
+            setattr(city_weather, field, value)
+        city_weather.last_info_update = now  # bulk_update bypasses auto_now
+        changed.append(city_weather)
+
+    with transaction.atomic():
+        CityWeather.objects.bulk_update(changed, fields=[*WEATHER_SCHEMA, 'last_info_update'],
+                                        batch_size=BULK_BATCH_SIZE)
+        WeatherObservation.objects.bulk_create(
+            [WeatherObservation(city_id=city_weather.city_id, observed_at=now,
+                                **{field: getattr(city_weather, field) for field in HISTORY_FIELDS})
+             for city_weather in changed], batch_size=BULK_BATCH_SIZE)
+
+    counts = {'written': len(changed), 'skipped': skipped}
+    logging.info(f"weather rows saved: {counts}")
+    return counts
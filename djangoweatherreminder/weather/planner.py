@@ -0,0 +1,32 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Exists, Min, OuterRef, Q
+
+from .models import AlertRule, CityWeather, UserSubscription
+
+
+def plan_weather_refresh(now):
+    """
+    Decide which cities the hourly run refetches.
+
+    A city's weather is only needed when a report goes out, for its alert rules and for the hourly readings the
+    digests of daily and less frequent subscribers are computed from, so per city this takes the earliest
+    next_notification_at of its subscribers. Cities with a subscriber due by `now`, with alert rules or with a
+    digest subscriber are refetched if their weather is older than WEATHER_MAX_AGE; the rest are skipped until a
+    later run.
+    Returns (stale, fresh, skipped): ids of the CityWeather rows to refetch, ids of the due ones whose
+    weather is recent enough to report as is, and the number of cities not refetched.
+    """
+    stale_before = now - timedelta(seconds=settings.WEATHER_MAX_AGE)
+    due = CityWeather.objects.annotate(
+        next_notification_at=Min('subscriptions__next_notification_at'),
+        has_alerts=Exists(AlertRule.objects.filter(subscription__weather_info=OuterRef('pk'))),
+        has_digests=Exists(UserSubscription.objects.filter(weather_info=OuterRef('pk'),
+                                                           notification_frequency__gte=settings.DIGEST_MIN_FREQUENCY)),
+    ).filter(Q(next_notification_at__lte=now) | Q(has_alerts=True) | Q(has_digests=True)) \
+        .order_by('pk').values_list('pk', 'last_info_update')
+    stale, fresh = [], []
+    for city_weather_id, last_info_update in due:
+        (stale if last_info_update < stale_before else fresh).append(city_weather_id)
+    return stale, fresh, CityWeather.objects.count() - len(stale)
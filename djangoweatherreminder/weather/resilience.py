@@ -0,0 +1,226 @@
+import asyncio
+import logging
+import random
+import threading
+import time
+
+from django.conf import settings
+
+try:
+    import redis
+except ImportError:  # redis is only needed for the shared limiter
+    redis = None
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class TokenBucket:
+    """
+    Process-local token bucket: `rate` requests per second on average, bursts of up to `capacity`.
+
+    The rate adapts to the upstream: penalize() halves it (down to `min_rate`) when OWM throttles us, reward()
+    raises it back towards the configured rate by 10% of it per successful call.
+    """
+
+    def __init__(self, rate, capacity, min_rate=None):
+        self.max_rate = rate
+        self.min_rate = min_rate or rate / 16
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.throttled = 0
+        self.lock = threading.Lock()
+
+    def reserve(self):
+        """Take a token, returning how long to wait before it may be used."""
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            if self.tokens >= 0:
+                return 0
+            self.throttled += 1
+            return -self.tokens / self.rate
+
+    def acquire(self):
+        wait = self.reserve()
+        if wait:
+            time.sleep(wait)
+
+    async def aacquire(self):
+        wait = self.reserve()
+        if wait:
+            await asyncio.sleep(wait)
+
+    def penalize(self):
+        with self.lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+
+    def reward(self):
+        with self.lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 10)
+
+    def metrics(self):
+        with self.lock:
+            return {'backend': 'local', 'rate': self.rate, 'capacity': self.capacity,
+                    'tokens': round(max(self.tokens, 0), 2), 'throttled': self.throttled}
+
+
+# refill and take one token atomically; returns the seconds to wait when the bucket is empty
+TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(state[1]) or capacity
+local updated = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + (now - updated) * rate)
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+return tostring(wait)
+"""
+
+
+class RedisTokenBucket(TokenBucket):
+    """Token bucket shared by every process that uses the same Redis `key`, e.g. all web and worker dynos."""
+
+    def __init__(self, url, key, rate, capacity, min_rate=None):
+        if redis is None:
+            raise RuntimeError("the redis package is required for the Redis rate limiter")
+        super().__init__(rate, capacity, min_rate)
+        self.key = key
+        self.client = redis.Redis.from_url(url)
+        self.script = self.client.register_script(TOKEN_BUCKET_SCRIPT)
+
+    def reserve(self):
+        wait = float(self.script(keys=[self.key], args=[self.rate, self.capacity]))
+        if wait:
+            with self.lock:
+                self.throttled += 1
+        return wait
+
+    def acquire(self):
+        while True:
+            wait = self.reserve()
+            if not wait:
+                return
+            time.sleep(wait)
+
+    async def aacquire(self):
+        while True:
+            wait = await asyncio.to_thread(self.reserve)
+            if not wait:
+                return
+            await asyncio.sleep(wait)
+
+    def metrics(self):
+        """Like TokenBucket.metrics; `tokens` is None (unknown) while Redis is unreachable."""
+        try:
+            tokens = self.client.hget(self.key, 'tokens')
+            tokens = round(float(tokens), 2) if tokens is not None else self.capacity
+        except Exception as e:  # a Redis outage must not break /metrics
+            logging.error(f"rate limiter state read failed: {e!r}")
+            tokens = None
+        with self.lock:
+            return {'backend': 'redis', 'rate': self.rate, 'capacity': self.capacity, 'tokens': tokens,
+                    'throttled': self.throttled}
+
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive failed calls and rejects calls for `reset_timeout` seconds.
+    Then one trial call is let through (half-open): success closes the circuit, failure opens it again. A trial
+    that never reports back does not hold the circuit half-open: another one is let through `reset_timeout`
+    seconds later.
+    """
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+    def __init__(self, failure_threshold, reset_timeout):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self.rejected = 0
+        self.lock = threading.Lock()
+
+    def allow(self):
+        with self.lock:
+            if self.state in (self.OPEN, self.HALF_OPEN) and \
+                    time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                self.opened_at = time.monotonic()  # when the trial started
+                return True
+            if self.state == self.CLOSED:
+                return True
+            self.rejected += 1
+            return False
+
+    def record_success(self):
+        with self.lock:
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+    def metrics(self):
+        with self.lock:
+            return {'state': self.state, 'failures': self.failures, 'rejected': self.rejected}
+
+
+def backoff_delay(attempt, base):
+    """Exponential backoff with full jitter."""
+    return random.uniform(0, base * 2 ** attempt)
+
+
+_limiter = None
+_breaker = None
+_lock = threading.Lock()
+
+
+def get_limiter():
+    global _limiter
+    with _lock:
+        if _limiter is None:
+            if settings.OWM_RATE_LIMIT_BACKEND == 'redis':
+                _limiter = RedisTokenBucket(settings.OWM_RATE_LIMIT_REDIS_URL, 'weather:owm:rate-limit',
+                                            settings.OWM_RATE_LIMIT, settings.OWM_RATE_BURST)
+            else:
+                _limiter = TokenBucket(settings.OWM_RATE_LIMIT, settings.OWM_RATE_BURST)
+        return _limiter
+
+
+def get_breaker():
+    global _breaker
+    with _lock:
+        if _breaker is None:
+            _breaker = CircuitBreaker(settings.OWM_BREAKER_THRESHOLD, settings.OWM_BREAKER_RESET_TIMEOUT)
+        return _breaker
+
+
+def reset():
+    """Drop the limiter and breaker so they are rebuilt from current settings."""
+    global _limiter, _breaker
+    with _lock:
+        _limiter = None
+        _breaker = None
+
+
+def resilience_metrics():
+    return {'rate_limiter': get_limiter().metrics(), 'circuit_breaker': get_breaker().metrics()}
@@ -1,6 +1,6 @@
 from rest_framework import serializers
 
-from .models import CityName, CityWeather, UserSubscription
+from .models import AlertRule, CityName, CityWeather, UserSubscription
 
 
 class CityNameSerializer(serializers.ModelSerializer):
@@ -32,4 +32,38 @@ class OneSubscriptionSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = UserSubscription
-        fields = ['city', 'notification_frequency', ]
\ No newline at end of file
+        fields = ['city', 'notification_frequency', ]
+
+
+class WeatherInfoSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = CityWeather
+        fields = ['last_info_update', 'weather_description', 'temperature', 'feels_like',
+                  'humidity', 'pressure', 'visibility', 'wind_speed', 'clouds', 'rain', 'snow', ]
+
+
+class SubscriptionListSerializer(serializers.ModelSerializer):
+    """Read serializer for subscription lists. `fields` limits the output, `include` opts into expansions."""
+    expandable_fields = ['weather', ]
+
+    city = CityNameSerializer(read_only=True)
+    weather = WeatherInfoSerializer(source='weather_info', read_only=True)
+
+    class Meta:
+        model = UserSubscription
+        fields = ['id', 'city', 'notification_frequency', 'weather', ]
+
+    def __init__(self, *args, fields=None, include=(), **kwargs):
+        super().__init__(*args, **kwargs)
+        for name in self.expandable_fields:
+            if name not in include:
+                self.fields.pop(name)
+        if fields:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+
+class AlertRuleSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = AlertRule
+        fields = ['id', 'field', 'operator', 'threshold', 'matching', 'last_triggered_at', ]
@@ -0,0 +1,83 @@
+import logging
+
+from django.conf import settings
+from django.db.models import Exists, OuterRef
+
+from .cache import count, get_cache, is_shared
+from .models import CityWeather, UserSubscription
+from .persistence import BULK_BATCH_SIZE
+from .serializers import CityWeatherSerializer
+from .utils import chunked
+
+
+def snapshot_cache_key(city_id):
+    return f"weather:snapshot:{city_id}"
+
+
+def serialize_snapshot(city_weather):
+    return {'id': city_weather.pk, **CityWeatherSerializer(city_weather).data}
+
+
+def store_snapshots(city_weathers):
+    """Write the snapshots of CityWeather rows to the cache. Returns them as {city_id: snapshot}."""
+    snapshots = {city_weather.city_id: serialize_snapshot(city_weather) for city_weather in city_weathers}
+    try:
+        get_cache().set_many({snapshot_cache_key(city_id): snapshot for city_id, snapshot in snapshots.items()},
+                             settings.WEATHER_SNAPSHOT_TTL)
+    except Exception as e:
+        logging.error(f"weather snapshot cache set failed: {e!r}")
+    return snapshots
+
+
+def load_city_weathers(city_ids):
+    """Latest weather of many cities read from the database with one query, bypassing the cache, and cached."""
+    return store_snapshots(CityWeather.objects.filter(city__in=set(city_ids)))
+
+
+def get_city_weathers(city_ids):
+    """
+    Latest weather of many cities as serialized CityWeather snapshots: {city_id: snapshot}.
+
+    Read-through: cached snapshots are served from the weather cache, the rest are read with one query and
+    cached. Cities without a CityWeather row are missing from the result.
+    """
+    city_ids = set(city_ids)
+    keys = {snapshot_cache_key(city_id): city_id for city_id in city_ids}
+    try:
+        cached = get_cache().get_many(keys)
+    except Exception as e:  # a cache outage must not break the request
+        logging.error(f"weather snapshot cache get failed: {e!r}")
+        cached = {}
+
+    snapshots = {keys[key]: snapshot for key, snapshot in cached.items()}
+    missing = city_ids - set(snapshots)
+    count('snapshot_hits', len(snapshots))
+    count('snapshot_misses', len(missing))
+    if missing:
+        snapshots.update(load_city_weathers(missing))
+    return snapshots
+
+
+def get_report_weathers(city_ids):
+    """
+    Latest weather of many cities for the notifier: read through the cache when it is shared, since every
+    refresh rewrites the snapshots there. A process-local cache only has fresh snapshots in the process that ran
+    the refresh, and a report must not go out with weather up to WEATHER_SNAPSHOT_TTL old, so then the weather is
+    read from the database.
+    """
+    if is_shared(get_cache()):
+        return get_city_weathers(city_ids)
+    return load_city_weathers(city_ids)
+
+
+def get_city_weather(city_id):
+    """Latest weather of one city as a serialized CityWeather snapshot, or None if it has no weather row."""
+    return get_city_weathers([city_id]).get(city_id)
+
+
+def warm_snapshots():
+    """Preload the snapshots of every city somebody is subscribed to. Returns the number of cities cached."""
+    subscribed = list(CityWeather.objects.filter(Exists(UserSubscription.objects.filter(city=OuterRef('city')))))
+    for batch in chunked(subscribed, BULK_BATCH_SIZE):
+        store_snapshots(batch)
+    return len(subscribed)
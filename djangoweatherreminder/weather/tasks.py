@@ -1,74 +1,281 @@
-from celery import shared_task
+from celery import group, shared_task
 from celery.schedules import crontab
+from collections import defaultdict
 from datetime import datetime, timedelta
+from functools import lru_cache
 from django.utils import timezone
-from django.template.loader import render_to_string
-from django.core.mail import send_mail
+from django.template.loader import get_template
+from django.core.mail import EmailMultiAlternatives
 from django.conf import settings
+from django.db.models import Exists, OuterRef
 import logging
 
-from .models import CityName, CityWeather, UserSubscription
-from .views import get_weather
-from .serializers import CityNameSerializer, CityWeatherSerializer, UserSubscriptionSerializer
-
-
-def update_weather_table():
-    all_cities = CityName.objects.all()
-    for city in all_cities:
-        city_weather = CityWeather.objects.get(city=city)
-        city_data = CityNameSerializer(city).data
-        weather_data, code = get_weather(city_data)
-        if code != 200:
-            logging.error(f"{weather_data['message']}, 'code': {code}")
-        else:
-            city_weather_serializer = CityWeatherSerializer(instance=city_weather, data=weather_data, partial=True)
-            if city_weather_serializer.is_valid():
-                city_weather_serializer.save()
-            else:
-                logging.error(f"{city_weather_serializer.errors}")
-
-
-def send_email(weather_data, city_data, user):
-    del weather_data['city']
-    del weather_data['last_info_update']
-
-    email_subject = "Weather report"
-    email_body = render_to_string('weather/weather_report_template.html', {
+from .models import AlertRule, CityName, CityWeather, Notification, UserSubscription
+from .alerts import evaluate_alerts
+from .digests import get_digests
+from .fetcher import fetch_city_weathers
+from .history import compact_history
+from .instrumentation import span
+from .mailer import send_in_batches
+from .outbox import claim_notifications, claim_token, delete_old_notifications, enqueue_notifications, \
+    finish_notifications, message_id, renew_claims, retryable, run_id
+from .persistence import BULK_BATCH_SIZE, save_weathers
+from .planner import plan_weather_refresh
+from .serializers import CityNameSerializer
+from .snapshots import get_report_weathers, store_snapshots
+from .utils import chunked
+
+
+@span('update_weather_table')
+def update_weather_table(city_weather_ids=None):
+    city_weathers = CityWeather.objects.select_related('city')
+    if city_weather_ids is not None:
+        city_weathers = city_weathers.filter(pk__in=city_weather_ids)
+    city_weathers = list(city_weathers)
+    results, located, report = fetch_city_weathers(city_weathers)
+    report.update(save_weathers(city_weathers, results))
+    store_snapshots(city_weathers)
+    CityName.objects.bulk_update(located, fields=['owm_id', 'latitude', 'longitude', 'geohash'],
+                                 batch_size=BULK_BATCH_SIZE)
+    triggered = evaluate_alerts([city_weather.pk for city_weather in city_weathers], timezone.now())
+    if triggered:
+        group(send_alerts.s(shard) for shard in chunked(triggered, settings.NOTIFICATION_SHARD_SIZE)).apply_async()
+    report['alerts'] = len(triggered)
+    return report
+
+
+REPORT_TEMPLATE = 'weather/weather_report_template.html'
+
+
+@lru_cache(maxsize=None)
+def get_report_template():
+    """The report template, compiled once per process."""
+    return get_template(REPORT_TEMPLATE)
+
+
+def render_report(weather_data, city_data, digest=None, digest_hours=None, alerts=()):
+    weather_data = {field: value for field, value in weather_data.items()
+                    if field not in ('id', 'city', 'last_info_update')}
+    return get_report_template().render({
         'weather_data': weather_data,
         'city_data': city_data,
-    }, )
-    send_mail(
-        subject=email_subject,
-        message="weather report",
-        html_message=email_body,
+        'digest': digest,
+        'digest_hours': digest_hours,
+        'alerts': alerts,
+    })
+
+
+def build_report_email(email_body, user, subject="Weather report"):
+    message = EmailMultiAlternatives(
+        subject=subject,
+        body="weather report",
         from_email=settings.EMAIL_FROM_USER,
-        recipient_list=[user.email],
-        fail_silently=True,
+        to=[user.email],
     )
+    message.attach_alternative(email_body, 'text/html')
+    return message
+
+
+def digest_hours(subscription):
+    """Length of the digest window of a subscription, None if it gets no digest."""
+    if subscription.notification_frequency >= settings.DIGEST_MIN_FREQUENCY:
+        return subscription.notification_frequency
+    return None
+
+
+def get_subscription_digests(subscriptions, now):
+    """Digests of the subscriptions that get one, by (city id, window hours), one computation per window."""
+    cities_by_hours = defaultdict(set)
+    for subscription in subscriptions:
+        hours = digest_hours(subscription)
+        if hours:
+            cities_by_hours[hours].add(subscription.city_id)
+    return {(city_id, hours): digest for hours, city_ids in cities_by_hours.items()
+            for city_id, digest in get_digests(city_ids, hours, now).items()}
+
+
+def build_report_emails(subscriptions, snapshots, digests=None):
+    """
+    Report emails for subscriptions (with user and city selected), given the weather snapshots of their cities
+    and the digests of get_subscription_digests.
+
+    Every subscriber of a city with the same digest window gets the same report, so it is rendered once per
+    city and window and reused for all of them. Subscriptions of cities without weather are skipped. Returns
+    the emails by subscription pk and the number of reports rendered.
+    """
+    digests = digests or {}
+    email_bodies = {}
+    messages = {}
+    for subscription in subscriptions:
+        if subscription.city_id not in snapshots:
+            logging.error(f"no weather for city {subscription.city_id}, subscription {subscription.pk} skipped")
+            continue
+        report_key = subscription.city_id, digest_hours(subscription)
+        if report_key not in email_bodies:
+            email_bodies[report_key] = render_report(snapshots[subscription.city_id],
+                                                     CityNameSerializer(subscription.city).data,
+                                                     digests.get(report_key), report_key[1])
+        messages[subscription.pk] = build_report_email(email_bodies[report_key], subscription.user)
+    return messages, len(email_bodies)
+
+
+def get_due_subscriptions(now):
+    return UserSubscription.objects.filter(next_notification_at__lte=now).select_related('user', 'city')
+
+
+def deliver_notifications(notification_ids):
+    """
+    Send the reports of these outbox notifications and record each outcome.
+
+    Notifications are claimed first, so concurrent senders never deliver the same report, and each email
+    carries a Message-ID derived from the notification key. The claims are renewed after every batch, and a
+    batch only sends the reports whose notification this worker still holds, so one that retry_notifications
+    handed to another worker is neither sent twice nor finished here. The notifications whose message the server
+    accepted are marked sent; only the others go back to pending for retry_notifications, including the ones
+    left unsent when the email server is down.
+    """
+    now = timezone.now()
+    token = claim_token()
+    claimed = claim_notifications(notification_ids, now, token)
+    subscriptions = [notification.subscription for notification in claimed]
+    snapshots = get_report_weathers(subscription.city_id for subscription in subscriptions)
+    digests = get_subscription_digests(subscriptions, now)
+    messages, rendered = build_report_emails(subscriptions, snapshots, digests)
+    for notification in claimed:
+        message = messages.get(notification.subscription_id)
+        if message is not None:
+            message.extra_headers['Message-ID'] = message_id(notification.key)
+            message.notification_id = notification.pk
+
+    sent_ids = []
+    outstanding = {message.notification_id for message in messages.values()}
+    held = set(outstanding)
+
+    def held_messages(batch):
+        return [message for message in batch if message.notification_id in held]
+
+    def record_batch(batch, accepted):
+        nonlocal held
+        sent_ids.extend(message.notification_id for message in accepted)
+        outstanding.difference_update(message.notification_id for message in batch)
+        held = renew_claims(outstanding, token, timezone.now())
+
+    report = send_in_batches(list(messages.values()), before_batch=held_messages, on_batch=record_batch)
+    finished = set(sent_ids) | outstanding
+    finish_notifications(sent_ids, [notification.pk for notification in claimed if notification.pk not in finished],
+                         timezone.now(), token, unsent_ids=outstanding)
+    report['rendered'] = rendered
+    return report
 
 
-def update_subscriptions_table():
-    all_subscriptions = UserSubscription.objects.all()
-    for subscription in all_subscriptions:
-        time_delta = timezone.now() - subscription.last_info_update
-        if time_delta > timedelta(hours=subscription.notification_frequency):
-            weather_data = CityWeatherSerializer(subscription.weather_info).data
-            city_data = CityNameSerializer(subscription.city).data
-            send_email(weather_data=weather_data, city_data=city_data, user=subscription.user)
-            new_data = {
-                'last_info_update': timezone.now(),
-            }
-            subscription_serializer = UserSubscriptionSerializer(instance=subscription, data=new_data, partial=True)
-            if subscription_serializer.is_valid():
-                subscription_serializer.save()
-            else:
-                logging.error(f"{subscription_serializer.errors}")
+@span('update_subscriptions_table')
+def update_subscriptions_table(subscription_ids=None, run=None):
+    """Queue the reports of the due subscriptions in the notification outbox, then deliver them."""
+    now = timezone.now()
+    due_subscriptions = get_due_subscriptions(now)
+    if subscription_ids is not None:
+        due_subscriptions = due_subscriptions.filter(pk__in=subscription_ids)
+    notification_ids = enqueue_notifications(due_subscriptions, now, run or run_id(now))
+    return deliver_notifications(notification_ids)
+
+
+def delete_unused_cities():
+    """Delete cities nobody is subscribed to (with their weather) with one NOT EXISTS query."""
+    unused_cities = CityName.objects.filter(~Exists(UserSubscription.objects.filter(city=OuterRef('pk'))))
+    deleted, _ = unused_cities.delete()
+    return deleted
 
 
 @shared_task()
-def update_tables_and_send_emails():
-    update_weather_table()
-    update_subscriptions_table()
+def remove_unused_cities():
+    deleted = delete_unused_cities()
+    logging.info(f"removed {deleted} unused city rows")
+    return deleted
+
+
+@shared_task()
+def send_alerts(rule_ids):
+    """Email the subscribers of triggered alert rules, one email per subscription listing its rules."""
+    rules = AlertRule.objects.filter(pk__in=rule_ids).select_related('subscription__user', 'subscription__city')
+    rules_by_subscription = defaultdict(list)
+    for rule in rules:
+        rules_by_subscription[rule.subscription].append(rule)
+    snapshots = get_report_weathers(subscription.city_id for subscription in rules_by_subscription)
+
+    messages = [build_report_email(render_report(snapshots[subscription.city_id],
+                                                 CityNameSerializer(subscription.city).data,
+                                                 alerts=[str(rule) for rule in subscription_rules]),
+                                   subscription.user, subject="Weather alert")
+                for subscription, subscription_rules in rules_by_subscription.items()
+                if subscription.city_id in snapshots]
+    report = send_in_batches(messages)
+    return {key: report[key] for key in ('messages', 'sent', 'failed', 'unsent', 'seconds')}
+
+
+@shared_task()
+def compact_weather_history():
+    report = compact_history(timezone.now())
+    logging.info(f"weather history compacted: {report}")
+    return report
+
+
+@shared_task()
+def send_notifications_shard(subscription_ids, run=None):
+    report = update_subscriptions_table(subscription_ids, run)
+    return {key: report[key] for key in ('messages', 'sent', 'failed', 'unsent', 'seconds')}
 
 
+@shared_task()
+def deliver_notifications_shard(notification_ids):
+    report = deliver_notifications(notification_ids)
+    return {key: report[key] for key in ('messages', 'sent', 'failed', 'unsent', 'seconds')}
+
+
+@shared_task()
+def retry_notifications():
+    """Redeliver outbox notifications left pending or stuck sending, and delete old delivered ones."""
+    now = timezone.now()
+    notification_ids = list(Notification.objects.filter(retryable(now)).order_by('pk').values_list('pk', flat=True))
+    group(deliver_notifications_shard.s(shard)
+          for shard in chunked(notification_ids, settings.NOTIFICATION_SHARD_SIZE)).apply_async()
+    deleted = delete_old_notifications(now)
+    logging.info(f"retrying {len(notification_ids)} notifications, deleted {deleted} old ones")
+    return len(notification_ids)
+
+
+def dispatch_notifications(city_weather_ids, run=None):
+    """Send the due subscriptions of these cities in NOTIFICATION_SHARD_SIZE subtasks. Returns their number."""
+    due_ids = list(get_due_subscriptions(timezone.now()).filter(weather_info__in=city_weather_ids)
+                   .order_by('pk').values_list('pk', flat=True))
+    group(send_notifications_shard.s(shard, run) for shard in chunked(due_ids, settings.NOTIFICATION_SHARD_SIZE)) \
+        .apply_async()
+    return len(due_ids)
+
+
+@shared_task()
+def refresh_weather_shard(city_weather_ids, run=None):
+    """Refresh one shard of cities, then fan out notifications for the subscriptions of those cities."""
+    report = update_weather_table(city_weather_ids)
+    report['due_subscriptions'] = dispatch_notifications(city_weather_ids, run)
+    return report
+
+
+@shared_task()
+def update_tables_and_send_emails():
+    """
+    Hourly coordinator: refetches the cities plan_weather_refresh finds stale in shards of WEATHER_SHARD_SIZE,
+    dispatched as a group, and sends the due subscriptions of cities whose weather is still fresh right away.
 
+    Notifications are dispatched by each weather shard once its cities are refreshed, rather than by a
+    chord callback, because the rpc result backend does not support chords. Every report of the run is queued
+    in the notification outbox under the same run label, for delivery stats.
+    """
+    now = timezone.now()
+    run = run_id(now)
+    stale, fresh, skipped = plan_weather_refresh(now)
+    shards = list(chunked(stale, settings.WEATHER_SHARD_SIZE))
+    group(refresh_weather_shard.s(shard, run) for shard in shards).apply_async()
+    due = sum(dispatch_notifications(ids, run) for ids in chunked(fresh, settings.WEATHER_SHARD_SIZE))
+    logging.info(f"dispatched {len(shards)} weather shards for {len(stale)} cities, skipped {skipped} cities "
+                 f"({len(fresh)} with fresh weather, {due} subscriptions notified without a refetch)")
+    return len(shards)
@@ -0,0 +1,218 @@
+import json
+import socketserver
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+GROUP_SIZE = 20
+
+
+def fake_weather(name):
+    """Deterministic OWM-shaped current weather payload for a city name."""
+    seed = zlib.crc32(name.lower().encode())
+    return {
+        'cod': 200,
+        'id': seed % 10_000_000 + 1,
+        'name': name,
+        'coord': {'lat': round(seed % 18000 / 100 - 90, 4), 'lon': round(seed % 36000 / 100 - 180, 4)},
+        'weather': [{'description': ('clear sky', 'light rain', 'overcast clouds', 'snow')[seed % 4]}],
+        'main': {
+            'temp': round(seed % 400 / 10 - 10, 1),
+            'feels_like': round(seed % 400 / 10 - 12, 1),
+            'humidity': seed % 100,
+            'pressure': 990 + seed % 40,
+        },
+        'visibility': 10000,
+        'wind': {'speed': seed % 150 / 10},
+        'clouds': {'all': seed % 100},
+        'sys': {'country': 'UA'},
+    }
+
+
+class OWMStubHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        stub = self.server.stub
+        url = urlparse(self.path)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        with stub.lock:
+            stub.requests.append((url.path, query))
+        if stub.delay:
+            time.sleep(stub.delay)
+
+        if stub.fail_status:
+            self.respond(stub.fail_status, {'cod': str(stub.fail_status), 'message': 'stub failure'})
+        elif url.path.endswith('/weather') and 'q' in query:
+            name = query['q'].split(',')[0]
+            if name in stub.missing:
+                self.respond(404, {'cod': '404', 'message': 'city not found'})
+            else:
+                weather = fake_weather(name)
+                with stub.lock:
+                    stub.names_by_id[weather['id']] = name
+                self.respond(200, weather)
+        elif url.path.endswith('/weather') and 'lat' in query:
+            latitude, longitude = float(query['lat']), float(query['lon'])
+            weather = fake_weather(f"Place {latitude:.1f} {longitude:.1f}")
+            weather['coord'] = {'lat': latitude, 'lon': longitude}
+            with stub.lock:
+                stub.names_by_id[weather['id']] = weather['name']
+            self.respond(200, weather)
+        elif url.path.endswith('/group') and 'id' in query:
+            owm_ids = [int(owm_id) for owm_id in query['id'].split(',')]
+            if len(owm_ids) > GROUP_SIZE:
+                self.respond(400, {'cod': '400', 'message': 'Too many cities'})
+                return
+            with stub.lock:
+                names = [stub.names_by_id.get(owm_id) for owm_id in owm_ids]
+            weathers = [fake_weather(name) for name in names if name is not None]
+            self.respond(200, {'cnt': len(weathers), 'list': weathers})
+        else:
+            self.respond(400, {'cod': '400', 'message': 'bad request'})
+
+    def respond(self, code, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class OWMStubHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128  # the default backlog of 5 drops connections under concurrent fetches
+
+
+class OWMStubServer:
+    """
+    Local HTTP server emulating the OpenWeatherMap endpoints used by the app.
+
+    Every city resolves to deterministic fake weather except names listed in `missing`, which answer with
+    OWM's "city not found" error; a lookup by coordinates finds a city named after them, e.g. "Place 50.4 30.5".
+    The group endpoint knows the ids of the cities looked up by name so far
+    (or registered with `add_city`) and, like OWM, accepts at most 20 ids per call. `delay` adds per-request
+    latency and setting `fail_status` (e.g. 429 or 503) makes every request fail with it.
+    Point settings.OWM_API_URL at `url`.
+    """
+
+    def __init__(self, missing=('wrong-city',), delay=0):
+        self.missing = set(missing)
+        self.delay = delay
+        self.fail_status = None
+        self.requests = []
+        self.names_by_id = {}
+        self.lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/data/2.5"
+
+    def start(self):
+        self._server = OWMStubHTTPServer(('127.0.0.1', 0), OWMStubHandler)
+        self._server.stub = self
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def add_city(self, name):
+        weather = fake_weather(name)
+        with self.lock:
+            self.names_by_id[weather['id']] = name
+        return weather['id']
+
+    def reset(self):
+        with self.lock:
+            self.requests.clear()
+        self.fail_status = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+class SMTPStubHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        stub = self.server.stub
+        self.reply('220 stub ESMTP')
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode('ascii', 'replace').strip().split(' ', 1)[0].upper()
+            if command == 'DATA':
+                self.reply('354 end data with <CR><LF>.<CR><LF>')
+                while self.rfile.readline() not in (b'.\r\n', b''):
+                    pass
+                with stub.lock:
+                    stub.messages += 1
+                self.reply('250 OK')
+            elif command == 'QUIT':
+                self.reply('221 bye')
+                return
+            elif command in ('EHLO', 'HELO', 'MAIL', 'RCPT', 'RSET', 'NOOP'):
+                self.reply('250 OK')
+            else:
+                self.reply('502 command not implemented')
+
+    def reply(self, line):
+        self.wfile.write(f"{line}\r\n".encode())
+
+
+class SMTPStubTCPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class SMTPStubServer:
+    """
+    Local SMTP sink: accepts every message over plain SMTP (no TLS, no auth) and only counts them.
+    Point settings.EMAIL_HOST and EMAIL_PORT at `host` and `port` with EMAIL_USE_TLS off.
+    """
+
+    def __init__(self):
+        self.messages = 0
+        self.lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    @property
+    def host(self):
+        return self._server.server_address[0]
+
+    @property
+    def port(self):
+        return self._server.server_address[1]
+
+    def start(self):
+        self._server = SMTPStubTCPServer(('127.0.0.1', 0), SMTPStubHandler)
+        self._server.stub = self
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
@@ -1,7 +1,45 @@
 import pytest
+from celery import current_app
 from django.urls import reverse
 from rest_framework.test import APIClient
 
+from weather import resilience
+from weather.cache import get_cache
+from weather.models import CityName, CityWeather, UserSubscription
+from weather.testing import OWMStubServer
+
+
+@pytest.fixture(scope='session')
+def owm_server():
+    with OWMStubServer() as server:
+        yield server
+
+
+@pytest.fixture(autouse=True)
+def owm_stub(settings, owm_server):
+    settings.OWM_API_URL = owm_server.url
+    settings.OWM_RATE_LIMIT_BACKEND = 'local'
+    settings.OWM_RATE_LIMIT = settings.OWM_RATE_BURST = 1000
+    owm_server.reset()
+    resilience.reset()
+    yield owm_server
+    resilience.reset()
+
+
+@pytest.fixture(autouse=True)
+def clear_weather_cache():
+    get_cache().clear()
+
+
+@pytest.fixture
+def celery_eager():
+    # the app reads Django settings with the CELERY namespace, so override the namespaced keys
+    conf = current_app.conf
+    previous = conf.CELERY_TASK_ALWAYS_EAGER, conf.get('CELERY_TASK_EAGER_PROPAGATES', False)
+    conf.CELERY_TASK_ALWAYS_EAGER, conf.CELERY_TASK_EAGER_PROPAGATES = True, True
+    yield
+    conf.CELERY_TASK_ALWAYS_EAGER, conf.CELERY_TASK_EAGER_PROPAGATES = previous
+
 
 @pytest.fixture
 def api_client():
@@ -17,6 +55,26 @@ def create_user(db, django_user_model):
     return make_user
 
 
+@pytest.fixture
+def create_city(db):
+    def make_city(name, country_code='UA', state=''):
+        city = CityName.objects.create(name=name, state=state, country_code=country_code)
+        CityWeather.objects.create(city=city, weather_description='unknown', temperature=0, feels_like=0, humidity=0,
+                                   pressure=0, visibility=0, wind_speed=0, clouds=0, rain=0, snow=0)
+        return city
+
+    return make_city
+
+
+@pytest.fixture
+def create_subscription(db):
+    def make_subscription(user, city, notification_frequency=2):
+        return UserSubscription.objects.create(user=user, city=city, weather_info=city.weather.get(),
+                                               notification_frequency=notification_frequency)
+
+    return make_subscription
+
+
 @pytest.fixture
 def api_client_with_authenticated_user(db, api_client, create_user):
     user = create_user(email='test_user@example.com')
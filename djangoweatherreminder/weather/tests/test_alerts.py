@@ -0,0 +1,111 @@
+import pytest
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.core import mail
+from django.urls import reverse
+from django.utils import timezone
+
+from weather.alerts import evaluate_alerts
+from weather.models import AlertRule, CityWeather, UserSubscription
+from weather.planner import plan_weather_refresh
+from weather.tasks import update_weather_table
+from weather.testing import fake_weather
+
+
+@pytest.mark.django_db
+def test_alert_rules_trigger_when_they_start_to_match(create_user, create_city, create_subscription,
+                                                      django_assert_max_num_queries):
+    user = create_user(email='user@example.com')
+    kyiv = create_subscription(user, create_city('Kyiv'))
+    lviv = create_subscription(user, create_city('Lviv'))
+    rain = AlertRule.objects.create(subscription=kyiv, field='rain', operator='gt', threshold=0)
+    frost = AlertRule.objects.create(subscription=kyiv, field='temperature', operator='lt', threshold=0)
+    lviv_rain = AlertRule.objects.create(subscription=lviv, field='rain', operator='gte', threshold=1)
+    city_weathers = list(CityWeather.objects.values_list('pk', flat=True))
+
+    def evaluate(**weather):
+        CityWeather.objects.filter(pk=kyiv.weather_info_id).update(**weather)
+        return sorted(evaluate_alerts(city_weathers, timezone.now()))
+
+    CityWeather.objects.filter(pk=kyiv.weather_info_id).update(rain=2, temperature=-3)
+    with django_assert_max_num_queries(7):  # fields, one query per field, two updates in a savepoint
+        assert sorted(evaluate_alerts(city_weathers, timezone.now())) == [rain.pk, frost.pk]
+    assert evaluate(rain=3, temperature=-3) == []
+    assert evaluate(rain=0, temperature=-3) == []
+    assert evaluate(rain=1, temperature=5) == [rain.pk]
+    assert not AlertRule.objects.get(pk=frost.pk).matching
+    assert not AlertRule.objects.get(pk=lviv_rain.pk).matching
+
+
+@pytest.mark.django_db
+def test_refresh_emails_triggered_alerts(celery_eager, create_user, create_city, create_subscription):
+    user = create_user(email='user@example.com')
+    subscription = create_subscription(user, create_city('Kyiv'))
+    temperature = fake_weather('Kyiv')['main']['temp']
+    AlertRule.objects.create(subscription=subscription, field='temperature', operator='gte', threshold=temperature)
+    AlertRule.objects.create(subscription=subscription, field='temperature', operator='lt', threshold=temperature)
+
+    report = update_weather_table()
+
+    assert report['alerts'] == 1
+    [message] = mail.outbox
+    assert message.subject == 'Weather alert'
+    assert f"temperature &gt;= {temperature:g}" in message.alternatives[0][0]
+
+    mail.outbox.clear()
+    assert update_weather_table()['alerts'] == 0
+    assert not mail.outbox
+
+
+@pytest.mark.django_db
+def test_cities_with_alert_rules_are_refreshed_without_due_subscribers(create_user, create_city,
+                                                                       create_subscription):
+    user = create_user(email='user@example.com')
+    watched = create_subscription(user, create_city('Kyiv'))
+    create_subscription(user, create_city('Lviv'))
+    AlertRule.objects.create(subscription=watched, field='snow', operator='gt', threshold=0)
+    CityWeather.objects.update(last_info_update=timezone.now() - timedelta(hours=1))
+
+    assert plan_weather_refresh(timezone.now()) == ([watched.weather_info_id], [], 1)
+
+
+@pytest.mark.django_db
+def test_alert_rules_api(api_client_with_authenticated_user, subscription):
+    subscription = UserSubscription.objects.get()
+    url = reverse('subscription_alerts', kwargs={'id': subscription.pk})
+
+    response = api_client_with_authenticated_user.post(url, {'field': 'rain', 'operator': 'gt', 'threshold': 0},
+                                                       format='json')
+    assert response.status_code == 201
+    rule_id = response.data['id']
+    assert api_client_with_authenticated_user.get(url).data == [
+        {'id': rule_id, 'field': 'rain', 'operator': 'gt', 'threshold': 0.0, 'matching': False,
+         'last_triggered_at': None},
+    ]
+
+    response = api_client_with_authenticated_user.post(url, {'field': 'mood', 'operator': 'eq', 'threshold': 'x'},
+                                                       format='json')
+    assert response.status_code == 400
+    assert set(response.data['errors']) == {'field', 'operator', 'threshold'}
+
+    response = api_client_with_authenticated_user.delete(
+        reverse('alert_rule', kwargs={'id': subscription.pk, 'rule_id': rule_id}))
+    assert response.status_code == 200
+    assert not AlertRule.objects.exists()
+
+
+@pytest.mark.django_db
+def test_alert_rules_of_other_users_are_hidden(api_client_with_authenticated_user, create_city,
+                                               create_subscription):
+    other = create_subscription(get_user_model().objects.create(email='other@example.com'), create_city('Kyiv'))
+    rule = AlertRule.objects.create(subscription=other, field='rain', operator='gt', threshold=0)
+
+    url = reverse('subscription_alerts', kwargs={'id': other.pk})
+    assert api_client_with_authenticated_user.get(url).status_code == 400
+    assert api_client_with_authenticated_user.post(url, {'field': 'rain', 'operator': 'gt', 'threshold': 0},
+                                                   format='json').status_code == 400
+    response = api_client_with_authenticated_user.delete(
+        reverse('alert_rule', kwargs={'id': other.pk, 'rule_id': rule.pk}))
+    assert response.status_code == 400
+    assert AlertRule.objects.filter(pk=rule.pk).exists()
@@ -0,0 +1,90 @@
+import asyncio
+
+import pytest
+from asgiref.sync import async_to_sync
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from weather.cache import aget_weather_cached
+from weather.models import CityName, UserSubscription
+
+
+def subscription_data(name, notification_frequency=2):
+    return {"city": {"name": name, "state": "", "country_code": "UA"},
+            "notification_frequency": notification_frequency}
+
+
+@pytest.mark.django_db
+def test_async_new_subscription(api_client_with_authenticated_user):
+    url = reverse('new_subscription_async')
+
+    response = api_client_with_authenticated_user.post(url, subscription_data('Kharkiv'), format='json')
+    assert response.status_code == 201
+    assert response.json()['res'] == 'New subscription created successfully'
+    assert CityName.objects.get(name='Kharkiv').owm_id is not None
+    assert UserSubscription.objects.get().next_notification_at is not None
+
+    response = api_client_with_authenticated_user.post(url, subscription_data('kharkiv'), format='json')
+    assert response.status_code == 400
+    assert UserSubscription.objects.count() == 1
+
+
+@pytest.mark.django_db
+def test_async_new_subscription_errors(api_client_with_authenticated_user):
+    url = reverse('new_subscription_async')
+
+    response = api_client_with_authenticated_user.post(url, subscription_data('wrong-city'), format='json')
+    assert response.status_code == 404
+
+    response = api_client_with_authenticated_user.post(url, {"city": {"name": "Kyiv"}}, format='json')
+    assert response.status_code == 400
+
+    response = APIClient().post(url, subscription_data('Kyiv'), format='json')
+    assert response.status_code == 401
+
+
+@pytest.mark.django_db
+def test_async_edit_and_delete_subscription(api_client_with_authenticated_user, subscription):
+    subscription = UserSubscription.objects.get()
+    url = reverse('subscription_action_async', kwargs={'id': subscription.pk})
+
+    response = api_client_with_authenticated_user.put(url, subscription_data('Lviv', 6), format='json')
+    assert response.status_code == 200
+    subscription.refresh_from_db()
+    assert subscription.city.name == 'Lviv'
+    assert subscription.notification_frequency == 6
+    assert not CityName.objects.filter(name='Kyiv').exists()
+
+    response = api_client_with_authenticated_user.delete(url)
+    assert response.status_code == 200
+    assert not UserSubscription.objects.exists()
+
+    response = api_client_with_authenticated_user.delete(url)
+    assert response.status_code == 404
+
+
+def test_async_concurrent_misses_share_one_request(owm_stub):
+    city_data = {'name': 'Odesa', 'state': '', 'country_code': 'UA'}
+
+    async def fetch_concurrently():
+        return await asyncio.gather(*(aget_weather_cached(city_data) for _ in range(10)))
+
+    results = async_to_sync(fetch_concurrently)()
+
+    assert all(code == 200 for _, code in results)
+    assert len(owm_stub.requests) == 1
+
+
+@pytest.mark.django_db
+def test_async_new_subscription_rejects_malformed_weather(api_client_with_authenticated_user, monkeypatch):
+    async def malformed_weather(city_data):
+        return {'weather_description': 'clear sky', 'temperature': 'hot'}, 200
+
+    monkeypatch.setattr('weather.async_views.aget_weather_or_snapshot', malformed_weather)
+
+    response = api_client_with_authenticated_user.post(reverse('new_subscription_async'), subscription_data('Kyiv'),
+                                                       format='json')
+
+    assert response.status_code == 502
+    assert response.json()['code'] == 502
+    assert not UserSubscription.objects.exists()
@@ -0,0 +1,91 @@
+from concurrent.futures import ThreadPoolExecutor
+from io import StringIO
+
+import pytest
+from django.core.management import call_command
+
+from weather.cache import cache_stats, get_weather_cached, weather_cache_key
+from weather.snapshots import get_city_weather, get_city_weathers
+from weather.tasks import update_weather_table
+from weather.testing import OWMStubServer, fake_weather
+
+
+def test_cache_key_is_normalized():
+    assert weather_cache_key({'name': ' Kyiv', 'state': '', 'country_code': 'ua'}) == \
+           weather_cache_key({'name': 'KYIV', 'state': '', 'country_code': 'UA'})
+
+
+def test_get_weather_cached(owm_stub):
+    city_data = {'name': 'Kyiv', 'state': '', 'country_code': 'UA'}
+    before = cache_stats()
+
+    first, code = get_weather_cached(city_data)
+    second, _ = get_weather_cached(dict(city_data, name='kyiv'))
+
+    assert code == 200
+    assert first == second
+    assert len(owm_stub.requests) == 1
+    after = cache_stats()
+    assert after['hits'] - before['hits'] == 1
+    assert after['misses'] - before['misses'] == 1
+
+
+def test_get_weather_cached_skips_errors(owm_stub):
+    city_data = {'name': 'wrong-city', 'state': '', 'country_code': 'UA'}
+
+    assert get_weather_cached(city_data)[1] != 200
+    assert get_weather_cached(city_data)[1] != 200
+    assert len(owm_stub.requests) == 2
+
+
+def test_get_weather_cached_single_flight(settings):
+    with OWMStubServer(delay=0.2) as server:
+        settings.OWM_API_URL = server.url
+        city_data = {'name': 'Lviv', 'state': '', 'country_code': 'UA'}
+        with ThreadPoolExecutor(max_workers=10) as executor:
+            results = list(executor.map(lambda _: get_weather_cached(city_data), range(10)))
+
+    assert len(server.requests) == 1
+    assert all(code == 200 for _, code in results)
+
+
+@pytest.mark.django_db
+def test_city_weather_snapshots_read_through(create_city, django_assert_num_queries):
+    kyiv = create_city('Kyiv')
+    before = cache_stats()
+
+    with django_assert_num_queries(1):
+        assert get_city_weather(kyiv.pk)['weather_description'] == 'unknown'
+    with django_assert_num_queries(0):
+        assert list(get_city_weathers([kyiv.pk])) == [kyiv.pk]
+    assert get_city_weathers([0]) == {}  # cities without weather are not cached
+
+    after = cache_stats()
+    assert after['snapshot_hits'] - before['snapshot_hits'] == 1
+    assert after['snapshot_misses'] - before['snapshot_misses'] == 2
+    assert after['snapshot_hit_ratio'] is not None
+
+
+@pytest.mark.django_db
+def test_weather_refresh_rewrites_snapshots(owm_stub, create_city):
+    kyiv = create_city('Kyiv')
+    assert get_city_weather(kyiv.pk)['weather_description'] == 'unknown'
+
+    update_weather_table()
+
+    assert get_city_weather(kyiv.pk)['weather_description'] == fake_weather('Kyiv')['weather'][0]['description']
+
+
+@pytest.mark.django_db
+def test_warm_weather_cache_command(create_user, create_city, create_subscription, django_assert_num_queries):
+    user = create_user(email='user@example.com')
+    cities = [create_city(f'city-{i}') for i in range(3)]
+    create_subscription(user, cities[0])
+    create_subscription(user, cities[1])
+
+    call_command('warm_weather_cache', stdout=StringIO())
+
+    with django_assert_num_queries(0):
+        assert set(get_city_weathers([cities[0].pk, cities[1].pk])) == {cities[0].pk, cities[1].pk}
+    with django_assert_num_queries(1):
+        get_city_weather(cities[2].pk)
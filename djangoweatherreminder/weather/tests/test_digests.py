@@ -0,0 +1,95 @@
+import pytest
+from datetime import timedelta
+
+from django.core import mail
+from django.utils import timezone
+
+from weather.digests import compute_digests, get_digests
+from weather.models import CityWeather, UserSubscription, WeatherAggregate, WeatherObservation
+from weather.persistence import HISTORY_FIELDS
+from weather.planner import plan_weather_refresh
+from weather.tasks import update_subscriptions_table, update_tables_and_send_emails
+
+
+def observe(city, observed_at, temperature, rain=0, wind_speed=1):
+    fields = {field: 0 for field in HISTORY_FIELDS}
+    fields.update(temperature=temperature, rain=rain, wind_speed=wind_speed)
+    return WeatherObservation.objects.create(city=city, observed_at=observed_at, **fields)
+
+
+@pytest.mark.django_db
+def test_compute_digests_combines_readings_and_aggregates(create_city):
+    kyiv, lviv = create_city('Kyiv'), create_city('Lviv')
+    end = timezone.now().replace(minute=0, second=0, microsecond=0)
+    start = end - timedelta(days=10)
+    observe(kyiv, end - timedelta(hours=2), 10, rain=1, wind_speed=7)
+    observe(kyiv, end - timedelta(hours=1), 20, rain=2)
+    observe(kyiv, end + timedelta(hours=1), 99)  # outside the window
+    WeatherAggregate.objects.create(city=kyiv, period=WeatherAggregate.HOUR, start=end - timedelta(days=9),
+                                    samples=2, temperature=0, temperature_min=-5, temperature_max=5,
+                                    wind_speed_max=9, **{field: 0.5 for field in HISTORY_FIELDS
+                                                         if field != 'temperature'})
+
+    digests = compute_digests([kyiv.pk, lviv.pk], start, end)
+
+    assert digests == {kyiv.pk: {'readings': 4, 'temperature_min': -5, 'temperature_max': 20,
+                                 'temperature_mean': 7.5, 'rain_total': 4, 'snow_total': 1, 'wind_speed_max': 9}}
+
+
+@pytest.mark.django_db
+def test_get_digests_is_cached_per_city_and_window(create_city, django_assert_num_queries):
+    kyiv = create_city('Kyiv')
+    now = timezone.now()
+    observe(kyiv, now - timedelta(hours=3), 10)
+
+    with django_assert_num_queries(2):
+        assert get_digests([kyiv.pk], 24, now)[kyiv.pk]['readings'] == 1
+    with django_assert_num_queries(0):
+        assert get_digests([kyiv.pk], 24, now)[kyiv.pk]['readings'] == 1
+    with django_assert_num_queries(2):
+        assert get_digests([kyiv.pk], 48, now)[kyiv.pk]['readings'] == 1
+
+
+@pytest.mark.django_db
+def test_daily_subscribers_get_a_digest(create_user, create_city, create_subscription):
+    kyiv = create_city('Kyiv')
+    for i in range(3):
+        create_subscription(create_user(email=f'daily-{i}@example.com'), kyiv, 24)
+    create_subscription(create_user(email='hourly@example.com'), kyiv, 2)
+    UserSubscription.objects.update(next_notification_at=timezone.now() - timedelta(minutes=1))
+    for hours, temperature in ((30, -10), (20, 4), (10, 8)):
+        observe(kyiv, timezone.now() - timedelta(hours=hours), temperature, rain=1.5)
+
+    report = update_subscriptions_table()
+
+    assert report['sent'] == 4
+    assert report['rendered'] == 2
+    bodies = {message.to[0]: message.alternatives[0][0] for message in mail.outbox}
+    assert bodies['daily-0@example.com'] == bodies['daily-2@example.com']
+    assert 'Over the last 24 hours' in bodies['daily-0@example.com']
+    assert 'from 4.0 to 8.0, mean 6.0' in bodies['daily-0@example.com']
+    assert 'rain total : 3.0' in bodies['daily-0@example.com']
+    assert 'Over the last' not in bodies['hourly@example.com']
+
+
+@pytest.mark.django_db
+def test_cities_of_digest_subscribers_are_read_hourly(celery_eager, create_user, create_city, create_subscription):
+    kyiv, lviv = create_city('Kyiv'), create_city('Lviv')
+    daily = create_subscription(create_user(email='daily@example.com'), kyiv, 24)
+    create_subscription(create_user(email='hourly@example.com'), lviv, 2)
+
+    for hours_ago in (3, 2, 1):  # three hourly runs in which nobody is due
+        CityWeather.objects.update(last_info_update=timezone.now() - timedelta(hours=1))
+        assert plan_weather_refresh(timezone.now())[0] == [kyiv.weather.get().pk]
+        update_tables_and_send_emails.delay().get()
+        WeatherObservation.objects.filter(observed_at__gt=timezone.now() - timedelta(minutes=5)) \
+            .update(observed_at=timezone.now() - timedelta(hours=hours_ago))
+    assert not mail.outbox
+
+    UserSubscription.objects.filter(pk=daily.pk).update(next_notification_at=timezone.now() - timedelta(minutes=1))
+    update_subscriptions_table()
+
+    [message] = mail.outbox
+    assert get_digests([kyiv.pk], 24, timezone.now())[kyiv.pk]['readings'] == 3
+    assert 'Over the last 24 hours' in message.alternatives[0][0]
+    assert not WeatherObservation.objects.filter(city=lviv).exists()
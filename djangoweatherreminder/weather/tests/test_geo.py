@@ -0,0 +1,116 @@
+import pytest
+
+from django.urls import reverse
+
+from weather.bulk import match_nearby_cities
+from weather.geo import encode, haversine_km, search_cells
+from weather.models import CityName, CityWeather, UserSubscription
+from weather.testing import fake_weather
+
+
+def locate(city, latitude, longitude):
+    CityName.objects.filter(pk=city.pk).update(latitude=latitude, longitude=longitude,
+                                               geohash=encode(latitude, longitude))
+
+
+def test_geohash_cells_cover_the_search_radius():
+    assert encode(57.64911, 10.40744, 11) == 'u4pruydqqvj'
+    assert haversine_km(50.45, 30.52, 49.84, 24.03) == pytest.approx(467, abs=1)
+
+    cells = search_cells(50.45, 30.52, 5)
+    assert len(cells) == 9
+    for latitude, longitude in ((50.49, 30.52), (50.45, 30.45), (50.41, 30.58)):  # all within 5 km
+        assert any(encode(latitude, longitude).startswith(cell) for cell in cells)
+    assert len(search_cells(0, 179.99, 5)) == 9  # wraps around the antimeridian
+
+
+@pytest.mark.django_db
+def test_nearest_city(create_city, django_assert_num_queries):
+    kyiv, brovary, lviv = create_city('Kyiv'), create_city('Brovary'), create_city('Lviv')
+    locate(kyiv, 50.45, 30.52)
+    locate(brovary, 50.51, 30.79)
+    locate(lviv, 49.84, 24.03)
+
+    with django_assert_num_queries(1):
+        assert CityName.objects.nearest(50.46, 30.53) == kyiv
+    assert CityName.objects.nearest(50.50, 30.78) == brovary
+    assert CityName.objects.nearest(50.48, 30.65) is None  # 10 km from both
+    assert CityName.objects.nearest(50.48, 30.65, radius_km=15) == kyiv
+
+
+@pytest.mark.django_db
+def test_subscribe_by_coordinates(api_client_with_authenticated_user, create_user, create_city,
+                                  create_subscription, owm_stub):
+    url = reverse('new_subscription_by_coordinates')
+    kyiv = create_city('Kyiv')
+    create_subscription(create_user(email='other@example.com'), kyiv)
+    locate(kyiv, 50.45, 30.52)
+
+    response = api_client_with_authenticated_user.post(url, {'latitude': 50.46, 'longitude': 30.5,
+                                                             'notification_frequency': 3}, format='json')
+    assert response.status_code == 201
+    assert response.data['city'] == {'name': 'Kyiv', 'state': '', 'country_code': 'UA'}
+    assert not owm_stub.requests
+
+    response = api_client_with_authenticated_user.post(url, {'latitude': 46.48, 'longitude': 30.72,
+                                                             'notification_frequency': 3}, format='json')
+    assert response.status_code == 201
+    assert [query['lat'] for _, query in owm_stub.requests] == ['46.48']
+    odesa = CityName.objects.get(name='Place 46.5 30.7')
+    assert odesa.geohash == encode(46.48, 30.72)
+    assert UserSubscription.objects.filter(city=odesa, weather_info__city=odesa).count() == 1
+
+    response = api_client_with_authenticated_user.post(url, {'latitude': 91, 'longitude': 30,
+                                                             'notification_frequency': 3}, format='json')
+    assert response.status_code == 400
+    assert set(response.data['errors']) == {'latitude'}
+
+
+@pytest.mark.django_db
+def test_new_spelling_of_a_nearby_city_reuses_it(api_client_with_authenticated_user, create_user, create_city,
+                                                 create_subscription):
+    kyiv = create_city('Kyiv')
+    create_subscription(create_user(email='other@example.com'), kyiv)
+    coord = fake_weather('Kiev')['coord']
+    locate(kyiv, coord['lat'] + 0.01, coord['lon'])
+
+    response = api_client_with_authenticated_user.post(reverse('new_subscription'), {
+        'city': {'name': 'Kiev', 'state': '', 'country_code': 'UA'}, 'notification_frequency': 3,
+    }, format='json')
+
+    assert response.status_code == 201
+    assert list(CityName.objects.values_list('name', flat=True)) == ['Kyiv']
+    assert CityWeather.objects.count() == 1
+    assert UserSubscription.objects.filter(city=kyiv).count() == 2
+
+
+@pytest.mark.django_db
+def test_bulk_subscribe_reuses_nearby_cities(api_client_with_authenticated_user, create_user, create_city,
+                                             create_subscription):
+    kyiv = create_city('Kyiv')
+    create_subscription(create_user(email='other@example.com'), kyiv)
+    coord = fake_weather('Kiev')['coord']
+    locate(kyiv, coord['lat'] + 0.01, coord['lon'])
+
+    response = api_client_with_authenticated_user.post(reverse('bulk_subscriptions'), {'subscriptions': [
+        {'city': {'name': 'Kiev', 'state': '', 'country_code': 'UA'}, 'notification_frequency': 3},
+        {'city': {'name': 'Lviv', 'state': '', 'country_code': 'UA'}, 'notification_frequency': 3},
+    ]}, format='json')
+
+    assert [result['status'] for result in response.json()['results']] == ['created', 'created']
+    assert sorted(CityName.objects.values_list('name', flat=True)) == ['Kyiv', 'Lviv']
+    assert CityWeather.objects.count() == 2
+    assert UserSubscription.objects.filter(city=kyiv).count() == 2
+
+
+@pytest.mark.django_db
+def test_match_nearby_cities_within_one_request():
+    def location(latitude, longitude):
+        return {'latitude': latitude, 'longitude': longitude, 'geohash': encode(latitude, longitude)}
+
+    cities = {}
+    weathers = {'kyiv': ({}, location(50.45, 30.52)), 'kiev': ({}, location(50.46, 30.53)),
+                'lviv': ({}, location(49.84, 24.03))}
+
+    assert match_nearby_cities(cities, weathers) == {'kiev': 'kyiv'}
+    assert cities == {}
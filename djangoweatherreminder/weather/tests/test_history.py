@@ -0,0 +1,105 @@
+import pytest
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from weather.history import compact_history
+from weather.models import WeatherAggregate, WeatherObservation
+from weather.persistence import HISTORY_FIELDS
+from weather.tasks import update_weather_table
+
+NOW = datetime(2026, 10, 18, 12, 30, tzinfo=dt_timezone.utc)
+
+
+def observe(city, observed_at, temperature):
+    return WeatherObservation.objects.create(city=city, observed_at=observed_at, temperature=temperature,
+                                             **{field: 1 for field in HISTORY_FIELDS if field != 'temperature'})
+
+
+@pytest.mark.django_db
+def test_refresh_appends_observations(create_city):
+    kyiv = create_city('Kyiv')
+    create_city('Lviv')
+
+    update_weather_table()
+    update_weather_table()
+
+    assert WeatherObservation.objects.count() == 4
+    observation = WeatherObservation.objects.filter(city=kyiv).latest('observed_at')
+    assert observation.temperature == kyiv.weather.get().temperature
+
+
+@pytest.mark.django_db
+def test_compact_history_rolls_up_old_rows(settings, create_city):
+    settings.WEATHER_HISTORY_RAW_DAYS = 7
+    settings.WEATHER_HISTORY_HOURLY_DAYS = 30
+    kyiv = create_city('Kyiv')
+    old_hour = datetime(2026, 10, 1, 6, tzinfo=dt_timezone.utc)
+    for minutes, temperature in ((0, 10), (20, 14), (40, 12)):
+        observe(kyiv, old_hour + timedelta(minutes=minutes), temperature)
+    recent = observe(kyiv, NOW - timedelta(hours=1), 20)
+    WeatherAggregate.objects.bulk_create([
+        WeatherAggregate(city=kyiv, period=WeatherAggregate.HOUR,
+                         start=datetime(2026, 9, 1, hour, tzinfo=dt_timezone.utc), samples=samples,
+                         temperature=temperature, temperature_min=temperature, temperature_max=temperature,
+                         wind_speed_max=1, **{field: 1 for field in HISTORY_FIELDS if field != 'temperature'})
+        for hour, samples, temperature in ((1, 1, 0), (2, 3, 4))
+    ])
+
+    report = compact_history(NOW)
+
+    assert report == {'observations_rolled': 3, 'hours_created': 1, 'hours_rolled': 2, 'days_created': 1}
+    assert list(WeatherObservation.objects.all()) == [recent]
+    hour = WeatherAggregate.objects.get(period=WeatherAggregate.HOUR)
+    assert (hour.start, hour.samples, hour.temperature, hour.temperature_min, hour.temperature_max) == \
+           (old_hour, 3, 12, 10, 14)
+    day = WeatherAggregate.objects.get(period=WeatherAggregate.DAY)
+    assert (day.start, day.samples, day.temperature, day.temperature_min, day.temperature_max) == \
+           (datetime(2026, 9, 1, tzinfo=dt_timezone.utc), 4, 3, 0, 4)
+
+
+@pytest.mark.django_db
+def test_city_history_downsamples(api_client_with_authenticated_user, create_city):
+    kyiv = create_city('Kyiv')
+    day = datetime(2026, 10, 17, tzinfo=dt_timezone.utc)
+    for hours, temperature in ((1, 10), (1.5, 20), (2, 30), (5, 40)):
+        observe(kyiv, day + timedelta(hours=hours), temperature)
+    WeatherAggregate.objects.create(city=kyiv, period=WeatherAggregate.HOUR, start=day, samples=2, temperature=5,
+                                    temperature_min=4, temperature_max=6, wind_speed_max=1,
+                                    **{field: 1 for field in HISTORY_FIELDS if field != 'temperature'})
+    url = reverse('city_history', kwargs={'id': kyiv.pk})
+    params = {'from': '2026-10-17T00:00:00Z', 'to': '2026-10-18T00:00:00'}
+
+    response = api_client_with_authenticated_user.get(url, {**params, 'resolution': 'hour'})
+    assert response.status_code == 200
+    assert [(point['period'], point['samples'], point['temperature']) for point in response.data['points']] == \
+           [('hour', 2, 5), ('hour', 2, 15), ('hour', 1, 30), ('hour', 1, 40)]
+
+    response = api_client_with_authenticated_user.get(url, {**params, 'resolution': 'day'})
+    [point] = response.data['points']
+    assert (point['time'], point['samples'], point['temperature']) == (day, 6, 18.33)
+    assert (point['temperature_min'], point['temperature_max']) == (4, 40)
+
+    response = api_client_with_authenticated_user.get(url, {**params, 'resolution': 'raw'})
+    assert len(response.data['points']) == 5
+
+
+@pytest.mark.parametrize('params, code', [
+    ({'resolution': 'week'}, 400),
+    ({'from': 'yesterday'}, 400),
+    ({'from': '2026-10-18T00:00:00Z', 'to': '2026-10-17T00:00:00Z'}, 400),
+    ({'from': '2020-01-01T00:00:00Z', 'resolution': 'hour'}, 400),
+    ({'from': '2022-01-01T00:00:00Z', 'resolution': 'day'}, 200),
+])
+@pytest.mark.django_db
+def test_city_history_validates_query(api_client_with_authenticated_user, create_city, params, code):
+    url = reverse('city_history', kwargs={'id': create_city('Kyiv').pk})
+    assert api_client_with_authenticated_user.get(url, params).status_code == code
+
+
+@pytest.mark.django_db
+def test_city_history_requires_authentication(create_city):
+    url = reverse('city_history', kwargs={'id': create_city('Kyiv').pk})
+    assert APIClient().get(url).status_code == 401
+    assert APIClient().get(reverse('city_history', kwargs={'id': 0})).status_code == 401
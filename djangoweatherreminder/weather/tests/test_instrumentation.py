@@ -0,0 +1,90 @@
+import json
+import logging
+
+import pytest
+from django.urls import reverse
+from prometheus_client import REGISTRY, CollectorRegistry
+
+from weather.instrumentation import ResilienceCollector
+from weather.resilience import RedisTokenBucket, TokenBucket
+from weather.tasks import remove_unused_cities
+
+
+def sample(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+@pytest.fixture
+def instrumentation_log(caplog):
+    logger = logging.getLogger('weather.instrumentation')
+    logger.addHandler(caplog.handler)
+    caplog.handler.setLevel(logging.INFO)
+    yield caplog
+    logger.removeHandler(caplog.handler)
+
+
+@pytest.mark.django_db
+def test_request_metrics_and_log(api_client_with_authenticated_user, instrumentation_log):
+    labels = {'view': 'new_subscription', 'method': 'POST', 'status': '201'}
+    requests_before = sample('http_request_duration_seconds_count', **labels)
+    owm_before = sample('outbound_request_duration_seconds_count', service='owm', endpoint='weather', status='200')
+
+    data = {"city": {"name": "Kyiv", "state": "", "country_code": "UA"}, "notification_frequency": 2}
+    response = api_client_with_authenticated_user.post(reverse('new_subscription'), data, format='json')
+
+    assert response.status_code == 201
+    assert sample('http_request_duration_seconds_count', **labels) == requests_before + 1
+    assert sample('outbound_request_duration_seconds_count', service='owm', endpoint='weather',
+                  status='200') == owm_before + 1
+    event = json.loads(instrumentation_log.records[-1].getMessage())
+    assert event['event'] == 'request'
+    assert event['view'] == 'new_subscription'
+    assert event['db_queries'] > 0
+    assert event['outbound_requests'] == 1
+
+
+@pytest.mark.django_db
+def test_task_metrics(celery_eager, instrumentation_log):
+    labels = {'task': 'weather.tasks.remove_unused_cities', 'state': 'SUCCESS'}
+    before = sample('celery_task_duration_seconds_count', **labels)
+
+    remove_unused_cities.delay().get()
+
+    assert sample('celery_task_duration_seconds_count', **labels) == before + 1
+    event = json.loads(instrumentation_log.records[-1].getMessage())
+    assert event['event'] == 'task'
+    assert event['db_queries'] >= 1
+
+
+@pytest.mark.django_db
+def test_metrics_endpoint(client, settings):
+    response = client.get(reverse('metrics'))
+    assert response.status_code == 200
+    body = response.content.decode()
+    assert 'http_request_duration_seconds' in body
+    assert 'owm_circuit_state{state="closed"} 1.0' in body
+
+    settings.METRICS_TOKEN = 'secret'
+    assert client.get(reverse('metrics')).status_code == 403
+    assert client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer secret').status_code == 200
+
+
+def test_resilience_collector_does_not_collect_on_registration(monkeypatch):
+    def unreachable():
+        raise ConnectionError('redis is down')
+
+    monkeypatch.setattr('weather.resilience.resilience_metrics', unreachable)
+
+    CollectorRegistry(auto_describe=True).register(ResilienceCollector())  # as the default REGISTRY
+
+
+def test_redis_rate_limiter_metrics_survive_redis_outage():
+    class DownClient:
+        def hget(self, key, field):
+            raise ConnectionError('redis is down')
+
+    bucket = RedisTokenBucket.__new__(RedisTokenBucket)
+    TokenBucket.__init__(bucket, 10, 20)
+    bucket.key, bucket.client = 'weather:owm:rate-limit', DownClient()
+
+    assert bucket.metrics()['tokens'] is None
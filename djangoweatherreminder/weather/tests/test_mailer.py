@@ -0,0 +1,99 @@
+import smtplib
+
+from django.core import mail
+from django.core.mail import EmailMessage
+from django.core.mail.backends.locmem import EmailBackend
+
+from weather.mailer import send_in_batches
+
+
+class FlakyBackend(EmailBackend):
+    def __init__(self, failures, error, **kwargs):
+        super().__init__(**kwargs)
+        self.failures = failures
+        self.error = error
+
+    def send_messages(self, messages):
+        if self.failures:
+            self.failures -= 1
+            raise self.error
+        return super().send_messages(messages)
+
+
+def make_messages(count):
+    return [EmailMessage(subject='Weather report', body='report', to=[f'user{i}@example.com']) for i in range(count)]
+
+
+def test_send_in_batches():
+    report = send_in_batches(make_messages(25), batch_size=10)
+
+    assert len(mail.outbox) == 25
+    assert report['sent'] == 25
+    assert report['failed'] == 0
+    assert [batch['messages'] for batch in report['batches']] == [10, 10, 5]
+
+
+def test_send_in_batches_retries_transient_errors(settings):
+    settings.EMAIL_RETRY_BACKOFF = 0
+    connection = FlakyBackend(failures=2, error=smtplib.SMTPServerDisconnected('connection lost'))
+
+    report = send_in_batches(make_messages(5), batch_size=5, retries=3, connection=connection)
+
+    assert report['sent'] == 5
+    assert report['batches'][0]['attempts'] == 3
+    assert len(mail.outbox) == 5
+
+
+def test_send_in_batches_gives_up_on_permanent_errors(settings):
+    settings.EMAIL_RETRY_BACKOFF = 0
+    connection = FlakyBackend(failures=1, error=smtplib.SMTPResponseException(550, b'mailbox unavailable'))
+
+    report = send_in_batches(make_messages(4), batch_size=2, retries=3, connection=connection)
+
+    assert report['sent'] == 3
+    assert report['failed'] == 1
+    assert [batch['attempts'] for batch in report['batches']] == [1, 1]
+
+
+class RefusingBackend(EmailBackend):
+    """Refuses the recipients of messages to `refused`, like SMTP does, and accepts the others."""
+
+    def __init__(self, refused, **kwargs):
+        super().__init__(**kwargs)
+        self.refused = refused
+        self.calls = 0
+
+    def send_messages(self, messages):
+        self.calls += 1
+        for message in messages:
+            if self.refused in message.to:
+                raise smtplib.SMTPRecipientsRefused({self.refused: (550, b'no such user')})
+        return super().send_messages(messages)
+
+
+def test_send_in_batches_does_not_resend_accepted_messages(settings):
+    settings.EMAIL_RETRY_BACKOFF = 0
+    messages = make_messages(4)
+    connection = RefusingBackend(refused=messages[2].to[0])
+
+    report = send_in_batches(messages, batch_size=4, retries=3, connection=connection)
+
+    assert report['sent'] == 3
+    assert report['failed'] == 1
+    assert connection.calls == 4
+    assert sorted(message.to[0] for message in mail.outbox) == \
+           sorted(message.to[0] for i, message in enumerate(messages) if i != 2)
+
+
+def test_send_in_batches_stops_when_the_server_is_unreachable(settings):
+    settings.EMAIL_RETRY_BACKOFF = 0
+    connection = FlakyBackend(failures=100, error=ConnectionRefusedError(111, 'Connection refused'))
+    batches = []
+
+    report = send_in_batches(make_messages(10), batch_size=4, retries=2, connection=connection,
+                             on_batch=lambda batch, accepted: batches.append((len(batch), len(accepted))))
+
+    assert connection.failures == 97  # one message tried, the others not waiting through their own retries
+    assert (report['sent'], report['failed'], report['unsent']) == (0, 1, 9)
+    assert batches == [(1, 0)]
+    assert not mail.outbox
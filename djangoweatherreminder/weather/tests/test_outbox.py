@@ -0,0 +1,193 @@
+import pytest
+import smtplib
+from datetime import timedelta
+from io import StringIO
+
+from django.core import mail
+from django.core.mail.backends.locmem import EmailBackend
+from django.core.management import call_command
+from django.utils import timezone
+
+from weather.models import Notification, UserSubscription
+from weather.outbox import delivery_stats, enqueue_notifications, message_id
+from weather.tasks import deliver_notifications, get_due_subscriptions, retry_notifications, \
+    update_subscriptions_table
+
+
+def make_due(*subscriptions):
+    UserSubscription.objects.filter(pk__in=[subscription.pk for subscription in subscriptions]) \
+        .update(next_notification_at=timezone.now().replace(microsecond=0) - timedelta(minutes=1))
+
+
+@pytest.fixture
+def smtp_down(monkeypatch, settings):
+    settings.EMAIL_RETRY_BACKOFF = 0
+
+    def send_messages(self, messages):
+        raise smtplib.SMTPResponseException(554, b'transaction failed')
+
+    monkeypatch.setattr(EmailBackend, 'send_messages', send_messages)
+    return monkeypatch
+
+
+@pytest.mark.django_db
+def test_enqueue_notifications_is_idempotent(create_user, create_city, create_subscription):
+    subscription = create_subscription(create_user(email='user@example.com'), create_city('Kyiv'))
+    make_due(subscription)
+    scheduled = UserSubscription.objects.get().next_notification_at
+    now = timezone.now()
+
+    [notification_id] = enqueue_notifications(get_due_subscriptions(now), now, 'run-1')
+    assert UserSubscription.objects.get().next_notification_at > now
+    UserSubscription.objects.update(next_notification_at=scheduled)  # as if the schedule update was lost
+    assert enqueue_notifications(get_due_subscriptions(now), now, 'run-2') == [notification_id]
+    assert Notification.objects.get().run == 'run-1'
+
+    deliver_notifications([notification_id])
+    deliver_notifications([notification_id])
+
+    [message] = mail.outbox
+    notification = Notification.objects.get()
+    assert notification.status == Notification.SENT
+    assert notification.attempts == 1
+    assert message.extra_headers['Message-ID'] == message_id(notification.key)
+
+
+@pytest.mark.django_db
+def test_failed_reports_are_retried(settings, celery_eager, smtp_down, create_user, create_city,
+                                    create_subscription):
+    settings.NOTIFICATION_MAX_ATTEMPTS = 2
+    subscription = create_subscription(create_user(email='user@example.com'), create_city('Kyiv'))
+    make_due(subscription)
+
+    report = update_subscriptions_table()
+
+    assert report['failed'] == 1
+    notification = Notification.objects.get()
+    assert (notification.status, notification.attempts) == (Notification.PENDING, 1)
+    assert UserSubscription.objects.get().next_notification_at > timezone.now()
+    assert retry_notifications() == 0  # not before NOTIFICATION_RETRY_AFTER
+
+    smtp_down.undo()
+    Notification.objects.update(created_at=timezone.now() - timedelta(hours=1))
+    assert retry_notifications() == 1
+    notification.refresh_from_db()
+    assert (notification.status, notification.attempts) == (Notification.SENT, 2)
+    assert len(mail.outbox) == 1
+
+
+@pytest.mark.django_db
+def test_reports_stay_pending_while_the_email_server_is_down(settings, monkeypatch, create_user, create_city,
+                                                             create_subscription):
+    settings.EMAIL_RETRY_BACKOFF = 0
+    kyiv = create_city('Kyiv')
+    subscriptions = [create_subscription(create_user(email=f'user-{i}@example.com'), kyiv) for i in range(3)]
+    make_due(*subscriptions)
+
+    def send_messages(self, messages):
+        raise ConnectionRefusedError(111, 'Connection refused')
+
+    monkeypatch.setattr(EmailBackend, 'send_messages', send_messages)
+
+    report = update_subscriptions_table()
+
+    assert (report['failed'], report['unsent']) == (1, 2)
+    assert sorted(Notification.objects.values_list('status', 'attempts')) == \
+        [(Notification.PENDING, 0), (Notification.PENDING, 0), (Notification.PENDING, 1)]
+
+
+@pytest.mark.django_db
+def test_reports_fail_after_max_attempts(settings, smtp_down, create_user, create_city, create_subscription):
+    settings.NOTIFICATION_MAX_ATTEMPTS = 2
+    subscription = create_subscription(create_user(email='user@example.com'), create_city('Kyiv'))
+    make_due(subscription)
+    update_subscriptions_table()
+
+    deliver_notifications(list(Notification.objects.values_list('pk', flat=True)))
+
+    assert Notification.objects.get().status == Notification.FAILED
+    assert not mail.outbox
+
+
+@pytest.mark.django_db
+def test_only_the_newest_report_of_a_subscription_is_sent(create_user, create_city, create_subscription):
+    user = create_user(email='user@example.com')
+    kyiv = create_subscription(user, create_city('Kyiv'))
+    lviv = create_subscription(user, create_city('Lviv'))
+    old = Notification.objects.create(subscription=kyiv, key='report:old', run='run-1')
+    new = Notification.objects.create(subscription=kyiv, key='report:new', run='run-2')
+    Notification.objects.create(subscription=lviv, key='report:lviv', run='run-2')
+
+    report = deliver_notifications(list(Notification.objects.values_list('pk', flat=True)))
+
+    assert report['sent'] == 2
+    assert Notification.objects.get(pk=old.pk).status == Notification.SKIPPED
+    assert Notification.objects.get(pk=new.pk).status == Notification.SENT
+    assert delivery_stats() == {
+        'run-2': {'pending': 0, 'sending': 0, 'sent': 2, 'failed': 0, 'skipped': 0},
+        'run-1': {'pending': 0, 'sending': 0, 'sent': 0, 'failed': 0, 'skipped': 1},
+    }
+    out = StringIO()
+    call_command('notification_stats', runs=1, stdout=out)
+    assert out.getvalue().splitlines()[1].split() == ['run-2', '0', '0', '2', '0', '0']
+
+
+@pytest.mark.django_db
+def test_partly_delivered_batch_requeues_only_the_refused_reports(settings, celery_eager, monkeypatch, create_user,
+                                                                 create_city, create_subscription):
+    settings.NOTIFICATION_MAX_ATTEMPTS = 2
+    kyiv = create_city('Kyiv')
+    subscriptions = [create_subscription(create_user(email=f'user-{i}@example.com'), kyiv) for i in range(4)]
+    make_due(*subscriptions)
+    send_messages = EmailBackend.send_messages
+
+    def refuse_user_2(self, messages):
+        if any('user-2@example.com' in message.to for message in messages):
+            raise smtplib.SMTPRecipientsRefused({'user-2@example.com': (550, b'no such user')})
+        return send_messages(self, messages)
+
+    monkeypatch.setattr(EmailBackend, 'send_messages', refuse_user_2)
+
+    report = update_subscriptions_table()
+
+    assert (report['sent'], report['failed']) == (3, 1)
+    statuses = dict(Notification.objects.values_list('subscription__user__email', 'status'))
+    assert statuses == {'user-0@example.com': Notification.SENT, 'user-1@example.com': Notification.SENT,
+                        'user-2@example.com': Notification.PENDING, 'user-3@example.com': Notification.SENT}
+
+    Notification.objects.update(created_at=timezone.now() - timedelta(hours=1))
+    assert retry_notifications() == 1
+    assert Notification.objects.get(subscription__user__email='user-2@example.com').status == Notification.FAILED
+    assert Notification.objects.filter(status=Notification.SENT).count() == 3
+    assert len(mail.outbox) == 3
+
+
+@pytest.mark.django_db
+def test_claims_are_renewed_and_reclaimed_reports_left_to_the_new_worker(settings, monkeypatch, create_user,
+                                                                         create_city, create_subscription):
+    settings.EMAIL_BATCH_SIZE = 1
+    kyiv = create_city('Kyiv')
+    for i in range(3):
+        subscription = create_subscription(create_user(email=f'user-{i}@example.com'), kyiv)
+        Notification.objects.create(subscription=subscription, key=f'report:{i}', run='run-1')
+    first, second, third = Notification.objects.order_by('pk')
+    send_messages = EmailBackend.send_messages
+    claims = []
+
+    def reclaim_during_second_report(self, messages):
+        if 'user-1@example.com' in messages[0].to:
+            claims.append(Notification.objects.get(pk=third.pk).claimed_at)
+            # the lease ran out and retry_notifications handed both rows to another worker
+            Notification.objects.filter(pk__in=[second.pk, third.pk]).update(claim_token='other-worker')
+        return send_messages(self, messages)
+
+    monkeypatch.setattr(EmailBackend, 'send_messages', reclaim_during_second_report)
+
+    report = deliver_notifications([first.pk, second.pk, third.pk])
+
+    assert (report['sent'], report['skipped']) == (2, 1)
+    assert [message.to for message in mail.outbox] == [['user-0@example.com'], ['user-1@example.com']]
+    assert claims[0] > Notification.objects.get(pk=first.pk).claimed_at  # renewed after the first batch
+    statuses = dict(Notification.objects.values_list('pk', 'status'))
+    assert statuses == {first.pk: Notification.SENT, second.pk: Notification.SENDING,
+                        third.pk: Notification.SENDING}
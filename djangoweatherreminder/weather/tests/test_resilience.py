@@ -0,0 +1,127 @@
+import time
+
+import pytest
+import requests
+from django.urls import reverse
+
+from weather.owm import get_session, get_weather
+from weather.resilience import CircuitBreaker, CircuitOpenError, TokenBucket, resilience_metrics
+
+
+def test_token_bucket_limits_rate():
+    bucket = TokenBucket(rate=20, capacity=2)
+
+    started = time.monotonic()
+    for _ in range(6):
+        bucket.acquire()
+
+    assert time.monotonic() - started >= 0.18
+    assert bucket.metrics()['throttled'] == 4
+
+
+def test_token_bucket_adapts_rate():
+    bucket = TokenBucket(rate=10, capacity=10)
+
+    bucket.penalize()
+    bucket.penalize()
+    assert bucket.rate == 2.5
+
+    for _ in range(20):
+        bucket.reward()
+    assert bucket.rate == 10
+
+
+def test_circuit_breaker_opens_and_recovers():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.1)
+
+    breaker.record_failure()
+    assert breaker.allow()
+    breaker.record_failure()
+    assert not breaker.allow()
+
+    time.sleep(0.1)
+    assert breaker.allow()  # half-open trial call
+    assert not breaker.allow()
+    breaker.record_success()
+    assert breaker.metrics() == {'state': 'closed', 'failures': 0, 'rejected': 2}
+
+
+def test_owm_failures_open_the_circuit(settings, owm_stub):
+    settings.OWM_RETRIES = 1
+    settings.OWM_BACKOFF = 0
+    settings.OWM_BREAKER_THRESHOLD = 2
+    owm_stub.fail_status = 503
+    city_data = {'name': 'Kyiv', 'state': '', 'country_code': 'UA'}
+
+    for _ in range(2):
+        with pytest.raises(Exception):
+            get_weather(city_data)
+    assert len(owm_stub.requests) == 4
+
+    with pytest.raises(CircuitOpenError):
+        get_weather(city_data)
+    assert len(owm_stub.requests) == 4
+    assert resilience_metrics()['circuit_breaker']['state'] == 'open'
+
+
+def test_throttling_slows_the_limiter(settings, owm_stub):
+    settings.OWM_RETRIES = 0
+    owm_stub.fail_status = 429
+
+    with pytest.raises(Exception):
+        get_weather({'name': 'Kyiv', 'state': '', 'country_code': 'UA'})
+
+    assert resilience_metrics()['rate_limiter']['rate'] == settings.OWM_RATE_LIMIT / 2
+
+
+@pytest.mark.django_db
+def test_new_subscription_served_from_snapshot_while_circuit_open(settings, owm_stub, create_city,
+                                                                   api_client_with_authenticated_user):
+    settings.OWM_RETRIES = 0
+    settings.OWM_BREAKER_THRESHOLD = 1
+    create_city('Kyiv')
+    owm_stub.fail_status = 503
+    url = reverse('new_subscription')
+
+    data = {"city": {"name": "Kyiv", "state": "", "country_code": "UA"}, "notification_frequency": 2}
+    response = api_client_with_authenticated_user.post(url, data, format='json')
+    assert response.status_code == 201
+
+    data = {"city": {"name": "Lviv", "state": "", "country_code": "UA"}, "notification_frequency": 2}
+    response = api_client_with_authenticated_user.post(url, data, format='json')
+    assert response.status_code == 503
+    assert len(owm_stub.requests) == 1
+
+
+def test_unexpected_error_in_trial_call_reopens_the_circuit(settings, monkeypatch, owm_stub):
+    settings.OWM_RETRIES = 0
+    settings.OWM_BREAKER_THRESHOLD = 1
+    settings.OWM_BREAKER_RESET_TIMEOUT = 0
+    city_data = {'name': 'Kyiv', 'state': '', 'country_code': 'UA'}
+    owm_stub.fail_status = 503
+    with pytest.raises(Exception):
+        get_weather(city_data)
+    owm_stub.fail_status = None
+
+    def redirect_loop(*args, **kwargs):
+        raise requests.TooManyRedirects('redirect loop')
+
+    with monkeypatch.context() as patch:
+        patch.setattr(get_session(), 'get', redirect_loop)
+        with pytest.raises(requests.TooManyRedirects):
+            get_weather(city_data)  # the half-open trial call
+    assert resilience_metrics()['circuit_breaker']['state'] == 'open'
+
+    assert get_weather(city_data)[1] == 200
+    assert resilience_metrics()['circuit_breaker']['state'] == 'closed'
+
+
+def test_circuit_breaker_lets_another_trial_through_if_one_never_reports():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.1)
+    breaker.record_failure()
+    time.sleep(0.1)
+    assert breaker.allow()  # trial call that never records an outcome
+    assert not breaker.allow()
+
+    time.sleep(0.1)
+    assert breaker.allow()
@@ -0,0 +1,216 @@
+import pytest
+from datetime import timedelta
+
+from django.core import mail
+from django.utils import timezone
+
+from weather.cache import cache_stats
+from weather.fetcher import fetch_weather_many
+from weather.models import CityName, CityWeather, UserSubscription
+from weather.persistence import WEATHER_SCHEMA, clean_weather
+from weather.planner import plan_weather_refresh
+from weather.snapshots import get_city_weather, store_snapshots
+from weather.tasks import delete_unused_cities, update_subscriptions_table, update_tables_and_send_emails, \
+    update_weather_table
+from weather.testing import OWMStubServer
+
+
+def test_fetch_weather_many_runs_concurrently(settings):
+    with OWMStubServer(delay=0.2) as server:
+        settings.OWM_API_URL = server.url
+        cities_data = {i: {'name': f'city-{i}', 'state': '', 'country_code': 'UA'} for i in range(10)}
+        results, report = fetch_weather_many(cities_data, concurrency=10)
+
+    assert len(server.requests) == 10
+    assert report['fetched'] == 10
+    assert report['failed'] == 0
+    assert report['seconds'] < 1
+    assert all(code == 200 for _, code in results.values())
+
+
+@pytest.mark.django_db
+def test_update_weather_table(owm_stub, create_city):
+    create_city('Kyiv')
+    create_city('Lviv')
+    create_city('wrong-city')
+
+    report = update_weather_table()
+
+    assert report['cities'] == 3
+    assert report['failed'] == 1
+    assert report['written'] == 2
+    assert report['skipped'] == 1
+    assert len(owm_stub.requests) == 3
+    assert CityWeather.objects.get(city__name='Kyiv').weather_description != 'unknown'
+    assert CityWeather.objects.get(city__name='wrong-city').weather_description == 'unknown'
+
+
+@pytest.mark.django_db
+def test_update_weather_table_batches_known_city_ids(create_city, owm_stub):
+    for i in range(25):
+        create_city(f'city-{i}')
+
+    first = update_weather_table()
+    assert first['requests'] == 25
+    assert first['located'] == 25
+    assert not CityName.objects.filter(owm_id=None).exists()
+
+    owm_stub.reset()
+    second = update_weather_table()
+    assert second['requests'] == second['group_requests'] == 2
+    assert second['written'] == 25
+    assert [path for path, _ in owm_stub.requests] == ['/data/2.5/group', '/data/2.5/group']
+
+
+@pytest.mark.django_db
+def test_update_weather_table_query_count(create_city, django_assert_max_num_queries):
+    for i in range(20):
+        create_city(f'city-{i}')
+
+    with django_assert_max_num_queries(7):  # includes looking up alert rules
+        report = update_weather_table()
+
+    assert report['written'] == 20
+    assert report['skipped'] == 0
+
+
+def test_clean_weather_rejects_malformed_payload():
+    weather_data = {field: 1 for field in WEATHER_SCHEMA}
+    weather_data['weather_description'] = 'clear sky'
+    assert clean_weather(weather_data)['temperature'] == 1.0
+
+    weather_data['temperature'] = 'hot'
+    with pytest.raises(ValueError):
+        clean_weather(weather_data)
+
+
+@pytest.mark.django_db
+def test_subscription_schedule_follows_frequency(create_user, create_city, create_subscription):
+    subscription = create_subscription(create_user(email='user@example.com'), create_city('Kyiv'), 5)
+    assert subscription.next_notification_at - subscription.last_info_update == \
+           pytest.approx(timedelta(hours=5), abs=timedelta(seconds=1))
+
+    subscription.notification_frequency = 1
+    subscription.save()
+    assert subscription.next_notification_at - timezone.now() < timedelta(hours=1)
+
+
+@pytest.mark.django_db
+def test_update_subscriptions_table_sends_only_due(create_user, create_city, create_subscription,
+                                                   django_assert_max_num_queries):
+    user = create_user(email='user@example.com')
+    due = create_subscription(user, create_city('Kyiv'))
+    create_subscription(user, create_city('Lviv'))
+    UserSubscription.objects.filter(pk=due.pk).update(next_notification_at=timezone.now() - timedelta(minutes=1))
+
+    with django_assert_max_num_queries(14):  # the weather, and enqueue, claim and finish in the outbox with savepoints
+        report = update_subscriptions_table()
+
+    assert report['sent'] == 1
+    assert len(mail.outbox) == 1
+    assert mail.outbox[0].to == [user.email]
+    due.refresh_from_db()
+    assert due.next_notification_at > timezone.now() + timedelta(hours=1)
+
+
+@pytest.mark.django_db
+def test_reports_do_not_use_process_local_weather_snapshots(create_user, create_city, create_subscription):
+    kyiv = create_city('Kyiv')
+    create_subscription(create_user(email='user@example.com'), kyiv)
+    UserSubscription.objects.update(next_notification_at=timezone.now() - timedelta(minutes=1))
+    assert get_city_weather(kyiv.pk)['weather_description'] == 'unknown'  # cached by this process
+    CityWeather.objects.update(weather_description='light rain')  # refreshed by another process
+
+    update_subscriptions_table()
+
+    assert 'light rain' in mail.outbox[0].alternatives[0][0]
+
+
+@pytest.mark.django_db
+def test_reports_read_weather_snapshots_from_a_shared_cache(settings, tmp_path, create_user, create_city,
+                                                            create_subscription):
+    settings.CACHES = {**settings.CACHES, settings.WEATHER_CACHE_ALIAS: {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': str(tmp_path),
+    }}
+    kyiv = create_city('Kyiv')
+    create_subscription(create_user(email='user@example.com'), kyiv)
+    CityWeather.objects.update(weather_description='light rain')
+    store_snapshots(CityWeather.objects.all())  # rewritten by the refresh, in whichever process ran it
+    UserSubscription.objects.update(next_notification_at=timezone.now() - timedelta(minutes=1))
+    hits = cache_stats()['snapshot_hits']
+
+    update_subscriptions_table()
+
+    assert cache_stats()['snapshot_hits'] == hits + 1
+    assert 'light rain' in mail.outbox[0].alternatives[0][0]
+
+
+@pytest.mark.django_db
+def test_update_subscriptions_table_renders_each_city_once(create_user, create_city, create_subscription):
+    kyiv, lviv = create_city('Kyiv'), create_city('Lviv')
+    for i in range(3):
+        create_subscription(create_user(email=f'kyiv-{i}@example.com'), kyiv)
+    create_subscription(create_user(email='lviv@example.com'), lviv)
+    UserSubscription.objects.update(next_notification_at=timezone.now() - timedelta(minutes=1))
+
+    report = update_subscriptions_table()
+
+    assert report['sent'] == 4
+    assert report['rendered'] == 2
+    bodies = {message.to[0]: message.alternatives[0][0] for message in mail.outbox}
+    assert bodies['kyiv-0@example.com'] == bodies['kyiv-1@example.com'] == bodies['kyiv-2@example.com']
+    assert 'Kyiv' in bodies['kyiv-0@example.com']
+    assert 'Lviv' in bodies['lviv@example.com']
+
+
+@pytest.mark.django_db
+def test_update_tables_and_send_emails_fans_out(settings, celery_eager, owm_stub, create_user, create_city,
+                                                create_subscription):
+    settings.WEATHER_SHARD_SIZE = 2
+    settings.NOTIFICATION_SHARD_SIZE = 1
+    user = create_user(email='user@example.com')
+    for i in range(5):
+        create_subscription(user, create_city(f'city-{i}'))
+    CityWeather.objects.update(last_info_update=timezone.now() - timedelta(hours=1))
+    UserSubscription.objects.filter(city__name__in=['city-0', 'city-1', 'city-3']) \
+        .update(next_notification_at=timezone.now() - timedelta(minutes=1))
+
+    assert update_tables_and_send_emails.delay().get() == 2
+
+    assert len(owm_stub.requests) == 3
+    assert sorted(message.to[0] for message in mail.outbox) == [user.email] * 3
+    assert not UserSubscription.objects.filter(next_notification_at__lte=timezone.now()).exists()
+
+
+@pytest.mark.django_db
+def test_weather_refresh_skips_cities_nobody_is_due_in(celery_eager, owm_stub, create_user, create_city,
+                                                       create_subscription):
+    user = create_user(email='user@example.com')
+    stale, fresh, later = create_city('Kyiv'), create_city('Lviv'), create_city('Odesa')
+    for city in (stale, fresh, later):
+        create_subscription(user, city)
+    CityWeather.objects.exclude(city=fresh).update(last_info_update=timezone.now() - timedelta(hours=1))
+    UserSubscription.objects.exclude(city=later).update(next_notification_at=timezone.now() - timedelta(minutes=1))
+
+    assert plan_weather_refresh(timezone.now()) == ([stale.weather.get().pk], [fresh.weather.get().pk], 2)
+
+    update_tables_and_send_emails.delay().get()
+
+    assert [query['q'] for _, query in owm_stub.requests] == ['Kyiv,,UA']
+    assert len(mail.outbox) == 2
+    assert CityWeather.objects.get(city=later).last_info_update < timezone.now() - timedelta(minutes=30)
+
+
+@pytest.mark.parametrize('unused_count', [1, 20])
+@pytest.mark.django_db
+def test_delete_unused_cities(create_user, create_city, create_subscription, django_assert_max_num_queries,
+                              unused_count):
+    create_subscription(create_user(email='user@example.com'), create_city('Kyiv'))
+    for i in range(unused_count):
+        create_city(f'city-{i}')
+
+    with django_assert_max_num_queries(8):  # includes one DELETE per history table
+        delete_unused_cities()
+
+    assert list(CityName.objects.values_list('name', flat=True)) == ['Kyiv']
+    assert CityWeather.objects.count() == 1
@@ -3,6 +3,9 @@ import json
 
 from django.urls import reverse
 
+from weather.models import CityName, UserSubscription
+from weather.tasks import remove_unused_cities
+
 
 @pytest.mark.django_db(reset_sequences=True)
 def test_new_subscription(api_client_with_authenticated_user):
@@ -20,6 +23,7 @@ def test_new_subscription(api_client_with_authenticated_user):
     response_json = json.loads(response.content)
     assert response.status_code == 201
     assert response_json['res'] == 'New subscription created successfully'
+    assert CityName.objects.get(name='Kharkiv').owm_id is not None
 
 
 @pytest.mark.django_db(reset_sequences=True)
@@ -60,6 +64,24 @@ def test_new_subscription_already_subscribed(api_client_with_authenticated_user,
     assert response_json['error'] == 'You are already subscribed to this city. Please, edit an existing subscription'
 
 
+@pytest.mark.django_db(reset_sequences=True)
+def test_new_subscription_resolves_city_case_insensitively(api_client_with_authenticated_user, subscription):
+    url = reverse('new_subscription')
+    data = {
+        "city": {
+            "name": " KYIV ",
+            "state": "",
+            "country_code": "ua"
+        },
+        "notification_frequency": 2
+    }
+
+    response = api_client_with_authenticated_user.post(url, data, format='json')
+    assert response.status_code == 400
+    assert CityName.objects.count() == 1
+    assert CityName.objects.get().key == 'kyiv||ua'
+
+
 @pytest.mark.django_db(reset_sequences=True)
 def test_get_subscriptions_list(api_client_with_authenticated_user, subscription):
     url_subscriptions_list = reverse('subscriptions_list')
@@ -70,7 +92,7 @@ def test_get_subscriptions_list(api_client_with_authenticated_user, subscription
     response = api_client_with_authenticated_user.get(url_subscriptions_list)
     response_json = json.loads(response.content)
     assert response.status_code == 200
-    assert response_json == subscriptions_list
+    assert response_json['results'] == subscriptions_list
 
 
 @pytest.mark.django_db(reset_sequences=True)
@@ -99,7 +121,7 @@ def test_edit_subscription(api_client_with_authenticated_user, subscription):
     response = api_client_with_authenticated_user.get(url_subscriptions_list)
     response_json = json.loads(response.content)
     data['id'] = 1
-    assert data in response_json
+    assert data in response_json['results']
 
 
 @pytest.mark.django_db(reset_sequences=True)
@@ -118,3 +140,149 @@ def test_delete_subscription_fail(api_client_with_authenticated_user, subscripti
     response_json = json.loads(response.content)
     assert response.status_code == 404
     assert response_json['res'] == "Subscription with id=2 does not exist for this user"
+
+
+@pytest.mark.parametrize('subscriptions_count', [1, 10, 100])
+@pytest.mark.django_db
+def test_get_subscriptions_list_query_count(api_client_with_authenticated_user, django_user_model, create_city,
+                                            create_subscription, django_assert_num_queries, subscriptions_count):
+    user = django_user_model.objects.get(email='test_user@example.com')
+    for i in range(subscriptions_count):
+        create_subscription(user, create_city(f'city-{i}'))
+
+    with django_assert_num_queries(1):
+        response = api_client_with_authenticated_user.get(reverse('subscriptions_list'), {'page_size': 100})
+
+    assert response.status_code == 200
+    assert len(response.json()['results']) == subscriptions_count
+    assert response.json()['results'][-1]['city'] == {'name': f'city-{subscriptions_count - 1}', 'state': '',
+                                           'country_code': 'UA'}
+
+
+@pytest.mark.django_db
+def test_get_subscriptions_list_pages(api_client_with_authenticated_user, django_user_model, create_city,
+                                      create_subscription):
+    user = django_user_model.objects.get(email='test_user@example.com')
+    for i in range(5):
+        create_subscription(user, create_city(f'city-{i}'))
+
+    ids = []
+    url = reverse('subscriptions_list') + '?page_size=2'
+    while url:
+        response_json = api_client_with_authenticated_user.get(url).json()
+        ids += [subscription['id'] for subscription in response_json['results']]
+        url = response_json['next']
+
+    assert len(ids) == 5
+    assert ids == sorted(ids)
+
+
+@pytest.mark.django_db
+def test_get_subscriptions_list_fields_and_include(api_client_with_authenticated_user, subscription,
+                                                   django_assert_num_queries):
+    url = reverse('subscriptions_list')
+
+    with django_assert_num_queries(1):
+        response = api_client_with_authenticated_user.get(url, {'fields': 'id,weather', 'include': 'weather'})
+
+    result = response.json()['results'][0]
+    assert set(result) == {'id', 'weather'}
+    assert result['weather']['weather_description']
+
+    response = api_client_with_authenticated_user.get(url, {'include': 'user'})
+    assert response.status_code == 400
+
+
+@pytest.mark.django_db(reset_sequences=True)
+def test_bulk_create_subscriptions(api_client_with_authenticated_user, subscription, owm_stub):
+    owm_stub.reset()
+    url = reverse('bulk_subscriptions')
+    data = {
+        "subscriptions": [
+            {"city": {"name": "Lviv", "state": "", "country_code": "UA"}, "notification_frequency": 3},
+            {"city": {"name": "Kyiv", "state": "", "country_code": "UA"}, "notification_frequency": 3},
+            {"city": {"name": "wrong-city", "state": "", "country_code": "UA"}, "notification_frequency": 3},
+            {"city": {"name": "Odesa", "state": "", "country_code": "UA"}, "notification_frequency": 12},
+            {"city": {"name": "Odesa", "state": "", "country_code": "UA"}},
+        ]
+    }
+
+    response = api_client_with_authenticated_user.post(url, data, format='json')
+    results = response.json()['results']
+
+    assert response.status_code == 207
+    assert [result['status'] for result in results] == ['created', 'error', 'error', 'created', 'error']
+    assert results[2]['error'] == 'city not found'
+    assert len(owm_stub.requests) == 3  # Kyiv is already stored and not validated again
+
+    response = api_client_with_authenticated_user.get(reverse('subscriptions_list'))
+    cities = [subscription['city']['name'] for subscription in response.json()['results']]
+    assert cities == ['Kyiv', 'Lviv', 'Odesa']
+
+
+@pytest.mark.django_db(reset_sequences=True)
+def test_bulk_update_and_delete_subscriptions(api_client_with_authenticated_user, subscription):
+    url = reverse('bulk_subscriptions')
+
+    response = api_client_with_authenticated_user.put(url, {"subscriptions": [
+        {"id": 1, "notification_frequency": 6},
+        {"id": 2, "notification_frequency": 6},
+    ]}, format='json')
+    assert response.status_code == 207
+    assert [result['status'] for result in response.json()['results']] == ['updated', 'error']
+
+    response = api_client_with_authenticated_user.put(url, {"subscriptions": [
+        {"id": True, "notification_frequency": 3},
+        {"id": "1", "notification_frequency": 3},
+        {"id": 1, "notification_frequency": 2.7},
+        {"id": 1},
+        [1, 3],
+    ]}, format='json')
+    assert response.status_code == 207
+    assert [set(result['errors']) for result in response.json()['results']] == \
+        [{'id'}, {'id'}, {'notification_frequency'}, {'notification_frequency'}, {'non_field_errors'}]
+
+    response = api_client_with_authenticated_user.get(reverse('subscriptions_list'))
+    assert response.json()['results'][0]['notification_frequency'] == 6
+
+    response = api_client_with_authenticated_user.delete(url, {"ids": [{"a": 1}, True, "1"]}, format='json')
+    assert response.status_code == 207
+    assert response.json()['results'] == [{'status': 'error', 'error': '"id" must be an integer'}] * 3
+    assert UserSubscription.objects.filter(pk=1).exists()
+
+    response = api_client_with_authenticated_user.delete(url, {"ids": [1]}, format='json')
+    assert response.status_code == 200
+    assert response.json()['results'] == [{'status': 'deleted', 'id': 1}]
+
+    response = api_client_with_authenticated_user.post(url, {"subscriptions": []}, format='json')
+    assert response.status_code == 400
+
+
+@pytest.mark.django_db(reset_sequences=True)
+def test_delete_subscription_deferred_cleanup(settings, celery_eager, api_client_with_authenticated_user,
+                                              subscription):
+    settings.CITY_CLEANUP_DEFERRED = True
+    url = reverse('subscription_action', kwargs={'id': 1})
+
+    response = api_client_with_authenticated_user.delete(url)
+
+    assert response.status_code == 200
+    assert CityName.objects.filter(name='Kyiv').exists()
+    remove_unused_cities.delay()
+    assert not CityName.objects.filter(name='Kyiv').exists()
+
+
+@pytest.mark.django_db
+def test_new_subscription_rejects_invalid_body_before_owm(api_client_with_authenticated_user, owm_stub):
+    url = reverse('new_subscription')
+    data = {"city": {"name": "Kyiv", "country_code": "UKR"}, "notification_frequency": "often"}
+
+    response = api_client_with_authenticated_user.post(url, data, format='json')
+
+    assert response.status_code == 400
+    assert response.json()['errors'] == {
+        'city': {'state': ['This field is required.'],
+                 'country_code': ['Ensure this field has no more than 2 characters.']},
+        'notification_frequency': ['A valid integer is required.'],
+    }
+    assert owm_stub.requests == []
@@ -1,7 +1,7 @@
 from django.urls import path, include
 from drf_spectacular.views import SpectacularAPIView, SpectacularSwaggerView
 
-from . import views
+from . import async_views, views
 
 
 urlpatterns = [
@@ -11,5 +11,14 @@ urlpatterns = [
     path('auth/', include('users.urls')),
     path('subscriptions/all/', views.UserSubscriptionsView.as_view(), name='subscriptions_list'),
     path('subscriptions/new/', views.NewSubscriptionView.as_view(), name='new_subscription'),
+    path('subscriptions/new/coordinates/', views.NewSubscriptionByCoordinatesView.as_view(),
+         name='new_subscription_by_coordinates'),
+    path('subscriptions/bulk/', views.BulkSubscriptionsView.as_view(), name='bulk_subscriptions'),
     path('subscriptions/<int:id>/', views.SubscriptionActionsView.as_view(), name='subscription_action'),
+    path('subscriptions/<int:id>/alerts/', views.SubscriptionAlertsView.as_view(), name='subscription_alerts'),
+    path('subscriptions/<int:id>/alerts/<int:rule_id>/', views.AlertRuleView.as_view(), name='alert_rule'),
+    path('cities/<int:id>/history/', views.CityHistoryView.as_view(), name='city_history'),
+    path('async/subscriptions/new/', async_views.AsyncNewSubscriptionView.as_view(), name='new_subscription_async'),
+    path('async/subscriptions/<int:id>/', async_views.AsyncSubscriptionActionsView.as_view(),
+         name='subscription_action_async'),
 ]
@@ -0,0 +1,82 @@
+from rest_framework import serializers
+from rest_framework.fields import SkipField, empty
+
+from .models import AlertRule
+
+
+class Schema:
+    """
+    Request body schema built once at import time: field name -> DRF field or nested Schema.
+
+    validate() runs the fields' own validation, so values and error messages are the same as with a
+    serializer, but nothing is instantiated per request and no model introspection or database query happens.
+    Uniqueness is left to the database constraints.
+    """
+
+    def __init__(self, required=True, **fields):
+        self.required = required
+        self.fields = fields
+
+    def validate(self, data, partial=False):
+        """Returns (validated_data, errors); errors is empty if the data is valid."""
+        if not isinstance(data, dict):
+            return None, {'non_field_errors': [f"Invalid data. Expected a dictionary, but got "
+                                               f"{type(data).__name__}."]}
+        validated = {}
+        errors = {}
+        for name, field in self.fields.items():
+            value = data.get(name, empty)
+            if value is empty and partial:
+                continue
+            try:
+                validated[name] = field.run_validation(value)
+            except SkipField:
+                pass
+            except serializers.ValidationError as e:
+                errors[name] = e.detail
+        return validated, errors
+
+    def run_validation(self, data=empty):
+        """Validates the schema as a nested field."""
+        if data is empty:
+            if self.required:
+                raise serializers.ValidationError(['This field is required.'])
+            raise SkipField()
+        validated, errors = self.validate(data)
+        if errors:
+            raise serializers.ValidationError(errors)
+        return validated
+
+
+CITY_SCHEMA = Schema(
+    name=serializers.CharField(max_length=150),
+    state=serializers.CharField(max_length=150, allow_blank=True),
+    country_code=serializers.CharField(max_length=2),
+)
+
+NEW_SUBSCRIPTION_SCHEMA = Schema(
+    city=CITY_SCHEMA,
+    notification_frequency=serializers.IntegerField(),
+)
+
+COORDINATES_SUBSCRIPTION_SCHEMA = Schema(
+    latitude=serializers.FloatField(min_value=-90, max_value=90),
+    longitude=serializers.FloatField(min_value=-180, max_value=180),
+    notification_frequency=serializers.IntegerField(),
+)
+
+BULK_UPDATE_SCHEMA = Schema(
+    id=serializers.IntegerField(),
+    notification_frequency=serializers.IntegerField(),
+)
+
+EDIT_SUBSCRIPTION_SCHEMA = Schema(
+    city=CITY_SCHEMA,
+    notification_frequency=serializers.IntegerField(required=False),
+)
+
+ALERT_RULE_SCHEMA = Schema(
+    field=serializers.ChoiceField(choices=AlertRule.FIELDS),
+    operator=serializers.ChoiceField(choices=AlertRule.OPERATORS),
+    threshold=serializers.FloatField(),
+)
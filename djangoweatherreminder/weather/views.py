@@ -1,85 +1,81 @@
+from datetime import timedelta, timezone as dt_timezone
+
 from rest_framework import status
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
-from drf_spectacular.utils import extend_schema
-import requests
-import json
-
-from .models import CityName, CityWeather, UserSubscription
-from .serializers import CityNameSerializer, CityWeatherSerializer, UserSubscriptionSerializer, \
-    OneSubscriptionSerializer
-
-from dotenv import load_dotenv
-import os
-
-load_dotenv()
-
-
-def get_weather(city_data):
-    OWM_TOKEN = os.environ.get('OWM_TOKEN')
-    url = f"https://api.openweathermap.org/data/2.5/weather?q={city_data['name']},{city_data['state']}," \
-          f"{city_data['country_code']}&appid={OWM_TOKEN}&units=metric"
-    weather_resp = requests.get(url).json()
-
-    if weather_resp['cod'] != 200:
-        res = {'message': weather_resp['message']}
-        code = weather_resp['cod']
-    else:
-        res = {
-            'weather_description': weather_resp['weather'][0]['description'],
-            'temperature': weather_resp['main']['temp'],
-            'feels_like': weather_resp['main']['feels_like'],
-            'humidity': weather_resp['main']['humidity'],
-            'pressure': weather_resp['main']['pressure'],
-            'visibility': weather_resp['visibility'],
-            'wind_speed': weather_resp['wind']['speed'],
-            'clouds': weather_resp.get('clouds', {}).get('all', 0),
-            'rain': weather_resp.get('rain', {}).get('1h', 0),
-            'snow': weather_resp.get('snow', {}).get('1h', 0),
-        }
-        code = 200
-
-    return res, code
-
-
-def validate_serializer(serializer, error_message):
-    if serializer.is_valid():
-        serializer.save()
-    else:
-        return Response({'errors': serializer.errors,
-                         'message': error_message},
-                        status=status.HTTP_400_BAD_REQUEST)
+from drf_spectacular.utils import OpenApiParameter, extend_schema
+from django.conf import settings
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import AlertRule, CityName, CityWeather, UserSubscription
+from .serializers import AlertRuleSerializer, CityNameSerializer, OneSubscriptionSerializer, \
+    SubscriptionListSerializer
+from .bulk import bulk_create_subscriptions, bulk_delete_subscriptions, bulk_update_subscriptions
+from .cache import get_weather_or_snapshot
+from .history import RESOLUTIONS, city_history
+from .owm import get_weather_at
+from .pagination import SubscriptionCursorPagination
+from .persistence import clean_weather
+from .snapshots import get_city_weather
+from .tasks import delete_unused_cities
+from .validation import ALERT_RULE_SCHEMA, COORDINATES_SUBSCRIPTION_SCHEMA, EDIT_SUBSCRIPTION_SCHEMA, \
+    NEW_SUBSCRIPTION_SCHEMA
+
+
+def get_city_weather_id(city, weather_data):
+    """
+    Id of the CityWeather row of `city`, created from freshly fetched `weather_data` if the city has none yet.
+    Raises ValueError if that weather is malformed.
+    """
+    snapshot = get_city_weather(city.pk)
+    if snapshot is not None:
+        return snapshot['id']
+    city_weather, _ = CityWeather.objects.get_or_create(city=city, defaults=clean_weather(weather_data))
+    return city_weather.pk
 
 
 def remove_unused_entries():
-    cities = CityName.objects.all()
-    for city in cities:
-        city_subscriptions = city.subscriptions.all()
-        if not city_subscriptions:
-            city.delete()
+    if not settings.CITY_CLEANUP_DEFERRED:  # otherwise the remove_unused_cities periodic task takes care of it
+        delete_unused_cities()
 
 
 class UserSubscriptionsView(APIView):
     permission_classes = (IsAuthenticated,)
-
-    @extend_schema(description='### Get the list of all your subscriptions',
+    pagination_class = SubscriptionCursorPagination
+
+    @extend_schema(description='### Get the list of all your subscriptions</br></br>'
+                               'The list is paginated with a cursor: follow the "next" link to get the next page, '
+                               '"page_size" sets the number of subscriptions per page.</br>'
+                               '"fields": comma-separated list of fields to return, e.g. <em>fields=id,city</em>.'
+                               '</br>'
+                               '"include": comma-separated list of expansions. <em>include=weather</em> adds the '
+                               'current weather in the city.',
+                   parameters=[
+                       OpenApiParameter('fields', str, description='fields to return'),
+                       OpenApiParameter('include', str, enum=SubscriptionListSerializer.expandable_fields,
+                                        description='expansions to add'),
+                       OpenApiParameter('page_size', int, description='subscriptions per page'),
+                   ],
+                   responses=SubscriptionListSerializer(many=True),
                    tags=['subscriptions'], )
     def get(self, request):
-        user = request.user
-        subscriptions = user.subscriptions
-        serializer = UserSubscriptionSerializer(subscriptions, many=True)
-        for subscriprion in serializer.data:
-            subscriprion.pop('user')
-            subscriprion.pop('weather_info')
-            subscriprion.pop('last_info_update')
+        fields = [name for name in request.query_params.get('fields', '').split(',') if name]
+        include = [name for name in request.query_params.get('include', '').split(',') if name]
+        unknown = [name for name in fields if name not in SubscriptionListSerializer.Meta.fields] + \
+                  [name for name in include if name not in SubscriptionListSerializer.expandable_fields]
+        if unknown:
+            return Response({'error': f"Unknown fields: {', '.join(unknown)}"}, status=status.HTTP_400_BAD_REQUEST)
 
-            city_id = subscriprion['city']
-            city = CityName.objects.get(id=city_id)
-            city_info = CityNameSerializer(city)
-            subscriprion['city'] = city_info.data
+        subscriptions = UserSubscription.objects.filter(user=request.user).select_related('city')
+        if 'weather' in include:
+            subscriptions = subscriptions.select_related('weather_info')
 
-        return Response(serializer.data)
+        paginator = self.pagination_class()
+        page = paginator.paginate_queryset(subscriptions, request, view=self)
+        serializer = SubscriptionListSerializer(page, many=True, fields=fields, include=include)
+        return paginator.get_paginated_response(serializer.data)
 
 
 class NewSubscriptionView(APIView):
@@ -94,53 +90,90 @@ class NewSubscriptionView(APIView):
                                ' "notification_frequency": measured in hours.',
                    tags=['subscriptions'], )
     def post(self, request):
-
-        request_body = json.loads(request.body)
-
-        city_data = request_body['city']
-
-        weather_data, code = get_weather(city_data)
+        data, errors = NEW_SUBSCRIPTION_SCHEMA.validate(request.data)
+        if errors:
+            return Response({'errors': errors,
+                             'message': "subscription errors:"},
+                            status=status.HTTP_400_BAD_REQUEST)
+        city_data = data['city']
+
+        weather_data, code = get_weather_or_snapshot(city_data)
         if code != 200:
             return Response({'error': weather_data['message'],
                              'code': code},
-                            status=status.HTTP_404_NOT_FOUND)
+                            status=status.HTTP_503_SERVICE_UNAVAILABLE if code == 503 else status.HTTP_404_NOT_FOUND)
+
+        subscription_city, _ = CityName.objects.resolve(city_data, location=weather_data.get('location'))
+        if subscription_city.subscriptions.filter(user=request.user).exists():
+            return Response({'error': 'You are already subscribed to this city. '
+                                      'Please, edit an existing subscription'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            weather_info_id = get_city_weather_id(subscription_city, weather_data)
+        except ValueError as e:
+            return Response({'error': str(e), 'code': 502}, status=status.HTTP_502_BAD_GATEWAY)
+
+        UserSubscription.objects.create(user=request.user, city=subscription_city, weather_info_id=weather_info_id,
+                                        notification_frequency=data['notification_frequency'])
+        return Response({'res': 'New subscription created successfully'}, status=status.HTTP_201_CREATED)
+
+
+class NewSubscriptionByCoordinatesView(APIView):
+    permission_classes = (IsAuthenticated,)
 
+    @staticmethod
+    def get_city_at(latitude, longitude):
+        """
+        The city to subscribe to at these coordinates and its weather id: the nearest known city within
+        CITY_MATCH_RADIUS_KM, without a call to OWM, or else the city OWM finds there. Returns (city, weather id,
+        error response).
+        """
+        city = CityName.objects.nearest(latitude, longitude)
+        snapshot = get_city_weather(city.pk) if city is not None else None
+        if snapshot is not None:
+            return city, snapshot['id'], None
+
+        if city is None:
+            weather_data, code = get_weather_at(latitude, longitude)
         else:
-            if not CityName.objects.filter(name=city_data['name'],
-                                           state=city_data['state'],
-                                           country_code=city_data['country_code']).exists():
-                city_serializer = CityNameSerializer(data=city_data)
-                validate_serializer(city_serializer, error_message="city_serializer errors:")
-
-            subscription_city = CityName.objects.get(name=city_data['name'],
-                                                     state=city_data['state'],
-                                                     country_code=city_data['country_code'])
-
-            if subscription_city.subscriptions.filter(user=request.user).exists():
-                return Response({'error': 'You are already subscribed to this city. '
-                                          'Please, edit an existing subscription'},
-                                status=status.HTTP_400_BAD_REQUEST)
-
-            if not CityWeather.objects.filter(city=subscription_city).exists():
-                weather_data['city'] = subscription_city.pk
-                city_weather_serializer = CityWeatherSerializer(data=weather_data)
-                validate_serializer(city_weather_serializer, error_message="city_weather_serializer errors:")
-
-            subscription_weather = CityWeather.objects.get(city=subscription_city.pk)
-
-            subscription_data = {
-                'user': request.user.pk,
-                'city': subscription_city.pk,
-                'weather_info': subscription_weather.pk,
-                'notification_frequency': request_body['notification_frequency'],
-            }
-
-            subscription_serializer = UserSubscriptionSerializer(data=subscription_data)
-            if subscription_serializer.is_valid():
-                subscription_serializer.save()
-                return Response({'res': 'New subscription created successfully'}, status=status.HTTP_201_CREATED)
-            else:
-                return Response(subscription_serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+            weather_data, code = get_weather_or_snapshot(CityNameSerializer(city).data)
+        if code != 200:
+            return None, None, Response({'error': weather_data['message'], 'code': code},
+                                        status=status.HTTP_503_SERVICE_UNAVAILABLE if code == 503
+                                        else status.HTTP_404_NOT_FOUND)
+        if city is None:
+            city, _ = CityName.objects.resolve(weather_data.pop('city'), location=weather_data.get('location'))
+        try:
+            return city, get_city_weather_id(city, weather_data), None
+        except ValueError as e:
+            return None, None, Response({'error': str(e), 'code': 502}, status=status.HTTP_502_BAD_GATEWAY)
+
+    @extend_schema(description='### Subscribe to the city at your location.</br></br>'
+                               '"latitude", "longitude": coordinates in degrees. You are subscribed to the nearest '
+                               'known city within a few kilometers, or to the city OpenWeatherMap finds there.</br>'
+                               '"notification_frequency": measured in hours.',
+                   tags=['subscriptions'], )
+    def post(self, request):
+        data, errors = COORDINATES_SUBSCRIPTION_SCHEMA.validate(request.data)
+        if errors:
+            return Response({'errors': errors,
+                             'message': "subscription errors:"},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        subscription_city, weather_info_id, error = self.get_city_at(data['latitude'], data['longitude'])
+        if error:
+            return error
+        if subscription_city.subscriptions.filter(user=request.user).exists():
+            return Response({'error': 'You are already subscribed to this city. '
+                                      'Please, edit an existing subscription'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        UserSubscription.objects.create(user=request.user, city=subscription_city, weather_info_id=weather_info_id,
+                                        notification_frequency=data['notification_frequency'])
+        return Response({'res': 'New subscription created successfully',
+                         'city': CityNameSerializer(subscription_city).data},
+                        status=status.HTTP_201_CREATED)
 
 
 class SubscriptionActionsView(APIView):
@@ -150,11 +183,8 @@ class SubscriptionActionsView(APIView):
         if self.request.method == 'PUT':
             return OneSubscriptionSerializer
 
-    def get_usersubscription_object(self, subscription_id):
-        try:
-            return UserSubscription.objects.get(id=subscription_id)
-        except UserSubscription.DoesNotExist:
-            return None
+    def get_usersubscription_object(self, user, subscription_id):
+        return UserSubscription.objects.filter(id=subscription_id, user=user).first()
 
     @extend_schema(description='### Write new updated information about your subscription.</br></br>'
                                '"city": name of the city you subscribe to.</br>'
@@ -164,73 +194,203 @@ class SubscriptionActionsView(APIView):
                                '"notification_frequency": measured in hours.',
                    tags=['subscriptions'], )
     def put(self, request, id):
-        user = request.user
-        user_subscriptions = user.subscriptions.all()
-        subscription = self.get_usersubscription_object(subscription_id=id)
-        if not subscription or subscription not in user_subscriptions:
+        subscription = self.get_usersubscription_object(user=request.user, subscription_id=id)
+        if not subscription:
             return Response({"res": f"Subscription with id={id} does not exist for this user"},
                             status=status.HTTP_400_BAD_REQUEST,
                             )
-        else:
-            request_body = json.loads(request.body)
-            city_data = request_body['city']
-
-            weather_data, code = get_weather(city_data)
-            if code != 200:
-                return Response({'error': weather_data['message'],
-                                 'code': code},
-                                status=status.HTTP_400_BAD_REQUEST)
-            else:
-                # if any field about city has changed
-                if not CityName.objects.filter(name=city_data['name'],
-                                               state=city_data['state'],
-                                               country_code=city_data['country_code']).exists():
-                    city_serializer = CityNameSerializer(data=city_data)
-                    validate_serializer(city_serializer, error_message="city_serializer errors:")
-
-                subscription_city = CityName.objects.get(name=city_data['name'],
-                                                         state=city_data['state'],
-                                                         country_code=city_data['country_code'])
-
-                if not CityWeather.objects.filter(city=subscription_city).exists():
-                    weather_data['city'] = subscription_city.pk
-                    city_weather_serializer = CityWeatherSerializer(data=weather_data)
-                    validate_serializer(city_weather_serializer, error_message="city_weather_serializer errors:")
-
-                subscription_weather = CityWeather.objects.get(city=subscription_city.pk)
-
-                new_subscription_data = {
-                    'user': request.user.pk,
-                    'city': subscription_city.pk,
-                    'weather_info': subscription_weather.pk,
-                    'notification_frequency': request_body.get('notification_frequency',
-                                                               subscription.notification_frequency),
-                }
-
-                subscription_serializer = UserSubscriptionSerializer(instance=subscription, data=new_subscription_data,
-                                                                     partial=True)
-                if subscription_serializer.is_valid():
-                    subscription_serializer.save()
-                    remove_unused_entries()  # remove cities that nobody is subscribed for
-                    return Response({"res": "Subscription edited"}, status=status.HTTP_200_OK)
-                else:
-                    return Response({"res": subscription_serializer.errors}, status=status.HTTP_400_BAD_REQUEST)
+
+        data, errors = EDIT_SUBSCRIPTION_SCHEMA.validate(request.data)
+        if errors:
+            return Response({'errors': errors,
+                             'message': "subscription errors:"},
+                            status=status.HTTP_400_BAD_REQUEST)
+        city_data = data['city']
+
+        weather_data, code = get_weather_or_snapshot(city_data)
+        if code != 200:
+            return Response({'error': weather_data['message'],
+                             'code': code},
+                            status=status.HTTP_503_SERVICE_UNAVAILABLE if code == 503
+                            else status.HTTP_400_BAD_REQUEST)
+
+        # if any field about city has changed, this resolves to another city
+        subscription_city, _ = CityName.objects.resolve(city_data, location=weather_data.get('location'))
+        try:
+            weather_info_id = get_city_weather_id(subscription_city, weather_data)
+        except ValueError as e:
+            return Response({'error': str(e), 'code': 502}, status=status.HTTP_502_BAD_GATEWAY)
+
+        subscription.city = subscription_city
+        subscription.weather_info_id = weather_info_id
+        subscription.notification_frequency = data.get('notification_frequency', subscription.notification_frequency)
+        subscription.save()
+        remove_unused_entries()  # remove cities that nobody is subscribed for
+        return Response({"res": "Subscription edited"}, status=status.HTTP_200_OK)
 
     @extend_schema(description='### Specify the id of the subscription you want to delete',
                    tags=['subscriptions'], )
     def delete(self, request, id):
-        user = request.user
-        user_subscriptions = user.subscriptions.all()
-        subscription = self.get_usersubscription_object(subscription_id=id)
-        if not subscription or subscription not in user_subscriptions:
+        subscription = self.get_usersubscription_object(user=request.user, subscription_id=id)
+        if not subscription:
             return Response({"res": f"Subscription with id={id} does not exist for this user"},
                             status=status.HTTP_404_NOT_FOUND,
                             )
         else:
-            user.subscriptions.remove(subscription)
             subscription.delete()
             remove_unused_entries()  # remove cities that nobody is subscribed for
             return Response(
                 {"res": "Subscription deleted"},
                 status=status.HTTP_200_OK
             )
+
+
+class BulkSubscriptionsView(APIView):
+    permission_classes = (IsAuthenticated,)
+
+    @staticmethod
+    def get_items(request, key):
+        items = request.data.get(key) if isinstance(request.data, dict) else None
+        if not isinstance(items, list) or not items:
+            return None, Response({'error': f'"{key}" must be a non-empty list'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(items) > settings.BULK_SUBSCRIPTIONS_MAX:
+            return None, Response({'error': f'At most {settings.BULK_SUBSCRIPTIONS_MAX} items per request'},
+                                  status=status.HTTP_400_BAD_REQUEST)
+        return items, None
+
+    @staticmethod
+    def results_response(results, done_status, success_code=status.HTTP_200_OK):
+        code = success_code if all(result['status'] == done_status for result in results) \
+            else status.HTTP_207_MULTI_STATUS
+        return Response({'results': results}, status=code)
+
+    @extend_schema(description='### Subscribe to many cities at once.</br></br>'
+                               '"subscriptions": a list of subscriptions, each in the same format as for a new '
+                               'subscription.</br>'
+                               'The response has one result per item, in the same order.',
+                   tags=['subscriptions'], )
+    def post(self, request):
+        entries, error_response = self.get_items(request, 'subscriptions')
+        if error_response:
+            return error_response
+        return self.results_response(bulk_create_subscriptions(request.user, entries), 'created',
+                                     status.HTTP_201_CREATED)
+
+    @extend_schema(description='### Change the notification frequency of many subscriptions at once.</br></br>'
+                               '"subscriptions": a list of <em>{"id": ..., "notification_frequency": ...}</em>.',
+                   tags=['subscriptions'], )
+    def put(self, request):
+        entries, error_response = self.get_items(request, 'subscriptions')
+        if error_response:
+            return error_response
+        return self.results_response(bulk_update_subscriptions(request.user, entries), 'updated')
+
+    @extend_schema(description='### Delete many subscriptions at once.</br></br>'
+                               '"ids": a list of ids of the subscriptions you want to delete.',
+                   tags=['subscriptions'], )
+    def delete(self, request):
+        ids, error_response = self.get_items(request, 'ids')
+        if error_response:
+            return error_response
+        results = bulk_delete_subscriptions(request.user, ids)
+        remove_unused_entries()  # remove cities that nobody is subscribed for
+        return self.results_response(results, 'deleted')
+
+
+class SubscriptionAlertsView(APIView):
+    permission_classes = (IsAuthenticated,)
+
+    @staticmethod
+    def subscription_not_found(id):
+        return Response({"res": f"Subscription with id={id} does not exist for this user"},
+                        status=status.HTTP_400_BAD_REQUEST)
+
+    @extend_schema(description='### Get the alert rules of your subscription',
+                   responses=AlertRuleSerializer(many=True),
+                   tags=['alerts'], )
+    def get(self, request, id):
+        if not UserSubscription.objects.filter(id=id, user=request.user).exists():
+            return self.subscription_not_found(id)
+        rules = AlertRule.objects.filter(subscription_id=id).order_by('pk')
+        return Response(AlertRuleSerializer(rules, many=True).data)
+
+    @extend_schema(description='### Add an alert rule to your subscription</br></br>'
+                               'You get an email as soon as the weather in the city meets the rule, e.g. '
+                               '<em>{"field": "rain", "operator": "gt", "threshold": 0}</em>, and again only after '
+                               'it stopped meeting it in between.</br>'
+                               '"field": one of ' + ', '.join(AlertRule.FIELDS) + '.</br>'
+                               '"operator": lt, lte, gt or gte.',
+                   tags=['alerts'], )
+    def post(self, request, id):
+        subscription = UserSubscription.objects.filter(id=id, user=request.user).first()
+        if not subscription:
+            return self.subscription_not_found(id)
+        data, errors = ALERT_RULE_SCHEMA.validate(request.data)
+        if errors:
+            return Response({'errors': errors, 'message': "alert rule errors:"}, status=status.HTTP_400_BAD_REQUEST)
+        if subscription.alert_rules.count() >= settings.ALERT_RULES_PER_SUBSCRIPTION:
+            return Response({'error': f"A subscription can have at most {settings.ALERT_RULES_PER_SUBSCRIPTION} "
+                                      f"alert rules"}, status=status.HTTP_400_BAD_REQUEST)
+
+        rule = AlertRule.objects.create(subscription=subscription, **data)
+        return Response(AlertRuleSerializer(rule).data, status=status.HTTP_201_CREATED)
+
+
+class AlertRuleView(APIView):
+    permission_classes = (IsAuthenticated,)
+
+    @extend_schema(description='### Delete an alert rule of your subscription',
+                   tags=['alerts'], )
+    def delete(self, request, id, rule_id):
+        deleted, _ = AlertRule.objects.filter(pk=rule_id, subscription_id=id, subscription__user=request.user).delete()
+        if not deleted:
+            return Response({"res": f"Alert rule with id={rule_id} does not exist for this subscription"},
+                            status=status.HTTP_400_BAD_REQUEST)
+        return Response({"res": "Alert rule deleted"}, status=status.HTTP_200_OK)
+
+
+def parse_time(value, default):
+    """An ISO 8601 query parameter as an aware datetime (UTC if no offset is given). Raises ValueError."""
+    if value is None:
+        return default
+    parsed = parse_datetime(value)
+    if parsed is None:
+        raise ValueError(f"invalid date and time: {value!r}")
+    return parsed if timezone.is_aware(parsed) else timezone.make_aware(parsed, dt_timezone.utc)
+
+
+class CityHistoryView(APIView):
+    permission_classes = (IsAuthenticated,)
+
+    @extend_schema(description='### Get the weather history of a city</br></br>'
+                               '"from", "to": ISO 8601 date and time, the last 7 days by default.</br>'
+                               '"resolution": <em>raw</em> readings, <em>hour</em> or <em>day</em> averages, '
+                               '<em>hour</em> by default. History older than a retention period is only kept as '
+                               'hourly and then daily averages, its points have that period.',
+                   parameters=[
+                       OpenApiParameter('from', str, description='start of the range'),
+                       OpenApiParameter('to', str, description='end of the range, exclusive'),
+                       OpenApiParameter('resolution', str, enum=list(RESOLUTIONS), description='time between points'),
+                   ],
+                   tags=['cities'], )
+    def get(self, request, id):
+        city = CityName.objects.filter(pk=id).first()
+        if not city:
+            return Response({'error': f"City with id={id} does not exist"}, status=status.HTTP_404_NOT_FOUND)
+
+        resolution = request.query_params.get('resolution', 'hour')
+        if resolution not in RESOLUTIONS:
+            return Response({'error': f"Unknown resolution: {resolution}"}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            end = parse_time(request.query_params.get('to'), timezone.now())
+            start = parse_time(request.query_params.get('from'), end - timedelta(days=7))
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        if start >= end:
+            return Response({'error': '"from" must be before "to"'}, status=status.HTTP_400_BAD_REQUEST)
+        if (end - start) / RESOLUTIONS[resolution] > settings.WEATHER_HISTORY_MAX_POINTS:
+            return Response({'error': f"Too many points, use a shorter range or a coarser resolution than "
+                                      f"{resolution}"}, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response({'city': CityNameSerializer(city).data, 'from': start, 'to': end, 'resolution': resolution,
+                         'points': city_history(city.pk, start, end, resolution)})